@@ -0,0 +1,6 @@
+"""
+Helpers shared by the query scripts in this repository.
+
+Query scripts run on Dataproc, so the package has to be shipped alongside them:
+pass ``pyfiles=['../../ancestry_utils']`` to ``dataproc.hail_dataproc_job``.
+"""
@@ -0,0 +1,30 @@
+"""
+Reading and writing NumPy archives on local disk or in cloud storage.
+"""
+
+import io
+import numpy as np
+
+
+def open_file(path, mode):
+    """Open a local path directly, and cloud paths through Hail."""
+    if path.startswith('gs://'):
+        import hail as hl  # pylint: disable=import-outside-toplevel
+
+        return hl.hadoop_open(path, mode)
+    return open(path, mode)  # pylint: disable=consider-using-with
+
+
+def save_arrays(path, **arrays):
+    """Write `arrays` as a compressed NumPy archive."""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    with open_file(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def load_arrays(path):
+    """Read a NumPy archive into a dict of arrays."""
+    with open_file(path, 'rb') as f:
+        with np.load(io.BytesIO(f.read())) as npz:
+            return {key: npz[key] for key in npz.files}
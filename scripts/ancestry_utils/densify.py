@@ -0,0 +1,143 @@
+"""
+Densify-once cache for the sparse TOB-WGS matrix tables.
+
+Densifying the full sparse callset is the most expensive step of most query
+scripts, so the result is written once per callset version and row filter and
+read back by every later job. When a site table is given, only the reference
+blocks that can cover those sites are densified (see `densify_sites`).
+"""
+
+import hashlib
+import json
+import hail as hl
+from ancestry_utils.stages import table_version
+
+DENSIFY_CACHE = 'gs://cpg-tob-wgs-main/densify_cache'
+
+
+def read_sites(sites_path):
+    """Read a site table, or the rows of a matrix table, keyed by locus and alleles."""
+    if sites_path.rstrip('/').endswith('.mt'):
+        sites = hl.read_matrix_table(sites_path).rows()
+    else:
+        sites = hl.read_table(sites_path)
+    return sites.key_by('locus', 'alleles').select()
+
+
+def compute_last_ref_block_end(mt):
+    """
+    For every locus in the sparse `mt`, the smallest start position of a reference
+    block that is still open at that locus, i.e. the first position that has to be
+    read to densify the locus. Loci not covered by any reference block map to
+    themselves.
+    """
+    mt = mt.select_entries('END')
+    t = mt._localize_entries('__entries', '__cols')  # pylint: disable=protected-access
+    t = t.select(
+        last_END_position=hl.or_else(
+            hl.min(
+                hl.scan.array_agg(
+                    lambda entry: hl.scan._prev_nonnull(  # pylint: disable=protected-access
+                        hl.or_missing(
+                            hl.is_defined(entry.END), hl.tuple([t.locus, entry.END])
+                        )
+                    ),
+                    t.__entries,
+                ).map(
+                    lambda x: hl.or_missing(
+                        (x[1] >= t.locus.position) & (x[0].contig == t.locus.contig),
+                        x[0].position,
+                    )
+                )
+            ),
+            t.locus.position,
+        )
+    )
+    # the first row at each locus only sees reference blocks from earlier loci
+    return t.select_globals().key_by('locus').distinct()
+
+
+def last_ref_block_end(mt_path, version=None, cache_dir=DENSIFY_CACHE):
+    """Read the reference block start table for `mt_path`, computed once per version."""
+    mt_path = mt_path.rstrip('/')
+    version = version or table_version(mt_path)
+    digest = hashlib.sha256(f'{mt_path}:{version}'.encode('utf-8')).hexdigest()[:16]
+    callset = mt_path.split('/')[-1].replace('.mt', '')
+    path = f'{cache_dir}/{callset}/last_END_positions_{digest}.ht'
+    if not hl.hadoop_exists(f'{path}/_SUCCESS'):
+        compute_last_ref_block_end(hl.read_matrix_table(mt_path)).write(
+            path, overwrite=True
+        )
+    return hl.read_table(path)
+
+
+def densify_sites(mt, sites_ht, last_end_ht):
+    """
+    Densify the sparse `mt` at the loci in `sites_ht` only. Rows are read from the
+    start of the earliest reference block spanning each site up to the site itself,
+    so the cost scales with the number of sites rather than with the genome.
+    """
+    sites_ht = sites_ht.key_by('locus').select().distinct()
+    sites_ht = sites_ht.annotate(
+        interval=hl.locus_interval(
+            sites_ht.locus.contig,
+            last_end_ht[sites_ht.key].last_END_position,
+            end=sites_ht.locus.position,
+            includes_end=True,
+            reference_genome=sites_ht.locus.dtype.reference_genome,
+        )
+    )
+    # sites without any row in the sparse callset cannot be densified
+    sites_ht = sites_ht.filter(hl.is_defined(sites_ht.interval))
+    mt = hl.filter_intervals(mt, sites_ht.interval.collect())
+    mt = hl.experimental.densify(mt)
+    return mt.filter_rows(hl.is_defined(sites_ht[mt.locus]))
+
+
+def densified_path(mt_path, sites_path=None, version=None, cache_dir=DENSIFY_CACHE):
+    """
+    Cache location of the densified `mt_path`, restricted to `sites_path`. Both
+    versions are part of the key, so rewriting either at the same path densifies
+    again.
+    """
+    mt_path = mt_path.rstrip('/')
+    params = {
+        'mt_path': mt_path,
+        'version': version or table_version(mt_path),
+        'sites_path': sites_path.rstrip('/') if sites_path else None,
+        'sites_version': table_version(sites_path) if sites_path else None,
+    }
+    digest = hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:16]
+    # e.g. gs://.../densify_cache/v7/0123456789abcdef.mt
+    callset = mt_path.split('/')[-1].replace('.mt', '')
+    return f'{cache_dir}/{callset}/{digest}.mt', params
+
+
+def read_densified(mt_path, sites_path=None, version=None, cache_dir=DENSIFY_CACHE):
+    """
+    Read the densified `mt_path` from the cache, densifying and writing it first
+    if no complete cached copy exists. If `sites_path` is given, only rows found in
+    that table (or matrix table) are kept, and only those sites are densified.
+    """
+    path, params = densified_path(mt_path, sites_path, version, cache_dir)
+    if hl.hadoop_exists(f'{path}/_SUCCESS'):
+        print(f'Reading densified matrix table from cache: {path}')
+        return hl.read_matrix_table(path)
+
+    mt = hl.read_matrix_table(params['mt_path']).key_rows_by('locus', 'alleles')
+    if sites_path:
+        sites = read_sites(sites_path)
+        last_end_ht = last_ref_block_end(
+            params['mt_path'], params['version'], cache_dir
+        )
+        mt = densify_sites(mt, sites, last_end_ht)
+        mt = mt.semi_join_rows(sites)
+    else:
+        mt = hl.experimental.densify(mt)
+    mt.write(path, overwrite=True)
+    # record how the cached copy was made, next to it
+    with hl.hadoop_open(path.replace('.mt', '.json'), 'w') as f:
+        json.dump(params, f, indent=2)
+    return hl.read_matrix_table(path)
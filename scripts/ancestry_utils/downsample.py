@@ -0,0 +1,130 @@
+"""
+Deterministic downsampling of variants to an exact number of rows.
+
+Every row gets a 64-bit pseudo-random score hashed from its locus, alleles and
+a seed, and the rows with the smallest scores are kept. Scores do not depend on
+partitioning, so the same seed always selects the same variants. The selection
+counts the rows of each stratum in one aggregation, then collects only the scores
+below a per-stratum bound slightly above the expected threshold in a second, so
+the driver holds little more than the selected scores.
+"""
+
+import hail as hl
+
+MAF_BIN_EDGES = (0.01, 0.05, 0.1, 0.2, 0.3, 0.4)
+
+_BASES = {'A': 1, 'C': 2, 'G': 3, 'T': 4}
+_SCORE_DICT = hl.tdict(hl.tstr, hl.tint64)
+
+
+def _allele_code(allele):
+    """Deterministic integer code of an allele string."""
+    bases = hl.literal(_BASES)
+    return hl.fold(
+        lambda code, i: code * 7 + hl.int64(bases.get(allele[i], 5)),
+        hl.int64(0),
+        hl.range(hl.len(allele)),
+    )
+
+
+def _splitmix64(x):
+    """SplitMix64 finaliser on int64 expressions (multiplication wraps around)."""
+    x = x + hl.int64(-7046029254386353131)
+    x = hl.bit_xor(x, hl.bit_rshift(x, 30, logical=True)) * hl.int64(
+        -4658895280553007687
+    )
+    x = hl.bit_xor(x, hl.bit_rshift(x, 27, logical=True)) * hl.int64(
+        -7723592293110705685
+    )
+    return hl.bit_xor(x, hl.bit_rshift(x, 31, logical=True))
+
+
+def row_score(ht, seed):
+    """Pseudo-random int64 score of each row of a table keyed by locus and alleles."""
+    x = ht.locus.global_position() * hl.int64(1000003)
+    x = hl.bit_xor(x, _allele_code(ht.alleles[0]) * hl.int64(31))
+    x = hl.bit_xor(x, _allele_code(hl.delimit(ht.alleles[1:], ',')))
+    return _splitmix64(hl.bit_xor(x, _splitmix64(hl.int64(seed))))
+
+
+def maf_bin(af_expr, edges=MAF_BIN_EDGES):
+    """
+    Index of the minor allele frequency bin delimited by `edges`, given the
+    alternate allele frequency, so common alternate alleles are binned like the
+    equally common reference alleles.
+    """
+    maf = hl.min(af_expr, 1 - af_expr)
+    return hl.sum(hl.literal(list(edges)).map(lambda edge: hl.int(maf >= edge)))
+
+
+def _allocate(counts, n_rows):
+    """Split `n_rows` across strata in proportion to their sizes (largest remainder)."""
+    total = sum(counts.values())
+    if total <= n_rows:
+        return dict(counts)
+    quotas = {stratum: n_rows * n / total for stratum, n in counts.items()}
+    allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remainder = n_rows - sum(allocation.values())
+    by_remainder = sorted(
+        quotas, key=lambda stratum: (allocation[stratum] - quotas[stratum], stratum)
+    )
+    for stratum in by_remainder[:remainder]:
+        allocation[stratum] += 1
+    return allocation
+
+
+def _score_bound(fraction):
+    """Score below which `fraction` of uniformly distributed int64 scores fall."""
+    return min(int(-(2**63) + fraction * 2**64), 2**63 - 1)
+
+
+def downsample_rows(ht, n_rows, seed=12345, stratum_expr=None):
+    """
+    Exactly `n_rows` rows of `ht` (all rows if there are fewer), keyed by locus and
+    alleles. If `stratum_expr` (e.g. `hl.struct(contig=..., maf_bin=...)`) is given,
+    rows are allocated to strata in proportion to their size and the lowest-scoring
+    rows of each stratum are kept.
+    """
+    # `stratum_expr` is an expression of the caller's `ht`, so annotate both at once
+    ht = ht.annotate(
+        _score=row_score(ht, seed),
+        _stratum='all' if stratum_expr is None else hl.str(stratum_expr),
+    )
+
+    counts = ht.aggregate(hl.agg.counter(ht._stratum))
+    allocation = _allocate(counts, n_rows)
+    print(f'Downsampling to {sum(allocation.values())} rows: {allocation}')
+
+    # scores are uniform, so the lowest `n` of a stratum fall below its
+    # n / count quantile; collect the scores below a bound a few standard
+    # deviations above it, and widen the bound of strata that fall short
+    thresholds = {}
+    margin = 5
+    pending = {stratum: n for stratum, n in allocation.items() if n > 0}
+    while pending:
+        bounds = {
+            stratum: _score_bound((n + margin * (n**0.5 + 10)) / counts[stratum])
+            for stratum, n in pending.items()
+        }
+        scores = ht.aggregate(
+            hl.agg.group_by(
+                ht._stratum,
+                hl.agg.filter(
+                    hl.or_else(
+                        ht._score <= hl.literal(bounds, _SCORE_DICT).get(ht._stratum),
+                        False,
+                    ),
+                    hl.agg.collect(ht._score),
+                ),
+            )
+        )
+        for stratum, n in list(pending.items()):
+            stratum_scores = sorted(scores.get(stratum, []))
+            if len(stratum_scores) >= n:
+                thresholds[stratum] = stratum_scores[n - 1]
+                del pending[stratum]
+        margin *= 2
+
+    # strata without an allocation have no threshold, so the filter drops them
+    ht = ht.filter(ht._score <= hl.literal(thresholds, _SCORE_DICT).get(ht._stratum))
+    return ht.drop('_score', '_stratum')
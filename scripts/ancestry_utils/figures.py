@@ -0,0 +1,70 @@
+"""
+Export of Bokeh figures as HTML and PNG.
+
+`get_screenshot_as_png` starts a new headless browser for every figure unless it
+is given one, and starting the browser takes far longer than the screenshot.
+`export_figures` splits the figures across a few worker threads, each of which
+starts one headless browser and passes it to `get_screenshot_as_png` for its
+share of the figures. The browsers are separate processes, so the screenshots
+run in parallel, while the Hail driver process is not forked. The HTML and PNG
+of every figure are then written together.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from ancestry_utils.arrays import open_file
+
+# headless browsers use a lot of memory, so don't start one per core
+MAX_WORKERS = 4
+
+
+def _screenshot_all(plots, timeout):
+    """PNGs of a list of figures, taken with one browser."""
+    # pylint: disable=import-outside-toplevel
+    from bokeh.io.export import get_screenshot_as_png
+    from bokeh.io.webdriver import webdriver_control
+
+    driver = webdriver_control.create()
+    try:
+        pngs = []
+        for plot in plots:
+            buffer = io.BytesIO()
+            image = get_screenshot_as_png(plot, driver=driver, timeout=timeout)
+            image.save(buffer, format='PNG')
+            pngs.append(buffer.getvalue())
+        return pngs
+    finally:
+        driver.quit()
+
+
+def export_figures(figures, title='my plot', n_workers=None, timeout=30):
+    """
+    Write each figure of `figures`, a dict of output paths without extension
+    (local or gs://) to Bokeh figures, as `<path>.html` and `<path>.png`.
+    Screenshots are taken by `n_workers` threads (by default up to
+    `MAX_WORKERS`), each reusing one headless browser.
+    """
+    # pylint: disable=import-outside-toplevel
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+
+    if not figures:
+        return
+    paths = list(figures)
+    if n_workers is None:
+        n_workers = min(MAX_WORKERS, os.cpu_count() or 1)
+    n_workers = max(1, min(n_workers, len(paths)))
+    chunks = [[figures[path] for path in paths[k::n_workers]] for k in range(n_workers)]
+    with ThreadPoolExecutor(n_workers) as executor:
+        results = list(
+            executor.map(lambda plots: _screenshot_all(plots, timeout), chunks)
+        )
+
+    print(f'Writing {len(paths)} figures with {n_workers} browsers')
+    for k, pngs in enumerate(results):
+        for path, png in zip(paths[k::n_workers], pngs):
+            with open_file(f'{path}.html', 'w') as f:
+                f.write(file_html(figures[path], CDN, title))
+            with open_file(f'{path}.png', 'wb') as f:
+                f.write(png)
@@ -0,0 +1,108 @@
+"""
+Hard calls of biallelic variants as 2-bit packed PLINK files.
+
+`export_genotype_cache` writes `{prefix}.bed`, `{prefix}.bim` (the variant index)
+and `{prefix}.fam` (the sample index) with `hl.export_plink`, which takes a
+quarter of a byte per genotype and no row or column metadata. The .bed file is
+variant-major, and Hail writes the alternate allele as allele 1, so the 2-bit
+codes read as alternate allele dosages 0 -> 2, 1 -> missing, 2 -> 1 and 3 -> 0.
+
+`read_genotype_cache` memory-maps the .bed file, so NumPy stages (PCA, kinship,
+projection) on a single VM only read the variants they ask for. Dosages are
+returned as int8 with -1 for missing calls, as expected by
+`ancestry_utils.projection_model.project_dosages`.
+"""
+
+import numpy as np
+from ancestry_utils.arrays import open_file
+
+BED_MAGIC = bytes([0x6C, 0x1B, 0x01])
+MISSING = -1
+
+# alternate allele dosage of the 2-bit code in each position of every byte value
+_CODE_DOSAGES = np.array([2, MISSING, 1, 0], dtype=np.int8)
+_BYTE_DOSAGES = _CODE_DOSAGES[(np.arange(256)[:, None] >> np.arange(0, 8, 2)) & 3]
+
+
+def export_genotype_cache(mt, prefix):
+    """
+    Write the GT calls of `mt`, which must be biallelic, to `{prefix}.bed/.bim/.fam`
+    with variant IDs `contig:position:ref:alt` and sample IDs `mt.s`, unless they
+    already exist. Returns `prefix`.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    if all(hl.hadoop_exists(f'{prefix}.{ext}') for ext in ('bed', 'bim', 'fam')):
+        print(f'Reading existing genotype cache {prefix}')
+        return prefix
+    hl.export_plink(
+        mt,
+        prefix,
+        call=mt.GT,
+        ind_id=mt.s,
+        varid=hl.variant_str(mt.locus, mt.alleles),
+    )
+    return prefix
+
+
+def download_genotype_cache(prefix, local_prefix):
+    """Copy a genotype cache from cloud storage to local disk, for memory-mapping."""
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    for ext in ('bed', 'bim', 'fam'):
+        hl.hadoop_copy(f'{prefix}.{ext}', f'file://{local_prefix}.{ext}')
+    return local_prefix
+
+
+def _read_columns(path, columns):
+    with open_file(path, 'r') as f:
+        rows = [line.split() for line in f if line.strip()]
+    return {
+        name: np.array([row[k] for row in rows])
+        for k, name in enumerate(columns)
+        if name is not None
+    }
+
+
+def read_genotype_cache(prefix):
+    """
+    Open a local genotype cache. Returns a dict with the sample index (`samples`),
+    the variant index (`contig`, `variant_id`, `position`, `alt`, `ref`) and the
+    memory-mapped .bed matrix (`bed`, variants x packed bytes).
+    """
+    fam = _read_columns(f'{prefix}.fam', (None, 'samples'))
+    bim = _read_columns(
+        f'{prefix}.bim', ('contig', 'variant_id', None, 'position', 'alt', 'ref')
+    )
+    bim['position'] = bim['position'].astype(np.int64)
+    n_samples = len(fam['samples'])
+    bytes_per_variant = (n_samples + 3) // 4
+    with open(f'{prefix}.bed', 'rb') as f:
+        if f.read(3) != BED_MAGIC:
+            raise ValueError(f'{prefix}.bed is not a variant-major PLINK .bed file')
+    bed = np.memmap(
+        f'{prefix}.bed',
+        dtype=np.uint8,
+        mode='r',
+        offset=len(BED_MAGIC),
+        shape=(len(bim['variant_id']), bytes_per_variant),
+    )
+    return {**fam, **bim, 'bed': bed}
+
+
+def dosages(cache, variants=slice(None)):
+    """
+    Alternate allele dosages (int8, -1 if missing) of the `variants` (a slice,
+    index array or boolean mask) of `cache`, as a variants x samples array.
+    """
+    n_samples = len(cache['samples'])
+    packed = np.asarray(cache['bed'][variants])
+    unpacked = _BYTE_DOSAGES[packed].reshape(len(packed), -1)
+    return unpacked[:, :n_samples]
+
+
+def dosage_blocks(cache, block_size=10000):
+    """Yield (start, dosages) for consecutive blocks of `block_size` variants."""
+    n_variants = len(cache['variant_id'])
+    for start in range(0, n_variants, block_size):
+        yield start, dosages(cache, slice(start, min(start + block_size, n_variants)))
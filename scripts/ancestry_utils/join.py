@@ -0,0 +1,153 @@
+"""
+Joining TOB-WGS samples onto the HGDP/1KG dense matrix table.
+"""
+
+import hashlib
+import json
+import hail as hl
+from hail.experimental import lgt_to_gt
+from ancestry_utils.densify import (
+    compute_last_ref_block_end,
+    densify_sites,
+    read_densified,
+    read_sites,
+)
+from ancestry_utils.stages import table_version
+
+GNOMAD_HGDP_1KG_MT = (
+    'gs://gcp-public-data--gnomad/release/3.1/mt/genomes/'
+    'gnomad.genomes.v3.1.hgdp_1kg_subset_dense.mt'
+)
+
+JOIN_CACHE = 'gs://cpg-tob-wgs-main/joint_matrix_cache'
+
+
+def _select_entries(mt, entry_fields):
+    """Select `entry_fields`, converting local genotypes of sparse callsets to GT."""
+    fields = {}
+    for field in entry_fields:
+        if field == 'GT' and 'LGT' in mt.entry:
+            fields['GT'] = lgt_to_gt(mt.LGT, mt.LA)
+        else:
+            fields[field] = mt[field]
+    return mt.select_entries(**fields)
+
+
+def joint_matrix_path(
+    tob_wgs_path,
+    hgdp_1kg_path=GNOMAD_HGDP_1KG_MT,
+    sites_path=None,
+    entry_fields=('GT',),
+    n_partitions=None,
+    checkpoint_dir=JOIN_CACHE,
+):
+    """Content-addressed location of the joined matrix table for these parameters."""
+    params = {
+        'tob_wgs_path': tob_wgs_path.rstrip('/'),
+        'tob_wgs_version': table_version(tob_wgs_path),
+        'hgdp_1kg_path': hgdp_1kg_path.rstrip('/'),
+        'sites_path': sites_path.rstrip('/') if sites_path else None,
+        'sites_version': table_version(sites_path) if sites_path else None,
+        'entry_fields': list(entry_fields),
+        'n_partitions': n_partitions,
+    }
+    digest = hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:16]
+    return f'{checkpoint_dir}/hgdp1kg_tobwgs_{digest}.mt', params
+
+
+def build_joint_matrix(  # pylint: disable=too-many-arguments
+    tob_wgs_path,
+    hgdp_1kg_path=GNOMAD_HGDP_1KG_MT,
+    sites_path=None,
+    entry_fields=('GT',),
+    n_partitions=None,
+    checkpoint_dir=JOIN_CACHE,
+):
+    """
+    Join the densified TOB-WGS callset at `tob_wgs_path` with the HGDP/1KG matrix
+    table, at the loci present in both and, if given, in `sites_path`. Columns
+    carry the HGDP/1KG sample metadata as `hgdp_1kg_metadata` (missing for TOB-WGS
+    samples). The result is written to a content-addressed path in
+    `checkpoint_dir`, so an identical join is only ever computed once.
+    """
+    path, params = joint_matrix_path(
+        tob_wgs_path,
+        hgdp_1kg_path,
+        sites_path,
+        entry_fields,
+        n_partitions,
+        checkpoint_dir,
+    )
+    if hl.hadoop_exists(f'{path}/_SUCCESS'):
+        print(f'Reading joined matrix table from cache: {path}')
+        return hl.read_matrix_table(path)
+
+    hgdp_1kg = hl.read_matrix_table(hgdp_1kg_path)
+    tob_wgs = read_densified(tob_wgs_path, sites_path=sites_path)
+
+    # filter to loci that are contained in both matrix tables (and the site table)
+    if sites_path:
+        hgdp_1kg = hgdp_1kg.semi_join_rows(read_sites(sites_path))
+    hgdp_1kg = hgdp_1kg.filter_rows(
+        hl.is_defined(tob_wgs.index_rows(hgdp_1kg['locus'], hgdp_1kg['alleles']))
+    )
+    tob_wgs = tob_wgs.semi_join_rows(hgdp_1kg.rows())
+
+    # Entries and columns must be identical
+    tob_wgs_select = _select_entries(tob_wgs, entry_fields).select_cols()
+    hgdp_1kg_select = _select_entries(hgdp_1kg, entry_fields).select_cols()
+    # Join datasets
+    joined = hgdp_1kg_select.union_cols(tob_wgs_select)
+    # Add in metadata information
+    hgdp_1kg_metadata = hgdp_1kg.cols()
+    joined = joined.annotate_cols(hgdp_1kg_metadata=hgdp_1kg_metadata[joined.s])
+    if n_partitions:
+        joined = joined.repartition(n_partitions, shuffle=False)
+
+    joined.write(path, overwrite=True)
+    with hl.hadoop_open(path.replace('.mt', '.json'), 'w') as f:
+        json.dump(params, f, indent=2)
+    return hl.read_matrix_table(path)
+
+
+def append_samples(joined_mt, tob_wgs_path, checkpoint_dir):
+    """
+    Add the samples of the sparse callset at `tob_wgs_path` that are not yet
+    columns of `joined_mt`. Only the new samples are densified, and only at the
+    rows of `joined_mt`; the row set and row partitioning of `joined_mt` are kept,
+    with missing calls for new samples at sites absent from their callset.
+    Returns None if there are no new samples.
+    """
+    if set(joined_mt.entry) != {'GT'}:
+        raise ValueError(
+            f'Expected a joined matrix table with GT entries only, '
+            f'found {list(joined_mt.entry)}'
+        )
+    existing_samples = hl.literal(set(joined_mt.s.collect()))
+    tob_wgs = hl.read_matrix_table(tob_wgs_path).key_rows_by('locus', 'alleles')
+    tob_wgs = tob_wgs.filter_cols(~existing_samples.contains(tob_wgs.s))
+    n_new = tob_wgs.count_cols()
+    print(f'Samples to append: {n_new}')
+    if n_new == 0:
+        return None
+
+    # reference block starts only depend on the new samples' entries
+    last_end_ht = compute_last_ref_block_end(tob_wgs).checkpoint(
+        f'{checkpoint_dir}/last_END_positions.ht', overwrite=True
+    )
+    tob_wgs = densify_sites(tob_wgs, joined_mt.rows(), last_end_ht)
+    tob_wgs = tob_wgs.semi_join_rows(joined_mt.rows())
+    tob_wgs = tob_wgs.select_rows().select_entries(
+        GT=lgt_to_gt(tob_wgs.LGT, tob_wgs.LA)
+    )
+    # columns must match the existing schema; TOB samples have no HGDP/1KG metadata
+    tob_wgs = tob_wgs.select_cols(
+        **{field: hl.missing(joined_mt[field].dtype) for field in joined_mt.col_value}
+    )
+    tob_wgs = tob_wgs.checkpoint(f'{checkpoint_dir}/new_samples.mt', overwrite=True)
+
+    return joined_mt.union_cols(tob_wgs, row_join_type='outer').semi_join_rows(
+        joined_mt.rows()
+    )
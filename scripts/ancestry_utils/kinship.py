@@ -0,0 +1,276 @@
+"""
+Kinship estimates of related sample pairs only.
+
+`hl.king` returns the full samples x samples kinship matrix, which has to be
+written out before the few related pairs can be filtered from its entries.
+`blocked_king` computes the same KING-robust estimate one pair of sample blocks
+at a time from genotype indicator block matrices, thresholds every block on the
+driver and keeps only the pairs above the threshold, so the memory and the
+output scale with the block size and the number of related pairs.
+
+`pc_relate_pairs` runs `hl.pc_relate` on the scores of an existing PCA rather
+than recomputing one, and keeps only the pairs above a minimum kinship.
+
+`compare_kinship` joins the pairs of both methods and the known relationships of
+a pedigree and summarises their agreement in a single aggregation.
+"""
+
+import numpy as np
+import hail as hl
+from hail.linalg import BlockMatrix
+from ancestry_utils.pedigree import DEGREE_KINSHIP_BOUNDS, DEGREES
+from ancestry_utils.stages import stage_path
+
+GENOTYPE_INDICATORS = ('hom_ref', 'het', 'hom_var', 'defined')
+
+
+def _write_indicators(call_expr, checkpoint_dir):
+    """Write 0/1 block matrices (variants x samples) of each genotype class."""
+    gt = call_expr
+    indicators = {
+        'hom_ref': gt.is_hom_ref(),
+        'het': gt.is_het(),
+        'hom_var': gt.is_hom_var(),
+        'defined': hl.is_defined(gt),
+    }
+    matrices = {}
+    for name in GENOTYPE_INDICATORS:
+        path = f'{checkpoint_dir}/king_{name}.bm'
+        if not hl.hadoop_exists(f'{path}/_SUCCESS'):
+            BlockMatrix.write_from_entry_expr(
+                hl.float64(hl.or_else(indicators[name], False)), path, overwrite=True
+            )
+        matrices[name] = BlockMatrix.read(path)
+    return matrices
+
+
+def _block_kinship(matrices, rows, cols):
+    """
+    KING-robust between-family kinship between the samples in `rows` and `cols`
+    (slices), as in `hl.king`: 1/2 + (2 (N_het,het - 2 N_homref,homvar) - N_het_i -
+    N_het_j) / (4 min(N_het_i, N_het_j)), where each sample's heterozygote count is
+    taken over the variants called in the other.
+    """
+
+    def cross(a, b):
+        return (matrices[a][:, rows].T @ matrices[b][:, cols]).to_numpy()
+
+    het_het = cross('het', 'het')
+    ibs0 = cross('hom_ref', 'hom_var') + cross('hom_var', 'hom_ref')
+    het_i = cross('het', 'defined')
+    het_j = cross('defined', 'het')
+    balance = het_het - 2 * ibs0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 0.5 + (2 * balance - het_i - het_j) / (4 * np.minimum(het_i, het_j))
+
+
+def blocked_king(call_expr, checkpoint_dir, params, min_kinship=0.125, block_size=1000):
+    """
+    KING kinship of every pair of distinct samples of the matrix table of
+    `call_expr` with a kinship above `min_kinship`, computed in blocks of
+    `block_size` samples. Returns a table with the same `s_1`, `s` and `phi` fields
+    as the entries of `hl.king`, with each pair listed once.
+
+    The genotype indicator matrices are written under `checkpoint_dir`, named
+    after a digest of `params` (which should identify the input matrix table,
+    its version and any row filters) and the sample IDs, and reused by later
+    calls with the same inputs.
+    """
+    mt = call_expr._indices.source  # pylint: disable=protected-access
+    samples = mt.s.collect()
+    matrices = _write_indicators(
+        call_expr,
+        stage_path(
+            checkpoint_dir, 'king_indicators', {**params, 'samples': samples}, 'bms'
+        ),
+    )
+    starts = range(0, len(samples), block_size)
+    pairs = []
+    for row_start in starts:
+        rows = slice(row_start, min(row_start + block_size, len(samples)))
+        for col_start in starts:
+            if col_start < row_start:
+                continue
+            cols = slice(col_start, min(col_start + block_size, len(samples)))
+            phi = _block_kinship(matrices, rows, cols)
+            related = phi > min_kinship
+            if col_start == row_start:
+                related = np.triu(related, k=1)
+            for i, j in zip(*np.nonzero(related)):
+                pairs.append(
+                    {
+                        's_1': samples[row_start + i],
+                        's': samples[col_start + j],
+                        'phi': float(phi[i, j]),
+                    }
+                )
+            print(
+                f'Samples {rows.start}-{rows.stop} x {cols.start}-{cols.stop}: '
+                f'{int(related.sum())} related pairs'
+            )
+    print(f'{len(pairs)} pairs with kinship above {min_kinship}')
+    return hl.Table.parallelize(
+        pairs,
+        hl.tstruct(s_1=hl.tstr, s=hl.tstr, phi=hl.tfloat64),
+        key=['s_1', 's'],
+    )
+
+
+def pc_relate_pairs(
+    call_expr, scores_ht, min_kinship=0.1, n_pcs=10, min_individual_maf=0.01
+):
+    """
+    `hl.pc_relate` kinship of the pairs of samples with a kinship of at least
+    `min_kinship`, using the first `n_pcs` scores of an existing PCA (`scores_ht`,
+    keyed by `s` as written by `hl.hwe_normalized_pca`) instead of recomputing the
+    PCA. Samples without scores are dropped. Returns a table keyed by the sample
+    IDs `i` and `j`, with a `kin` field.
+    """
+    mt = call_expr._indices.source  # pylint: disable=protected-access
+    mt = mt.select_entries(__gt=call_expr)
+    mt = mt.annotate_cols(__scores=scores_ht[mt.s].scores[:n_pcs])
+    n_missing = mt.aggregate_cols(hl.agg.count_where(hl.is_missing(mt.__scores)))
+    if n_missing:
+        print(f'Dropping {n_missing} samples without PCA scores')
+        mt = mt.filter_cols(hl.is_defined(mt.__scores))
+    pairs = hl.pc_relate(
+        mt.__gt,
+        min_individual_maf,
+        scores_expr=mt.__scores,
+        min_kinship=min_kinship,
+        statistics='kin',
+    )
+    pairs = pairs.key_by(i=pairs.i.s, j=pairs.j.s)
+    return pairs.select('kin')
+
+
+def ordered_pairs(i_expr, j_expr, kinship_expr):
+    """
+    Table of distinct sample pairs keyed by `i` < `j` with their kinship as `kin`,
+    from the pair table of the expressions. Self-pairs are dropped.
+    """
+    ht = i_expr._indices.source  # pylint: disable=protected-access
+    ht = ht.annotate(
+        __i=hl.if_else(i_expr < j_expr, i_expr, j_expr),
+        __j=hl.if_else(i_expr < j_expr, j_expr, i_expr),
+        __kin=kinship_expr,
+    )
+    ht = ht.filter(ht.__i != ht.__j)
+    ht = ht.key_by(i=ht.__i, j=ht.__j)
+    return ht.select(kin=ht.__kin).distinct()
+
+
+def read_kinship_pairs(path):
+    """
+    Read a kinship estimate written by this repository as `ordered_pairs`: the
+    matrix table of `hl.king`, the related pairs of `blocked_king` or
+    `pc_relate_pairs`, or the full table of `hl.pc_relate`.
+    """
+    if hl.hadoop_exists(f'{path}/entries'):
+        ht = hl.read_matrix_table(path).entries()
+        return ordered_pairs(ht.s_1, ht.s, ht.phi)
+    ht = hl.read_table(path)
+    if 'phi' in ht.row:
+        return ordered_pairs(ht.s_1, ht.s, ht.phi)
+    if isinstance(ht.i.dtype, hl.tstruct):
+        return ordered_pairs(ht.i.s, ht.j.s, ht.kin)
+    return ordered_pairs(ht.i, ht.j, ht.kin)
+
+
+def kinship_degree_expr(kinship_expr):
+    """
+    Hail expression of `ancestry_utils.pedigree.kinship_degree`, which is
+    'unrelated' for a missing or NaN kinship.
+    """
+    n_bounds_above = hl.len(
+        hl.literal(list(DEGREE_KINSHIP_BOUNDS)).filter(
+            lambda bound: kinship_expr < bound
+        )
+    )
+    return (
+        hl.case()
+        .when(hl.or_else(hl.is_nan(kinship_expr), True), 'unrelated')
+        .default(hl.literal(list(DEGREES))[n_bounds_above])
+    )
+
+
+def compare_kinship(king_ht, pc_relate_ht, truth_pairs, samples, min_kinship=0.1):
+    """
+    Compare the KING and pc_relate pairs (as returned by `ordered_pairs`) of
+    `samples` with each other and with the known `truth_pairs` (a dict of ordered
+    sample pairs to degree, see `ancestry_utils.pedigree.pedigree_pairs`), in one
+    aggregation. Pairs with other samples are ignored, and pairs absent from a
+    table are taken as unrelated.
+
+    Returns a dict with the number of pairs with a kinship of at least
+    `min_kinship` in each method and in both, their concordance (shared over
+    either), the correlation of the two estimates over the pairs present in both,
+    and for each method the confusion matrix of inferred against known degree
+    over all pairs of `samples`.
+    """
+    samples = set(samples)
+    known_pairs = [
+        {'i': i, 'j': j, 'degree': degree}
+        for (i, j), degree in truth_pairs.items()
+        if i in samples and j in samples
+    ]
+    truth_ht = hl.Table.parallelize(
+        known_pairs,
+        hl.tstruct(i=hl.tstr, j=hl.tstr, degree=hl.tstr),
+        key=['i', 'j'],
+    )
+    # pairs with other samples would otherwise land in the confusion matrices
+    samples_expr = hl.literal(samples)
+    king_ht, pc_relate_ht = (
+        pairs_ht.filter(
+            samples_expr.contains(pairs_ht.i) & samples_expr.contains(pairs_ht.j)
+        )
+        for pairs_ht in (king_ht, pc_relate_ht)
+    )
+    ht = king_ht.rename({'kin': 'king'}).join(
+        pc_relate_ht.rename({'kin': 'pc_relate'}), how='outer'
+    )
+    ht = ht.join(truth_ht, how='outer')
+    degree = hl.or_else(ht.degree, 'unrelated')
+    king_related = hl.or_else(ht.king >= min_kinship, False)
+    pc_relate_related = hl.or_else(ht.pc_relate >= min_kinship, False)
+    summary = ht.aggregate(
+        hl.struct(
+            n_king=hl.agg.count_where(king_related),
+            n_pc_relate=hl.agg.count_where(pc_relate_related),
+            n_both=hl.agg.count_where(king_related & pc_relate_related),
+            correlation=hl.agg.corr(ht.king, ht.pc_relate),
+            n_compared=hl.agg.count_where(
+                hl.is_defined(ht.king) & hl.is_defined(ht.pc_relate)
+            ),
+            king=hl.agg.counter(hl.tuple([degree, kinship_degree_expr(ht.king)])),
+            pc_relate=hl.agg.counter(
+                hl.tuple([degree, kinship_degree_expr(ht.pc_relate)])
+            ),
+        )
+    )
+
+    n_sample_pairs = len(samples) * (len(samples) - 1) // 2
+    confusion = {}
+    for method in ('king', 'pc_relate'):
+        counts = {known: {inferred: 0 for inferred in DEGREES} for known in DEGREES}
+        for (known, inferred), count in summary[method].items():
+            counts[known][inferred] = count
+        # pairs in none of the tables
+        counts['unrelated']['unrelated'] += n_sample_pairs - sum(
+            summary[method].values()
+        )
+        confusion[method] = counts
+    n_either = summary.n_king + summary.n_pc_relate - summary.n_both
+    return {
+        'n_samples': len(samples),
+        'n_known_pairs': len(known_pairs),
+        'min_kinship': min_kinship,
+        'n_king': summary.n_king,
+        'n_pc_relate': summary.n_pc_relate,
+        'n_both': summary.n_both,
+        'concordance': summary.n_both / n_either if n_either else None,
+        'n_compared': summary.n_compared,
+        'correlation': summary.correlation,
+        'confusion': confusion,
+    }
@@ -0,0 +1,154 @@
+"""
+Banded LD matrices stored as sparse chunks.
+
+`export_banded_ld` computes `hl.ld_matrix` one chromosome at a time and keeps only
+the upper triangle of the band within `radius` bp. Each chromosome is written as
+a locus index (`{contig}/loci.npz`: position, ref, alt in row order) and chunks
+of `chunk_size` rows in compressed sparse row form (`{contig}/chunk_00000.npz`:
+indptr, indices, data). `manifest.json` lists the chunks of every chromosome with
+the rows and positions they cover, so `read_ld_region` only reads the chunks
+overlapping a region.
+"""
+
+import json
+import numpy as np
+from ancestry_utils.arrays import load_arrays, open_file, save_arrays
+
+
+def _csr(i, j, r, row_start, n_rows):
+    """Compressed sparse rows of the entries (i, j, r) with rows from `row_start`."""
+    order = np.lexsort((j, i))
+    counts = np.bincount(i[order] - row_start, minlength=n_rows)
+    indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return indptr, j[order].astype(np.int64), r[order].astype(np.float32)
+
+
+def _read_manifest(path):
+    with open_file(f'{path}/manifest.json', 'r') as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    with open_file(f'{path}/manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def export_banded_ld(mt, path, radius=2000000, chunk_size=10000):
+    """
+    Write the LD (Pearson correlation of `mt.GT.n_alt_alleles()`) between all
+    pairs of variants of `mt` on the same chromosome at most `radius` bp apart to
+    `path`. Chromosomes already listed in the manifest are skipped, so an
+    interrupted export resumes with the next chromosome. Pairs whose correlation is
+    zero or undefined are not stored.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    if hl.hadoop_exists(f'{path}/manifest.json'):
+        manifest = _read_manifest(path)
+    else:
+        manifest = {'radius': radius, 'chunk_size': chunk_size, 'contigs': {}}
+    reference_genome = mt.locus.dtype.reference_genome
+    contigs = mt.aggregate_rows(hl.agg.collect_as_set(mt.locus.contig))
+    for contig in sorted(contigs, key=reference_genome.contigs.index):
+        if contig in manifest['contigs']:
+            continue
+        contig_mt = hl.filter_intervals(
+            mt,
+            [hl.parse_locus_interval(contig, reference_genome=reference_genome)],
+        )
+        loci = (
+            contig_mt.rows()
+            .key_by()
+            .select(
+                position=contig_mt.locus.position,
+                ref=contig_mt.alleles[0],
+                alt=contig_mt.alleles[1],
+            )
+            .to_pandas()
+        )
+        n_variants = len(loci)
+        save_arrays(
+            f'{path}/{contig}/loci.npz',
+            position=loci['position'].to_numpy(dtype=np.int32),
+            ref=loci['ref'].to_numpy(dtype=str),
+            alt=loci['alt'].to_numpy(dtype=str),
+        )
+
+        ld = hl.ld_matrix(contig_mt.GT.n_alt_alleles(), contig_mt.locus, radius=radius)
+        ld = ld.checkpoint(f'{path}/tmp/{contig}.bm', overwrite=True)
+        # blocks outside the band are not stored, and entries outside it are zero
+        entries = ld.entries()
+        entries = entries.filter(
+            (entries.j >= entries.i) & (entries.entry != 0) & ~hl.is_nan(entries.entry)
+        )
+        entries = entries.checkpoint(f'{path}/tmp/{contig}_entries.ht', overwrite=True)
+
+        chunks = []
+        positions = loci['position'].to_numpy()
+        for row_start in range(0, n_variants, chunk_size):
+            row_end = min(row_start + chunk_size, n_variants)
+            chunk = entries.filter(
+                (entries.i >= row_start) & (entries.i < row_end)
+            ).to_pandas()
+            indptr, indices, data = _csr(
+                chunk['i'].to_numpy(dtype=np.int64),
+                chunk['j'].to_numpy(dtype=np.int64),
+                chunk['entry'].to_numpy(),
+                row_start,
+                row_end - row_start,
+            )
+            chunk_path = f'{contig}/chunk_{row_start // chunk_size:05d}.npz'
+            save_arrays(
+                f'{path}/{chunk_path}', indptr=indptr, indices=indices, data=data
+            )
+            chunks.append(
+                {
+                    'path': chunk_path,
+                    'row_start': row_start,
+                    'row_end': row_end,
+                    'start': int(positions[row_start]),
+                    'end': int(positions[row_end - 1]),
+                    'n_entries': len(data),
+                }
+            )
+            print(f'{contig}: wrote rows {row_start}-{row_end} ({len(data)} entries)')
+
+        manifest['contigs'][contig] = {
+            'n_variants': n_variants,
+            'loci': f'{contig}/loci.npz',
+            'chunks': chunks,
+        }
+        _write_manifest(path, manifest)
+
+
+def read_ld_region(path, contig, start, end):
+    """
+    LD between the variants of `contig` with positions in [start, end], read from
+    an export written by `export_banded_ld` (a local directory or a cloud path).
+    Returns a dict with the position, ref and alt of these variants, and their
+    correlation matrix as a dense symmetric array. Pairs further apart than the
+    export radius are zero.
+    """
+    info = _read_manifest(path)['contigs'][contig]
+    loci = load_arrays(f'{path}/{info["loci"]}')
+    lo = int(np.searchsorted(loci['position'], start, side='left'))
+    hi = int(np.searchsorted(loci['position'], end, side='right'))
+    ld = np.zeros((hi - lo, hi - lo), dtype=np.float32)
+    for chunk in info['chunks']:
+        if chunk['row_end'] <= lo or chunk['row_start'] >= hi:
+            continue
+        arrays = load_arrays(f'{path}/{chunk["path"]}')
+        rows = chunk['row_start'] + np.repeat(
+            np.arange(len(arrays['indptr']) - 1), np.diff(arrays['indptr'])
+        )
+        in_region = (
+            (rows >= lo)
+            & (rows < hi)
+            & (arrays['indices'] >= lo)
+            & (arrays['indices'] < hi)
+        )
+        ld[rows[in_region] - lo, arrays['indices'][in_region] - lo] = arrays['data'][
+            in_region
+        ]
+    ld = ld + ld.T - np.diag(np.diag(ld))
+    return {key: values[lo:hi] for key, values in loci.items()}, ld
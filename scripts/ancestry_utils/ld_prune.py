@@ -0,0 +1,627 @@
+"""
+Windowed LD pruning on sorted segments of variants.
+
+`hl.ld_prune` builds a block matrix of correlations between all variants that
+survive its local pruning step and finds a maximal independent set across the
+whole genome, which needs a large shuffle and a lot of memory on the driver.
+`windowed_ld_prune` instead makes one greedy pass over the variants in genomic
+order: a variant is kept if its r2 with every kept variant at most
+`bp_window_size` bp upstream on the same chromosome is below `r2`. The variants
+are split into segments of consecutive variants, and each segment is sent the
+variants of earlier segments within one window of its start (its halo), so
+every task only holds one segment's halo and window in memory. The kept
+variants carried into a segment depend on how its predecessors were pruned, so
+segments are pruned again until the kept variants carried between them no
+longer change, which gives the same result as a single sequential pass.
+
+`ld_index` stores the same pairwise r2 values sparsely (every pair within a
+window whose r2 is at least a floor), so that `prune_from_index` can repeat the
+greedy pass at any threshold at or above the floor, any window up to the
+index's, and any subset of its variants without reading genotypes again.
+"""
+
+import itertools
+import json
+import time
+from collections import defaultdict
+import numpy as np
+import hail as hl
+from ancestry_utils.stages import stage_path
+
+MISSING_DOSAGE = '9'
+SEGMENT_SIZE = 10000
+LD_INDEX_DIR = 'gs://cpg-tob-wgs-main/ld_index'
+
+
+def _standardize(dosages):
+    """
+    Alternate allele dosages of one variant, encoded as a string of '0', '1', '2'
+    and MISSING_DOSAGE, mean-imputed, centred and scaled to unit norm, so that
+    dot products between variants are correlations. None if monomorphic.
+    """
+    d = np.frombuffer(dosages.encode('ascii'), dtype=np.uint8) - ord('0')
+    called = d <= 2
+    if not called.any():
+        return None
+    x = d.astype(np.float64)
+    mean = x[called].mean()
+    x[~called] = mean
+    x -= mean
+    norm = np.sqrt(x @ x)
+    if norm == 0:
+        return None
+    return x / norm
+
+
+_WINDOW_FIELDS = ('positions', 'indices', 'vectors')
+
+
+def _empty_window(contig=None):
+    return {'contig': contig, **{field: [] for field in _WINDOW_FIELDS}}
+
+
+def _append(window, row, x):
+    window['positions'].append(row.position)
+    window['indices'].append(row.idx)
+    window['vectors'].append(x)
+
+
+def _trim_window(window, position, bp_window_size):
+    """Drop variants of `window` more than `bp_window_size` bp before `position`."""
+    while window['positions'] and position - window['positions'][0] > bp_window_size:
+        for field in _WINDOW_FIELDS:
+            window[field].pop(0)
+
+
+def _scan_rows(rows, bp_window_size, window, visit):
+    """
+    Stream rows with fields contig, position, idx, alleles and dosages, sorted by
+    locus, through a window of variants at most `bp_window_size` bp upstream,
+    starting from `window` (or an empty one). `visit(window, row, x)` is called
+    for every polymorphic variant with its standardised dosages `x`, and returns
+    whether to add it to the window. Returns the window at the end of the rows and
+    per-contig timings.
+    """
+    window = window or _empty_window()
+    stats = defaultdict(lambda: {'n_variants': 0, 'n_kept': 0, 'seconds': 0.0})
+    last_position = None
+    start = time.perf_counter()
+    for row in rows:
+        if row.contig != window['contig']:
+            if window['contig'] is not None:
+                stats[window['contig']]['seconds'] += time.perf_counter() - start
+                start = time.perf_counter()
+            window = _empty_window(row.contig)
+        stats[row.contig]['n_variants'] += 1
+        last_position = row.position
+        x = _standardize(row.dosages)
+        if x is None:
+            continue
+        _trim_window(window, row.position, bp_window_size)
+        if visit(window, row, x):
+            _append(window, row, x)
+            stats[row.contig]['n_kept'] += 1
+    if window['contig'] is not None:
+        stats[window['contig']]['seconds'] += time.perf_counter() - start
+        if last_position is not None:
+            window['end'] = last_position
+    return window, dict(stats)
+
+
+def _window_r2(window, x):
+    """r2 of standardised dosages `x` with every variant of `window`."""
+    if not window['vectors']:
+        return np.zeros(0)
+    r = np.stack(window['vectors']) @ x
+    return r * r
+
+
+def _prune_rows(rows, r2, bp_window_size, window=None):
+    """
+    Greedily prune sorted rows, starting from a `window` of kept upstream
+    variants. Returns the kept (contig, position, alleles), the window of kept
+    variants at the end of the rows, and per-contig counts and timings.
+    """
+    kept = []
+
+    def visit(window, row, x):
+        if np.any(_window_r2(window, x) >= r2):
+            return False
+        kept.append((row.contig, row.position, list(row.alleles)))
+        return True
+
+    window, stats = _scan_rows(rows, bp_window_size, window, visit)
+    return kept, window, stats
+
+
+def _pair_rows(rows, r2_floor, bp_window_size, window=None):
+    """
+    Pairs (upstream idx, downstream idx, distance, r2) of sorted rows with r2 of at
+    least `r2_floor`, including pairs with the variants of the starting `window`.
+    Returns the pairs and the window of all variants at the end of the rows.
+    """
+    pairs = []
+
+    def visit(window, row, x):
+        window_r2 = _window_r2(window, x)
+        for k in np.flatnonzero(window_r2 >= r2_floor):
+            pairs.append(
+                (
+                    window['indices'][k],
+                    row.idx,
+                    row.position - window['positions'][k],
+                    float(window_r2[k]),
+                )
+            )
+        return True
+
+    window, _ = _scan_rows(rows, bp_window_size, window, visit)
+    return pairs, window
+
+
+def _dosage_table(call_expr, checkpoint_path):
+    """
+    Rows of the matrix table of `call_expr` with their dosages as one string, a
+    running index in locus order and whether they are polymorphic, checkpointed.
+    """
+    mt = call_expr._indices.source  # pylint: disable=protected-access
+    # select the entries first, while `call_expr` still belongs to `mt`
+    mt = mt.select_entries(dosage=hl.str(call_expr.n_alt_alleles())).select_rows()
+    ht = mt.localize_entries('entries')
+    ht = ht.select(
+        dosages=hl.delimit(
+            ht.entries.map(lambda e: hl.or_else(e.dosage, MISSING_DOSAGE)), ''
+        ),
+        polymorphic=hl.len(
+            hl.set(ht.entries.map(lambda e: e.dosage).filter(hl.is_defined))
+        )
+        > 1,
+    )
+    ht = ht.add_index('idx')
+    return ht.checkpoint(checkpoint_path, overwrite=True)
+
+
+def _segment_starts(dosage_ht, segment_size):
+    """
+    (contig, position) of the first variant of each segment of `segment_size`
+    consecutive variants of `dosage_ht`, in order.
+    """
+    starts = dosage_ht.filter(dosage_ht.idx % segment_size == 0).select()
+    return [(row.locus.contig, row.locus.position) for row in starts.collect()]
+
+
+def _segment_targets(row, starts, segment_size, bp_window_size):
+    """
+    Segments a row is sent to, as (segment, whether it is in the segment's halo):
+    its own, and every later segment starting on the same contig at most
+    `bp_window_size` bp downstream.
+    """
+    own = row.idx // segment_size
+    yield own, False
+    for segment in range(own + 1, len(starts)):
+        contig, position = starts[segment]
+        if contig != row.contig or position - row.position > bp_window_size:
+            break
+        yield segment, True
+
+
+def _split_halo(rows):
+    """
+    The halo rows at the start of a segment's (is_halo, row) stream, sorted by
+    idx, and an iterator over the segment's own rows.
+    """
+    rows = iter(rows)
+    halo = []
+    for is_halo, row in rows:
+        if not is_halo:
+            return halo, itertools.chain([row], (row for _, row in rows))
+        halo.append(row)
+    return halo, iter(())
+
+
+def _halo_window(halo, keep):
+    """Window of the polymorphic halo rows whose idx passes `keep`."""
+    window = _empty_window()
+    for row in halo:
+        if not keep(row.idx):
+            continue
+        x = _standardize(row.dosages)
+        if x is None:
+            continue
+        if row.contig != window['contig']:
+            window = _empty_window(row.contig)
+        _append(window, row, x)
+    return window
+
+
+def _prune_segment(rows, r2, bp_window_size, carried):
+    """
+    Greedily prune the (is_halo, row) stream of a segment, starting from the
+    halo variants in `carried`, the kept variants carried into it. Returns the
+    kept (contig, position, alleles), per-contig counts and timings, and the
+    contig and (idx, position) of the kept variants in the window at its end.
+    """
+    halo, rows = _split_halo(rows)
+    window = _halo_window(halo, carried.__contains__)
+    kept, window, stats = _prune_rows(rows, r2, bp_window_size, window)
+    tail = list(zip(window['indices'], window['positions']))
+    return kept, stats, (window['contig'], tail)
+
+
+def _prune_segments(prune, n_segments, carries):
+    """
+    Prune every segment with the kept variants carried over from earlier
+    segments. `prune(todo)` prunes the segments of the dict `todo` (segment to the
+    frozenset of kept idx carried into it) and returns a dict of segment to its
+    result, and `carries(results)` lists the kept idx carried into each segment
+    given the results of every segment. The first round prunes every segment
+    without a carry, later rounds only those whose carried variants changed,
+    until none do: the first segment never has a carry, so by induction every
+    segment is then pruned exactly as in a single sequential pass. Returns the
+    results and the number of rounds.
+    """
+    current = [frozenset()] * n_segments
+    pruned_with = [None] * n_segments
+    results = {}
+    n_rounds = 0
+    while True:
+        todo = {
+            segment: carry
+            for segment, carry in enumerate(current)
+            if pruned_with[segment] != carry
+        }
+        if not todo:
+            return results, n_rounds
+        n_rounds += 1
+        results.update(prune(todo))
+        for segment, carry in todo.items():
+            pruned_with[segment] = carry
+        current = carries(results)
+
+
+def _window_carries(starts, bp_window_size):
+    """
+    `carries` of `_prune_segments` for `_prune_segment` results: the kept
+    variants at the end of the previous segment within `bp_window_size` of the
+    start of the next, on the same contig.
+    """
+
+    def carries(results):
+        current = [frozenset()]
+        for segment in range(1, len(starts)):
+            contig, tail = results[segment - 1][2]
+            start_contig, start_position = starts[segment]
+            current.append(
+                frozenset(
+                    idx
+                    for idx, position in tail
+                    if contig == start_contig
+                    and start_position - position <= bp_window_size
+                )
+            )
+        return current
+
+    return carries
+
+
+def _pair_segment(rows, r2_floor, bp_window_size):
+    """Pairs of `_pair_rows` of the (is_halo, row) stream of a segment."""
+    halo, rows = _split_halo(rows)
+    window = _halo_window(halo, lambda idx: True)
+    pairs, _ = _pair_rows(rows, r2_floor, bp_window_size, window)
+    return pairs
+
+
+def _by_segment(rdd, n_segments):
+    """
+    Values of an RDD keyed by (segment, idx), with one partition per segment
+    sorted by idx, persisted as they are read again in every round.
+    """
+    # pyspark is only available on the cluster
+    # pylint: disable=import-outside-toplevel
+    from pyspark import StorageLevel
+
+    rdd = rdd.repartitionAndSortWithinPartitions(
+        max(n_segments, 1), partitionFunc=lambda key: key[0]
+    )
+    return rdd.values().persist(StorageLevel.MEMORY_AND_DISK)
+
+
+def _segment_rdd(dosage_ht, starts, segment_size, bp_window_size):
+    """
+    Spark RDD with one partition per segment, holding the (is_halo, row) stream
+    of the segment sorted by idx: its halo rows first, then its own rows.
+    """
+    ht = dosage_ht.annotate(
+        contig=dosage_ht.locus.contig, position=dosage_ht.locus.position
+    )
+    ht = ht.key_by().select('contig', 'position', 'idx', 'alleles', 'dosages')
+    starts = hl.spark_context().broadcast(starts)
+
+    def targets(row):
+        for segment, is_halo in _segment_targets(
+            row, starts.value, segment_size, bp_window_size
+        ):
+            yield (segment, row.idx), (is_halo, row)
+
+    return _by_segment(ht.to_spark().rdd.flatMap(targets), len(starts.value))
+
+
+def _prune_rdd(rdd, prune_segment):
+    """
+    `prune` of `_prune_segments` for an RDD with one partition per segment:
+    `prune_segment(rows, carry)` prunes the rows of one partition.
+    """
+
+    def prune(todo):
+        todo = hl.spark_context().broadcast(todo)
+
+        def prune_partition(segment, rows):
+            if segment not in todo.value:
+                return []
+            return [(segment, prune_segment(rows, todo.value[segment]))]
+
+        return dict(rdd.mapPartitionsWithIndex(prune_partition).collect())
+
+    return prune
+
+
+def windowed_ld_prune(
+    call_expr, checkpoint_path, r2=0.2, bp_window_size=500000, segment_size=SEGMENT_SIZE
+):
+    """
+    LD-prune the rows of the matrix table of `call_expr`. The dosages are written
+    once to `checkpoint_path` as one string per variant, then split into segments
+    of `segment_size` variants, each with the variants of earlier segments within
+    `bp_window_size` of its start. Segments are pruned in rounds until the kept
+    variants carried between them are stable, so the result is the same as a
+    single sequential greedy pass. Memory per task is bounded by the number of
+    variants in a window.
+
+    Returns a table of the kept variants, keyed by locus and alleles, and a dict of
+    per-contig number of variants, number kept and seconds spent pruning.
+    """
+    reference_genome = call_expr._indices.source.locus.dtype.reference_genome
+    dosage_ht = _dosage_table(call_expr, checkpoint_path)
+
+    start = time.perf_counter()
+    starts = _segment_starts(dosage_ht, segment_size)
+    rdd = _segment_rdd(dosage_ht, starts, segment_size, bp_window_size)
+
+    prune = _prune_rdd(
+        rdd, lambda rows, carry: _prune_segment(rows, r2, bp_window_size, carry)
+    )
+    results, n_rounds = _prune_segments(
+        prune, len(starts), _window_carries(starts, bp_window_size)
+    )
+    rdd.unpersist()
+    print(
+        f'Windowed LD pruning of {len(starts)} segments took {n_rounds} rounds '
+        f'and {time.perf_counter() - start:.1f}s'
+    )
+
+    kept = []
+    timings = defaultdict(lambda: {'n_variants': 0, 'n_kept': 0, 'seconds': 0.0})
+    for segment in range(len(starts)):
+        segment_kept, segment_stats, _ = results[segment]
+        kept.extend(segment_kept)
+        for contig, contig_stats in segment_stats.items():
+            for field, value in contig_stats.items():
+                timings[contig][field] += value
+    for contig, contig_stats in timings.items():
+        print(
+            f'{contig}: kept {contig_stats["n_kept"]} of '
+            f'{contig_stats["n_variants"]} variants in '
+            f'{contig_stats["seconds"]:.1f}s'
+        )
+
+    pruned = hl.Table.parallelize(
+        [
+            {'contig': contig, 'position': position, 'alleles': alleles}
+            for contig, position, alleles in kept
+        ],
+        hl.tstruct(contig=hl.tstr, position=hl.tint32, alleles=hl.tarray(hl.tstr)),
+    )
+    pruned = pruned.key_by(
+        locus=hl.locus(
+            pruned.contig, pruned.position, reference_genome=reference_genome
+        ),
+        alleles=pruned.alleles,
+    )
+    return pruned.select(), dict(timings)
+
+
+def ld_index_path(params, r2_floor=0.05, bp_window_size=500000, index_dir=LD_INDEX_DIR):
+    """
+    Directory of the LD index of a variant set, versioned by `params` (which should
+    identify the cohort and the site set, e.g. the paths they were read from),
+    the r2 floor and the window size.
+    """
+    return stage_path(
+        index_dir,
+        'ld_index',
+        {**params, 'r2_floor': r2_floor, 'bp_window_size': bp_window_size},
+        kind='index',
+    )
+
+
+def ld_index(  # pylint: disable=too-many-arguments
+    call_expr,
+    params,
+    r2_floor=0.05,
+    bp_window_size=500000,
+    index_dir=LD_INDEX_DIR,
+    segment_size=SEGMENT_SIZE,
+):
+    """
+    Sparse LD index of the rows of the matrix table of `call_expr`, computed once
+    per `params` and stored under `ld_index_path(...)`. Returns two tables:
+    `variants.ht`, keyed by locus and alleles, with a running index `idx` and
+    whether each variant is polymorphic; and `pairs.ht`, with every pair of
+    variants (i upstream of j) on the same chromosome at most `bp_window_size` bp
+    apart with r2 of at least `r2_floor`, their distance and r2. The floor and
+    window are stored as globals of the pairs table. Pairs are computed in
+    segments of `segment_size` variants, each with the variants within one window
+    before its start.
+    """
+    path = ld_index_path(params, r2_floor, bp_window_size, index_dir)
+    if hl.hadoop_exists(f'{path}/_SUCCESS'):
+        print(f'Reading LD index {path}')
+        return hl.read_table(f'{path}/variants.ht'), hl.read_table(f'{path}/pairs.ht')
+
+    print(f'Computing LD index {path}')
+    dosage_ht = _dosage_table(call_expr, f'{path}/dosages.ht')
+    dosage_ht.select('idx', 'polymorphic').write(f'{path}/variants.ht', overwrite=True)
+    starts = _segment_starts(dosage_ht, segment_size)
+    rdd = _segment_rdd(dosage_ht, starts, segment_size, bp_window_size)
+    pairs_rdd = rdd.mapPartitions(
+        lambda rows: _pair_segment(rows, r2_floor, bp_window_size)
+    )
+    # pyspark is only available on the cluster
+    # pylint: disable=import-outside-toplevel
+    from pyspark.sql import SparkSession
+    from pyspark.sql.types import (
+        DoubleType,
+        IntegerType,
+        LongType,
+        StructField,
+        StructType,
+    )
+
+    pairs_df = SparkSession.builder.getOrCreate().createDataFrame(
+        pairs_rdd,
+        StructType(
+            [
+                StructField('i', LongType(), False),
+                StructField('j', LongType(), False),
+                StructField('distance', IntegerType(), False),
+                StructField('r2', DoubleType(), False),
+            ]
+        ),
+    )
+    pairs_ht = hl.Table.from_spark(pairs_df)
+    pairs_ht = pairs_ht.annotate_globals(
+        r2_floor=r2_floor, bp_window_size=bp_window_size
+    )
+    pairs_ht.write(f'{path}/pairs.ht', overwrite=True)
+    rdd.unpersist()
+    with hl.hadoop_open(f'{path}/params.json', 'w') as f:
+        json.dump(
+            {**params, 'r2_floor': r2_floor, 'bp_window_size': bp_window_size},
+            f,
+            indent=2,
+        )
+    with hl.hadoop_open(f'{path}/_SUCCESS', 'w') as f:
+        f.write('')
+    return hl.read_table(f'{path}/variants.ht'), hl.read_table(f'{path}/pairs.ht')
+
+
+def _greedy_segment(rows, carried):
+    """
+    Greedy pass over the (idx, upstream) rows of a segment of candidate variants,
+    sorted by idx: a variant is kept unless one of its `upstream` partners was
+    kept, either earlier in the segment or, for partners in earlier segments, in
+    `carried`. Returns the kept idx and the partners in earlier segments.
+    """
+    seen = set()
+    kept = set()
+    external = set()
+    for idx, upstream in rows:
+        keep = True
+        for partner in upstream:
+            if partner in seen:
+                keep = keep and partner not in kept
+            else:
+                external.add(partner)
+                keep = keep and partner not in carried
+        seen.add(idx)
+        if keep:
+            kept.add(idx)
+    return sorted(kept), frozenset(external)
+
+
+def _index_carries(results):
+    """
+    `carries` of `_prune_segments` for `_greedy_segment` results: the kept
+    partners of each segment in earlier segments.
+    """
+    kept = set().union(*(segment_kept for segment_kept, _ in results.values()))
+    return [results[segment][1] & kept for segment in range(len(results))]
+
+
+def prune_from_index(  # pylint: disable=too-many-arguments
+    variants_ht,
+    pairs_ht,
+    r2,
+    bp_window_size=None,
+    sites_ht=None,
+    segment_size=SEGMENT_SIZE,
+):
+    """
+    Greedy LD pruning answered from an LD index, without genotypes: the same
+    result as a single sequential pass of `windowed_ld_prune` over the index's
+    variants (restricted to those in `sites_ht` if given), for any `r2` at or
+    above the index floor and any `bp_window_size` up to the index window.
+    The upstream partners of each candidate are grouped in Hail, and the greedy
+    pass runs on segments of `segment_size` candidates, in rounds until the kept
+    partners carried between segments are stable, so only the kept variants are
+    collected. Returns the kept variants, keyed by locus and alleles.
+    """
+    r2_floor, index_window = hl.eval(
+        (pairs_ht.globals.r2_floor, pairs_ht.globals.bp_window_size)
+    )
+    if r2 < r2_floor:
+        raise ValueError(f'r2 {r2} is below the LD index floor {r2_floor}')
+    if bp_window_size is None:
+        bp_window_size = index_window
+    if bp_window_size > index_window:
+        raise ValueError(
+            f'Window {bp_window_size} is larger than the LD index window {index_window}'
+        )
+
+    candidates_ht = variants_ht.filter(variants_ht.polymorphic)
+    if sites_ht is not None:
+        candidates_ht = candidates_ht.semi_join(sites_ht)
+    candidates_ht = candidates_ht.key_by('idx').select()
+    # pairs with a variant outside the candidates do not constrain the prune
+    pairs_ht = pairs_ht.filter(
+        (pairs_ht.r2 >= r2) & (pairs_ht.distance <= bp_window_size)
+    )
+    pairs_ht = pairs_ht.filter(
+        hl.is_defined(candidates_ht[pairs_ht.i])
+        & hl.is_defined(candidates_ht[pairs_ht.j])
+    )
+    upstream_ht = pairs_ht.group_by(idx=pairs_ht.j).aggregate(
+        upstream=hl.agg.collect(pairs_ht.i)
+    )
+    candidates_ht = candidates_ht.annotate(
+        upstream=hl.or_else(
+            upstream_ht[candidates_ht.idx].upstream, hl.empty_array(hl.tint64)
+        )
+    )
+    candidates_ht = candidates_ht.add_index('k')
+    n_candidates = candidates_ht.count()
+    n_segments = -(-n_candidates // segment_size)
+
+    rdd = _by_segment(
+        candidates_ht.key_by()
+        .to_spark()
+        .rdd.map(
+            lambda row: ((row.k // segment_size, row.idx), (row.idx, row.upstream))
+        ),
+        n_segments,
+    )
+    results, n_rounds = _prune_segments(
+        _prune_rdd(rdd, _greedy_segment), n_segments, _index_carries
+    )
+    rdd.unpersist()
+    kept = sorted(idx for segment_kept, _ in results.values() for idx in segment_kept)
+    print(
+        f'Kept {len(kept)} of {n_candidates} variants at r2 < {r2} '
+        f'({n_segments} segments, {n_rounds} rounds)'
+    )
+
+    kept_ht = hl.Table.parallelize(
+        [{'idx': idx} for idx in kept], hl.tstruct(idx=hl.tint64), key='idx'
+    )
+    return variants_ht.filter(hl.is_defined(kept_ht[variants_ht.idx])).select()
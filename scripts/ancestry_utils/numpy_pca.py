@@ -0,0 +1,213 @@
+"""
+HWE-normalised PCA with NumPy on a single machine, reading genotypes from a
+packed genotype cache (`ancestry_utils.genotype_cache`).
+
+The genotype matrix is normalised as in `hl.hwe_normalized_pca`: variants that
+are not polymorphic among the called genotypes are dropped, the remaining M
+variants are centred by their mean dosage and scaled by
+sqrt(mean * (2 - mean) * M / 2), and missing genotypes are set to zero. With a
+few thousand samples, the samples x samples matrix X^T X is small, so it is
+accumulated over blocks of variants and decomposed exactly; a second pass over
+the blocks gives the loadings. Memory is bounded by one block and X^T X.
+
+With more than `MAX_GRAM_SAMPLES` samples and a starting subspace (e.g. the
+eigenvectors of a previous run on nearly the same samples), the PCA is refined by
+subspace iteration instead, which only needs one pass over the genotypes per
+iteration and no samples x samples matrix. It stops once the top PCs stop
+moving, as the trailing PCs, which are mostly noise with nearly equal
+eigenvalues, may never converge.
+"""
+
+import numpy as np
+from ancestry_utils.genotype_cache import dosage_blocks
+
+# up to this many samples, the samples x samples matrix X^T X (8 bytes per entry)
+# is accumulated and decomposed exactly, even when a starting subspace is given
+MAX_GRAM_SAMPLES = 10000
+
+
+def _normalize(block, mean, scale):
+    """Normalised dosages of a block of variants, with missing genotypes set to 0."""
+    called = block >= 0
+    x = (block - mean[:, None]) / scale[:, None]
+    return np.where(called, x, 0.0)
+
+
+def _sample_blocks(cache, samples, block_size):
+    """Yield (start, dosages) blocks of the cache, restricted to `samples`."""
+    for start, block in dosage_blocks(cache, block_size):
+        yield start, block[:, samples]
+
+
+def _allele_stats(cache, samples, block_size):
+    """Mean alternate allele dosage of each variant and whether it is polymorphic."""
+    means = []
+    polymorphic = []
+    for _, block in _sample_blocks(cache, samples, block_size):
+        called = block >= 0
+        n_called = called.sum(axis=1)
+        ac = np.where(called, block, 0).sum(axis=1, dtype=np.int64)
+        means.append(ac / np.maximum(n_called, 1))
+        polymorphic.append((ac > 0) & (ac < 2 * n_called))
+    return np.concatenate(means), np.concatenate(polymorphic)
+
+
+def _normalized_blocks(cache, samples, mean, scale, polymorphic, block_size):
+    """Yield normalised blocks of the polymorphic variants."""
+    for start, block in _sample_blocks(cache, samples, block_size):
+        keep = polymorphic[start : start + len(block)]
+        rows = slice(start, start + len(block))
+        yield _normalize(block[keep], mean[rows][keep], scale[rows][keep])
+
+
+def _subspace_iteration(  # pylint: disable=too-many-arguments
+    blocks, start, k, oversampling, tol, max_iterations, n_converged
+):
+    """
+    Top `k` eigenpairs of X^T X, where `blocks()` yields the row blocks of X, by
+    subspace iteration with Rayleigh-Ritz from the columns of `start` plus
+    `oversampling` random columns. Stops when the largest principal angle between
+    the spans of the top `n_converged` eigenvectors of two successive iterations
+    is below `tol` degrees.
+    """
+    rng = np.random.default_rng(0)
+    start = np.asarray(start)[:, :k]
+    extra = rng.standard_normal((start.shape[0], k + oversampling - start.shape[1]))
+    v, _ = np.linalg.qr(np.hstack([start, extra]))
+    previous = None
+    for iteration in range(1, max_iterations + 1):
+        w = np.zeros_like(v)
+        for x in blocks():
+            w += x.T @ (x @ v)
+        eigenvalues, rotation = np.linalg.eigh(v.T @ w)
+        rotation = rotation[:, ::-1]
+        eigenvalues = eigenvalues[::-1]
+        v, w = v @ rotation, w @ rotation
+        top = v[:, :n_converged]
+        if previous is not None:
+            # sine of the largest principal angle between the two subspaces
+            sine = np.linalg.norm(top - previous @ (previous.T @ top), 2)
+            angle = np.degrees(np.arcsin(min(sine, 1.0)))
+            if angle < tol:
+                break
+        previous = top
+        v, _ = np.linalg.qr(w)
+    if previous is not None:
+        print(
+            f'Subspace iteration: {iteration} passes, largest angle between the '
+            f'last two top-{n_converged} subspaces {angle:.2e} degrees'
+        )
+    return eigenvalues[:k], v[:, :k]
+
+
+def hwe_normalized_pca(  # pylint: disable=too-many-arguments,too-many-locals
+    cache,
+    k=20,
+    compute_loadings=True,
+    samples=slice(None),
+    block_size=4096,
+    start=None,
+    oversampling=10,
+    tol=1.0,
+    max_iterations=50,
+    n_converged=10,
+    max_gram_samples=MAX_GRAM_SAMPLES,
+):
+    """
+    HWE-normalised PCA of the genotypes in `cache`, restricted to `samples` (a
+    boolean mask or index array over the cache samples) if given. Returns the
+    eigenvalues (the squared singular values), the sample scores (samples x k, in
+    cache sample order), the loadings (polymorphic variants x k, None unless
+    `compute_loadings`) and the boolean mask of the variants of the cache that were
+    used, as `hl.hwe_normalized_pca` returns eigenvalues, scores and loadings.
+
+    Up to `max_gram_samples` samples, X^T X is decomposed exactly. With more
+    samples, if `start` (samples x at most k, e.g. previous eigenvectors of these
+    samples) is given, the PCA is warm-started from it by `_subspace_iteration`,
+    until the top `n_converged` PCs move by less than `tol` degrees.
+    """
+    mean, polymorphic = _allele_stats(cache, samples, block_size)
+    n_variants = int(polymorphic.sum())
+    if n_variants == 0:
+        raise ValueError('No polymorphic variants in the genotype cache')
+    scale = np.sqrt(mean * (2 - mean) * n_variants / 2)
+    scale[~polymorphic] = 1.0
+    n_samples = len(cache['samples'][samples])
+    print(f'Running PCA on {n_variants} variants, {n_samples} samples')
+
+    def blocks():
+        return _normalized_blocks(cache, samples, mean, scale, polymorphic, block_size)
+
+    if start is None or n_samples <= max_gram_samples:
+        gram = np.zeros((n_samples, n_samples))
+        for x in blocks():
+            gram += x.T @ x
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        eigenvalues = eigenvalues[::-1][:k]
+        eigenvectors = eigenvectors[:, ::-1][:, :k]
+    else:
+        eigenvalues, eigenvectors = _subspace_iteration(
+            blocks,
+            start,
+            k,
+            oversampling,
+            tol,
+            max_iterations,
+            min(n_converged, k),
+        )
+    scores = eigenvectors * np.sqrt(eigenvalues)
+
+    loadings = None
+    if compute_loadings:
+        loadings = np.concatenate(
+            [x @ eigenvectors / np.sqrt(eigenvalues) for x in blocks()]
+        )
+    return eigenvalues, scores, loadings, polymorphic
+
+
+def pca_tables(cache, scores, loadings, variants, samples=slice(None)):
+    """
+    Hail tables equivalent to those of `hl.hwe_normalized_pca`: scores of the
+    `samples` of the cache keyed by `s`, and loadings keyed by locus and alleles
+    for the `variants` (boolean mask) of the cache.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    scores_ht = hl.Table.parallelize(
+        [
+            {'s': s, 'scores': [float(x) for x in row]}
+            for s, row in zip(cache['samples'][samples], scores)
+        ],
+        hl.tstruct(s=hl.tstr, scores=hl.tarray(hl.tfloat64)),
+        key='s',
+    )
+    if loadings is None:
+        return scores_ht, None
+    loadings_ht = hl.Table.parallelize(
+        [
+            {
+                'contig': contig,
+                'position': int(position),
+                'alleles': [ref, alt],
+                'loadings': [float(x) for x in row],
+            }
+            for contig, position, ref, alt, row in zip(
+                cache['contig'][variants],
+                cache['position'][variants],
+                cache['ref'][variants],
+                cache['alt'][variants],
+                loadings,
+            )
+        ],
+        hl.tstruct(
+            contig=hl.tstr,
+            position=hl.tint32,
+            alleles=hl.tarray(hl.tstr),
+            loadings=hl.tarray(hl.tfloat64),
+        ),
+    )
+    loadings_ht = loadings_ht.key_by(
+        locus=hl.locus(loadings_ht.contig, loadings_ht.position),
+        alleles=loadings_ht.alleles,
+    )
+    return scores_ht, loadings_ht.select('loadings')
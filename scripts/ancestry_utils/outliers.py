@@ -0,0 +1,76 @@
+"""
+Iterative removal of PCA outliers.
+
+Instead of running a PCA, plotting it and adding the samples that stand out to a
+hard-coded exclusion list, `iterative_outlier_removal` flags samples whose score
+on any of the top PCs is more than a number of median absolute deviations from
+the median, drops them and reruns the PCA until no sample is flagged. Each rerun
+is passed the previous eigenvectors of the remaining samples, so backends that
+support it (`ancestry_utils.numpy_pca`) can warm-start from them.
+"""
+
+import numpy as np
+
+# scales the median absolute deviation to the standard deviation of a normal
+MAD_SCALE = 1.4826
+
+
+def mad_outliers(scores, n_pcs=10, n_mads=6.0):
+    """
+    Boolean mask of the rows of `scores` (samples x PCs) that lie more than
+    `n_mads` scaled median absolute deviations from the median on any of the
+    first `n_pcs` PCs.
+    """
+    scores = np.asarray(scores)[:, :n_pcs]
+    median = np.median(scores, axis=0)
+    mad = MAD_SCALE * np.median(np.abs(scores - median), axis=0)
+    return np.any(np.abs(scores - median) > n_mads * mad, axis=1)
+
+
+def iterative_outlier_removal(run_pca, sample_ids, n_pcs=10, n_mads=6.0, max_rounds=10):
+    """
+    Run `run_pca(mask, start)` on the samples of `sample_ids` selected by the
+    boolean `mask`, and remove outliers (`mad_outliers`) until none are left or
+    `max_rounds` PCAs have been run. `run_pca` returns a tuple whose first two
+    elements are the eigenvalues and the scores (in the order of
+    `sample_ids[mask]`); `start` is None in the first round and afterwards the
+    eigenvectors of the previous round restricted to the remaining samples.
+
+    Returns the result of the last `run_pca` call, the sample mask it was run on
+    and the removed samples as a list of (sample ID, round) pairs. If outliers are
+    still flagged after `max_rounds`, they are reported but kept, so the mask
+    always matches the result.
+    """
+    sample_ids = np.asarray(sample_ids)
+    mask = np.ones(len(sample_ids), dtype=bool)
+    outliers = []
+    start = None
+    for round_number in range(1, max_rounds + 1):
+        result = run_pca(mask, start)
+        eigenvalues, scores = np.asarray(result[0]), np.asarray(result[1])
+        flagged = mad_outliers(scores, n_pcs, n_mads)
+        print(
+            f'Round {round_number}: {mask.sum()} samples, '
+            f'{flagged.sum()} outliers flagged'
+        )
+        if not flagged.any():
+            break
+        if round_number == max_rounds:
+            print(f'Stopped after {max_rounds} rounds with outliers still flagged')
+            break
+        removed = np.flatnonzero(mask)[flagged]
+        outliers.extend((str(sample_ids[k]), round_number) for k in removed)
+        mask[removed] = False
+        start = scores[~flagged] / np.sqrt(eigenvalues)
+    return result, mask, outliers
+
+
+def write_outliers(path, outliers):
+    """Write removed samples as a TSV file with columns s and round."""
+    # pylint: disable=import-outside-toplevel
+    from ancestry_utils.arrays import open_file
+
+    with open_file(path, 'w') as f:
+        f.write('s\tround\n')
+        for sample_id, round_number in outliers:
+            f.write(f'{sample_id}\t{round_number}\n')
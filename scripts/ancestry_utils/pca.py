@@ -0,0 +1,250 @@
+"""
+PCA helpers returning the same (eigenvalues, scores, loadings) triple as
+`hl.hwe_normalized_pca`.
+"""
+
+import random
+import numpy as np
+import hail as hl
+from hail.experimental import pc_project
+from hail.linalg import BlockMatrix
+
+PCA_METHODS = ('exact', 'randomized')
+
+
+def hwe_normalized_pca(  # pylint: disable=too-many-arguments
+    call_expr,
+    k=20,
+    compute_loadings=True,
+    method='exact',
+    oversampling=10,
+    q_iterations=3,
+    block_size=128,
+):
+    """
+    HWE-normalised PCA of `call_expr`.
+
+    `method='exact'` runs `hl.hwe_normalized_pca`. `method='randomized'` runs a
+    blocked randomized SVD (block Lanczos), which streams the genotype matrix in
+    blocks of `block_size` rows, projects it onto `k + oversampling` random
+    directions and refines them with `q_iterations` power iterations, i.e.
+    `q_iterations + 1` passes over the genotypes in total.
+    """
+    if method == 'exact':
+        return hl.hwe_normalized_pca(call_expr, k=k, compute_loadings=compute_loadings)
+    if method == 'randomized':
+        return hl._hwe_normalized_blanczos(  # pylint: disable=protected-access
+            call_expr,
+            k=k,
+            compute_loadings=compute_loadings,
+            q_iterations=q_iterations,
+            oversampling_param=oversampling,
+            block_size=block_size,
+        )
+    raise ValueError(f'Unknown PCA method {method}, expected one of {PCA_METHODS}')
+
+
+def _score_stdevs(scores_ht):
+    """Standard deviation of each PC across the rows of a scores table."""
+    return scores_ht.aggregate(
+        hl.agg.array_agg(lambda x: hl.agg.stats(x).stdev, scores_ht.scores)
+    )
+
+
+def project_samples(mt, loadings_ht, correct_shrinkage=True):
+    """
+    Project the samples of `mt` onto a PCA fitted by `fit_reference_pca`, using the
+    reference allele frequencies stored with the loadings. Projected scores are
+    multiplied by the per-PC `shrinkage` factors of the loadings table unless
+    `correct_shrinkage` is False.
+    """
+    ht = pc_project(mt.GT, loadings_ht.loadings, loadings_ht.pca_af)
+    if correct_shrinkage:
+        shrinkage = hl.literal(hl.eval(loadings_ht.shrinkage))
+        ht = ht.annotate(scores=hl.zip(ht.scores, shrinkage).map(lambda x: x[0] * x[1]))
+    return ht
+
+
+def fit_reference_pca(ref_mt, k=20, holdout_fraction=0.1, seed=12345, **pca_kwargs):
+    """
+    PCA of the reference panel `ref_mt`, with the panel allele frequencies added to
+    the loadings as `pca_af` so other samples can be placed with `project_samples`.
+
+    Projected samples are shrunk towards zero compared to the samples the PCA was
+    fitted on. To correct for this, a `holdout_fraction` of the panel is left out
+    of the fit and projected instead; the per-PC ratio of fitted to projected score
+    standard deviations is stored as the `shrinkage` global of the loadings table.
+    The returned scores contain both fitted and (corrected) held-out samples, with
+    the latter flagged by `held_out`.
+    """
+    samples = sorted(ref_mt.s.collect())
+    holdout = set(
+        random.Random(seed).sample(samples, int(len(samples) * holdout_fraction))
+    )
+    fit_mt = ref_mt.filter_cols(~hl.literal(holdout).contains(ref_mt.s))
+    fit_mt = fit_mt.annotate_rows(pca_af=hl.agg.mean(fit_mt.GT.n_alt_alleles()) / 2)
+
+    eigenvalues, scores, loadings = hwe_normalized_pca(
+        fit_mt.GT, k=k, compute_loadings=True, **pca_kwargs
+    )
+    loadings = loadings.annotate(pca_af=fit_mt.rows()[loadings.key].pca_af)
+    if not holdout:
+        return (
+            eigenvalues,
+            scores.annotate(held_out=False),
+            loadings.annotate_globals(shrinkage=[1.0] * k),
+        )
+
+    loadings = loadings.annotate_globals(shrinkage=[1.0] * k).cache()
+    holdout_mt = ref_mt.filter_cols(hl.literal(holdout).contains(ref_mt.s))
+    projected = project_samples(holdout_mt, loadings, correct_shrinkage=False).cache()
+    shrinkage = [
+        fitted / held_out
+        for fitted, held_out in zip(_score_stdevs(scores), _score_stdevs(projected))
+    ]
+    print(f'Projection shrinkage correction per PC: {shrinkage}')
+    loadings = loadings.annotate_globals(shrinkage=shrinkage)
+    projected = projected.annotate(
+        scores=hl.zip(projected.scores, hl.literal(shrinkage)).map(
+            lambda x: x[0] * x[1]
+        )
+    )
+    scores = scores.annotate(held_out=False).union(
+        projected.select('scores', held_out=True)
+    )
+    return eigenvalues, scores, loadings
+
+
+def sample_pca_runner(mt, sample_ids, k=20, **pca_kwargs):
+    """
+    `run_pca(mask, start)` for `ancestry_utils.outliers.iterative_outlier_removal`:
+    runs `hwe_normalized_pca` on the columns of `mt` whose IDs are in
+    `sample_ids[mask]`, and returns the eigenvalues, the scores as an array in the
+    order of `sample_ids[mask]`, and the scores and loadings tables. `start` is
+    ignored, as Hail's PCA cannot be warm-started.
+    """
+
+    def run_pca(mask, start):  # pylint: disable=unused-argument
+        samples = [str(s) for s in sample_ids[mask]]
+        sample_mt = mt.filter_cols(hl.literal(set(samples)).contains(mt.s))
+        eigenvalues, scores, loadings = hwe_normalized_pca(
+            sample_mt.GT, k=k, compute_loadings=True, **pca_kwargs
+        )
+        by_sample = {row.s: row.scores for row in scores.collect()}
+        return eigenvalues, [by_sample[s] for s in samples], scores, loadings
+
+    return run_pca
+
+
+def _orthonormal(x):
+    return np.linalg.qr(x)[0]
+
+
+def _normalized_columns(x):
+    norms = np.linalg.norm(x, axis=0)
+    return x / np.where(norms > 0, norms, 1)
+
+
+def principal_angles(a, b):
+    """Principal angles in degrees between the column spaces of `a` and `b`."""
+    cosines = np.linalg.svd(_orthonormal(a).T @ _orthonormal(b), compute_uv=False)
+    return np.degrees(np.arccos(np.clip(cosines, -1, 1)))
+
+
+def warm_started_pca(  # pylint: disable=too-many-arguments,too-many-locals
+    call_expr,
+    previous_loadings_ht,
+    checkpoint_path,
+    k=20,
+    n_iterations=3,
+    oversampling=10,
+    tol_degrees=0.1,
+    seed=0,
+):
+    """
+    HWE-normalised PCA of `call_expr` (normalised as in `hl.hwe_normalized_pca`),
+    started from the loadings of a previous PCA of nearly the same samples and
+    variants instead of from scratch. The normalised genotypes are written once as
+    a block matrix to `checkpoint_path`. The previous loadings (zero for new
+    variants) plus `oversampling` random directions are then refined by at most
+    `n_iterations` block power iterations, each of which is two passes over the
+    block matrix, stopping early when the leading `k` loadings move by less than
+    `tol_degrees`.
+
+    Returns eigenvalues, scores and loadings like `hl.hwe_normalized_pca`, and a
+    dict reporting the convergence: the largest principal angle between
+    successive iterations, and the principal angles and per-PC absolute
+    correlations between the previous and the new loadings.
+    """
+    mt = call_expr._indices.source  # pylint: disable=protected-access
+    mt = mt.select_entries(__gt=call_expr.n_alt_alleles()).unfilter_entries()
+    mt = mt.annotate_rows(
+        __ac=hl.agg.sum(mt.__gt), __n_called=hl.agg.count_where(hl.is_defined(mt.__gt))
+    )
+    mt = mt.filter_rows((mt.__ac > 0) & (mt.__ac < 2 * mt.__n_called))
+    n_variants = mt.count_rows()
+    mean = mt.__ac / mt.__n_called
+    scale = hl.sqrt(mean * (2 - mean) * n_variants / 2)
+    BlockMatrix.write_from_entry_expr(
+        hl.or_else((mt.__gt - mean) / scale, 0.0), checkpoint_path, overwrite=True
+    )
+    x = BlockMatrix.read(checkpoint_path)
+
+    rows = mt.rows()
+    previous = rows.select(
+        loadings=previous_loadings_ht[rows.key].loadings
+    ).loadings.collect()
+    matched = [row for row in previous if row is not None]
+    if not matched:
+        raise ValueError('None of the variants have previous loadings')
+    n_previous = len(matched[0])
+    start = np.array(
+        [row[:k] if row is not None else [0.0] * min(k, n_previous) for row in previous]
+    )
+    print(f'Starting from previous loadings of {len(matched)} of {n_variants} variants')
+    rng = np.random.default_rng(seed)
+    extra = rng.standard_normal((n_variants, k + oversampling - start.shape[1]))
+    basis = _orthonormal(np.hstack([start, extra]))
+
+    changes = []
+    loadings = None
+    for iteration in range(n_iterations + 1):
+        z = (x.T @ BlockMatrix.from_numpy(basis)).to_numpy()
+        u, s, vt = np.linalg.svd(z, full_matrices=False)
+        estimate = basis @ vt.T[:, :k]
+        if loadings is not None:
+            changes.append(float(principal_angles(loadings, estimate).max()))
+            print(f'Iteration {iteration}: subspace moved {changes[-1]:.4f} degrees')
+        loadings = estimate
+        if iteration == n_iterations or (changes and changes[-1] < tol_degrees):
+            break
+        basis = _orthonormal((x @ BlockMatrix.from_numpy(z)).to_numpy())
+
+    eigenvalues = (s[:k] ** 2).tolist()
+    scores = u[:, :k] * s[:k]
+    angles = principal_angles(start, loadings)
+    correlations = np.abs(
+        np.sum(_normalized_columns(start) * loadings[:, : start.shape[1]], axis=0)
+    )
+    convergence = {
+        'n_variants': n_variants,
+        'iterations': len(changes),
+        'subspace_change_degrees': changes,
+        'principal_angles_to_previous_degrees': angles.tolist(),
+        'pc_correlation_with_previous': correlations.tolist(),
+    }
+    print(f'Principal angles to the previous loadings: {angles.round(3).tolist()}')
+
+    scores_ht = hl.Table.parallelize(
+        [
+            {'s': sample, 'scores': row.tolist()}
+            for sample, row in zip(mt.s.collect(), scores)
+        ],
+        hl.tstruct(s=hl.tstr, scores=hl.tarray(hl.tfloat64)),
+        key='s',
+    )
+    rows = rows.add_index('__idx')
+    loadings_ht = rows.select(
+        loadings=hl.literal(loadings.tolist())[hl.int32(rows.__idx)]
+    )
+    return eigenvalues, scores_ht, loadings_ht, convergence
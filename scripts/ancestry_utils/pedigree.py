@@ -0,0 +1,227 @@
+"""
+Known relationships from the 1000 Genomes pedigree, used as the truth set when
+evaluating kinship estimates.
+
+`reports/relatedness_method_test/pedigree.txt` (from
+ftp://ftp.1000genomes.ebi.ac.uk/vol1/ftp/technical/working/20130606_sample_info/20130606_g1k.ped)
+is tab-separated with a header, one individual per row, parents in the
+`Paternal ID` and `Maternal ID` columns (0 if unknown), and comma-separated lists
+of other relatives in the `Siblings`, `Second Order` and `Third Order` columns.
+
+`relationship_graph` indexes the parents of every individual, the families
+(connected by parent links) and the listed relatives. `expected_kinship` derives
+the kinship coefficient of every pair within a family from the parent links, and
+takes the nominal kinship of listed relatives whose common ancestors are not in
+the pedigree. `score_kinship` compares a table of kinship estimates against it
+with precision and recall per relationship degree.
+"""
+
+import csv
+import math
+from ancestry_utils.arrays import open_file
+
+DEGREES = ('duplicate', 'first', 'second', 'third', 'unrelated')
+# lower kinship bounds of each degree but unrelated, as in the KING manual
+DEGREE_KINSHIP_BOUNDS = (0.354, 0.177, 0.0884, 0.0442)
+# kinship of duplicates and of first, second and third degree relatives
+DEGREE_KINSHIP = {'duplicate': 0.5, 'first': 0.25, 'second': 0.125, 'third': 0.0625}
+RELATIVE_COLUMNS = {
+    'Siblings': 'first',
+    'Second Order': 'second',
+    'Third Order': 'third',
+}
+
+
+def kinship_degree(kinship):
+    """
+    Relationship degree (one of `DEGREES`) inferred from a kinship estimate, or
+    'unrelated' if it is None or NaN.
+    """
+    if kinship is None or math.isnan(kinship):
+        return 'unrelated'
+    return DEGREES[sum(kinship < bound for bound in DEGREE_KINSHIP_BOUNDS)]
+
+
+def _ids(value):
+    return [s.strip() for s in value.split(',') if s.strip() not in ('', '0')]
+
+
+def _pair(i, j):
+    return (i, j) if i < j else (j, i)
+
+
+def read_pedigree(path):
+    """Rows of a pedigree file as dicts keyed by its header."""
+    with open_file(path, 'r') as f:
+        return list(csv.DictReader(f, delimiter='\t'))
+
+
+def relationship_graph(path):
+    """
+    Index the relationships of a pedigree file. Returns a dict with the known
+    `parents` of each individual (father, mother; None if unknown), the
+    `families` as lists of individuals connected through parent links, and the
+    `relatives` listed in the sibling and second and third order columns as a
+    dict of ordered pairs to degree.
+    """
+    parents = {}
+    relatives = {}
+    for row in read_pedigree(path):
+        sample = row['Individual ID']
+        father, mother = (
+            (_ids(row[column]) or [None])[0]
+            for column in ('Paternal ID', 'Maternal ID')
+        )
+        parents[sample] = (father, mother)
+        for column, degree in RELATIVE_COLUMNS.items():
+            for relative in _ids(row[column]):
+                if relative != sample:
+                    pair = _pair(sample, relative)
+                    if DEGREES.index(degree) < DEGREES.index(
+                        relatives.get(pair, 'unrelated')
+                    ):
+                        relatives[pair] = degree
+    for father, mother in list(parents.values()):
+        for parent in (father, mother):
+            if parent is not None:
+                parents.setdefault(parent, (None, None))
+
+    # families are the connected components of the parent links (union-find)
+    root = {sample: sample for sample in parents}
+
+    def find(sample):
+        while root[sample] != sample:
+            root[sample] = root[root[sample]]
+            sample = root[sample]
+        return sample
+
+    for sample, sample_parents in parents.items():
+        for parent in sample_parents:
+            if parent is not None:
+                root[find(parent)] = find(sample)
+    families = {}
+    for sample in parents:
+        families.setdefault(find(sample), []).append(sample)
+    return {
+        'parents': parents,
+        'families': sorted(families.values(), key=len, reverse=True),
+        'relatives': relatives,
+    }
+
+
+def _family_kinship(family, parents):
+    """Kinship coefficient of every pair of distinct individuals of a family."""
+    depth = {}
+
+    def generation(sample):
+        if sample not in depth:
+            depth[sample] = 0
+            known = [p for p in parents[sample] if p is not None]
+            depth[sample] = 1 + max(map(generation, known)) if known else 0
+        return depth[sample]
+
+    memo = {}
+
+    def kinship(a, b):
+        if a == b:
+            father, mother = parents[a]
+            if father is None or mother is None:
+                return 0.5
+            return 0.5 * (1 + kinship(father, mother))
+        if generation(a) < generation(b):
+            a, b = b, a
+        key = (a, b)
+        if key not in memo:
+            # a is not an ancestor of b, so a's kinship with b is the mean of
+            # its parents' kinship with b
+            memo[key] = 0.5 * sum(
+                kinship(parent, b) for parent in parents[a] if parent is not None
+            )
+        return memo[key]
+
+    return {
+        _pair(a, b): kinship(a, b)
+        for k, a in enumerate(family)
+        for b in family[k + 1 :]
+    }
+
+
+def expected_kinship(graph):
+    """
+    Expected kinship of every related pair of the `relationship_graph`, as a
+    dict of ordered pairs to kinship: the kinship derived from the parent links
+    or, if higher, the nominal kinship of the degree they are listed with.
+    """
+    expected = {}
+    for family in graph['families']:
+        for pair, kinship in _family_kinship(family, graph['parents']).items():
+            if kinship > 0:
+                expected[pair] = kinship
+    for pair, degree in graph['relatives'].items():
+        expected[pair] = max(expected.get(pair, 0.0), DEGREE_KINSHIP[degree])
+    return expected
+
+
+def pedigree_pairs(path):
+    """
+    Known related pairs of a pedigree file up to the third degree, as a dict of
+    ordered (i, j) sample pairs to their degree.
+    """
+    pairs = {}
+    for pair, kinship in expected_kinship(relationship_graph(path)).items():
+        degree = kinship_degree(kinship)
+        if degree != 'unrelated':
+            pairs[pair] = degree
+    return pairs
+
+
+def score_kinship(pairs, expected, samples):
+    """
+    Score kinship estimates, given as (i, j, kinship) tuples, against the
+    `expected_kinship` of the pedigree, over the pairs of `samples` (the
+    individuals of the pedigree that were in the dataset). Pairs without an
+    estimate are taken as unrelated.
+
+    Returns a dict with the number of expected, inferred and correctly inferred
+    pairs, precision and recall of each degree and of related pairs of any
+    degree, and the mean absolute error of the estimates of expected related
+    pairs.
+    """
+    samples = set(samples)
+    expected_degrees = {
+        pair: kinship_degree(kinship)
+        for pair, kinship in expected.items()
+        if pair[0] in samples and pair[1] in samples
+    }
+    estimates = {}
+    for i, j, kinship in pairs:
+        if i != j and i in samples and j in samples:
+            estimates[_pair(i, j)] = float(kinship)
+    inferred_degrees = {pair: kinship_degree(k) for pair, k in estimates.items()}
+
+    def summary(is_degree):
+        n_expected = sum(map(is_degree, expected_degrees.values()))
+        n_inferred = sum(map(is_degree, inferred_degrees.values()))
+        n_correct = sum(
+            is_degree(degree) and is_degree(expected_degrees.get(pair, 'unrelated'))
+            for pair, degree in inferred_degrees.items()
+        )
+        return {
+            'n_expected': n_expected,
+            'n_inferred': n_inferred,
+            'n_correct': n_correct,
+            'precision': n_correct / n_inferred if n_inferred else None,
+            'recall': n_correct / n_expected if n_expected else None,
+        }
+
+    scores = {
+        degree: summary(lambda d, degree=degree: d == degree) for degree in DEGREES[:-1]
+    }
+    scores['related'] = summary(lambda d: d != 'unrelated')
+    errors = [
+        abs(estimates[pair] - expected[pair])
+        for pair in expected_degrees
+        if pair in estimates
+    ]
+    scores['mean_absolute_error'] = sum(errors) / len(errors) if errors else None
+    return scores
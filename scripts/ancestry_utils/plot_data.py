@@ -0,0 +1,125 @@
+"""
+Local frames of PCA scores for plotting.
+
+Plot scripts used to collect one PC of the scores table per axis of every figure,
+scanning the table twice per PC pair and colouring. `scores_frame` collects the
+scores and all labels in one pass into a pandas data frame (columns `s`,
+`PC1`..`PCk` and one per label) and caches its columns on local disk, keyed by
+the table path, its version and the names and expressions of the labels, so
+reruns with the same inputs do not read the table at all.
+"""
+
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from ancestry_utils.arrays import load_arrays, save_arrays
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ancestry_plot_data')
+# parts of a rendered IR that differ between sessions: generated field names and
+# the error IDs of function calls and indexing
+_IR_UIDS = re.compile(r'__uid_\d+')
+_IR_ERROR_IDS = re.compile(
+    r'\((Apply\w*|ArrayRef|ArraySlice|Stream\w+|\w*NDArray\w*) -?\d+'
+)
+
+
+def _expr_key(expr):
+    """
+    Rendered IR of a label expression and of the keys of the joins in it, with the
+    generated field names numbered in order of appearance and the error IDs removed.
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    from hail import ir
+
+    joins = expr._ir.search(lambda node: isinstance(node, ir.Join))
+    text = ' '.join(
+        [str(expr._ir)] + [str(key._ir) for join in joins for key in join.join_exprs]
+    )
+    uids = {}
+    text = _IR_UIDS.sub(
+        lambda match: f'__uid_{uids.setdefault(match.group(0), len(uids))}', text
+    )
+    return _IR_ERROR_IDS.sub(r'(\1', text)
+
+
+def _cache_path(path, version, label_keys, cache_dir):
+    key = json.dumps(
+        {'path': path.rstrip('/'), 'version': version, 'labels': label_keys},
+        sort_keys=True,
+    )
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'scores_{digest}.npz')
+
+
+def _frame(arrays):
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    columns = {'s': arrays['s']}
+    for k in range(arrays['scores'].shape[1]):
+        columns[f'PC{k + 1}'] = arrays['scores'][:, k]
+    for name, values in arrays.items():
+        if name.startswith('label_'):
+            columns[name[len('label_') :]] = values
+    return pd.DataFrame(columns)
+
+
+def _collect(ht, label_exprs):
+    """Columns of the scores and labels of `ht`, collected in one pass."""
+    ht = ht.annotate(**{f'label_{name}': expr for name, expr in label_exprs.items()})
+    rows = ht.select('scores', *(f'label_{name}' for name in label_exprs)).collect()
+    arrays = {
+        's': np.array([row.s for row in rows], dtype=str),
+        'scores': np.array([row.scores for row in rows], dtype=np.float64),
+    }
+    for name in label_exprs:
+        values = [row[f'label_{name}'] for row in rows]
+        arrays[f'label_{name}'] = np.array(
+            ['NA' if value is None else value for value in values], dtype=str
+        )
+    return arrays
+
+
+def scores_frame(path, labels=None, version=None, cache_dir=CACHE_DIR):
+    """
+    Scores of the table at `path` (keyed by `s`, with a `scores` array) as a data
+    frame with columns `s`, `PC1`..`PCk` and one column per label. `labels` is a
+    function of the scores table returning a dict of label names to string
+    expressions (e.g. joined from a metadata table); missing labels are 'NA'.
+    The cache is keyed by the label names and expressions too, but `version` (by
+    default the table's modification time) should change whenever the table or
+    the tables the labels are joined from change.
+    """
+    # pylint: disable=import-outside-toplevel
+    import hail as hl
+    from ancestry_utils.stages import table_version
+
+    if version is None:
+        version = table_version(path)
+    ht = hl.read_table(path)
+    label_exprs = labels(ht) if labels else {}
+    label_keys = {name: _expr_key(expr) for name, expr in label_exprs.items()}
+    cache_path = _cache_path(path, version, label_keys, cache_dir)
+    if os.path.exists(cache_path):
+        print(f'Reading cached scores {cache_path}')
+        return _frame(load_arrays(cache_path))
+
+    arrays = _collect(ht, label_exprs)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_arrays(cache_path, **arrays)
+    return _frame(arrays)
+
+
+def table_frame(ht, labels=None):
+    """
+    Like `scores_frame` for a table that has not been written (e.g. the union of
+    projected and reference scores), without caching. `labels` is a dict of label
+    names to string expressions of `ht`.
+    """
+    return _frame(_collect(ht, labels or {}))
+
+
+def pc_pairs(n_pcs):
+    """Consecutive (x, y) PC indices plotted against each other: (0, 1), (1, 2), ..."""
+    return [(pc, pc + 1) for pc in range(n_pcs - 1)]
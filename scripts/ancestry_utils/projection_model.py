@@ -0,0 +1,219 @@
+"""
+Projection models: PCA loadings bundled with the allele frequencies and
+normalisation constants needed to place new samples on the PCA, stored as a single
+compressed NumPy archive. Projecting with a model only needs NumPy, so it runs on
+a single VM without a Spark cluster.
+
+Scores match `ancestry_utils.pca.project_samples`: genotypes are centred by
+twice the allele frequency and scaled by sqrt(n_variants * 2 * af * (1 - af)),
+missing genotypes contribute zero, and the scores are multiplied by the per-PC
+`shrinkage` factors of the loadings table (ones for tables without them, which
+are projected with plain `pc_project`).
+"""
+
+import numpy as np
+from ancestry_utils.arrays import load_arrays, save_arrays
+
+
+def projection_model_table(loadings_ht, mt, path):
+    """
+    `loadings_ht` with the allele frequencies of the samples in `mt` annotated as
+    `pca_af`. The table is persisted as `{path}.ht`, together with the equivalent
+    NumPy model `{path}.npz`, and read back on later calls instead of being
+    recomputed.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    if hl.hadoop_exists(f'{path}.ht/_SUCCESS') and hl.hadoop_exists(f'{path}.npz'):
+        return hl.read_table(f'{path}.ht')
+    mt = mt.annotate_rows(pca_af=hl.agg.mean(mt.GT.n_alt_alleles()) / 2)
+    loadings_ht = loadings_ht.select(
+        'loadings', pca_af=mt.rows()[loadings_ht.key].pca_af
+    )
+    loadings_ht = loadings_ht.checkpoint(f'{path}.ht', overwrite=True)
+    write_projection_model(loadings_ht, f'{path}.npz')
+    return loadings_ht
+
+
+def write_projection_model(loadings_ht, path, **extra_arrays):
+    """
+    Write a loadings table keyed by locus and alleles, with `loadings` and `pca_af`
+    fields and optionally a `shrinkage` global, as a NumPy projection model.
+    `extra_arrays` are stored alongside.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    n_variants = loadings_ht.count()
+    # pc_project ignores variants without loadings or that are monomorphic
+    ht = loadings_ht.filter(
+        hl.is_defined(loadings_ht.loadings)
+        & hl.is_defined(loadings_ht.pca_af)
+        & (loadings_ht.pca_af > 0)
+        & (loadings_ht.pca_af < 1)
+    )
+    rows = ht.select(
+        contig=ht.locus.contig,
+        position=ht.locus.position,
+        ref=ht.alleles[0],
+        alt=ht.alleles[1],
+        loadings=ht.loadings,
+        af=ht.pca_af,
+    ).collect()
+    af = np.array([row.af for row in rows], dtype=np.float64)
+    loadings = np.array([row.loadings for row in rows], dtype=np.float32)
+    if 'shrinkage' in loadings_ht.globals:
+        shrinkage = np.array(hl.eval(loadings_ht.shrinkage), dtype=np.float64)
+    else:
+        shrinkage = np.ones(loadings.shape[1], dtype=np.float64)
+    save_arrays(
+        path,
+        contig=np.array([row.contig for row in rows]),
+        position=np.array([row.position for row in rows], dtype=np.int32),
+        ref=np.array([row.ref for row in rows]),
+        alt=np.array([row.alt for row in rows]),
+        loadings=loadings,
+        mean=2 * af,
+        scale=1 / np.sqrt(n_variants * 2 * af * (1 - af)),
+        shrinkage=shrinkage,
+        **extra_arrays,
+    )
+
+
+def add_reference_populations(path, scores_ht, pop_expr):
+    """
+    Store the sample IDs, PC scores and population labels (`pop_expr`, indexed by
+    `scores_ht`) of reference samples in the model at `path`, for
+    `nearest_populations`.
+    """
+    rows = scores_ht.select(scores=scores_ht.scores, pop=pop_expr).collect()
+    rows = [row for row in rows if row.pop is not None]
+    model = read_projection_model(path)
+    model['reference_s'] = np.array([row.s for row in rows])
+    model['reference_scores'] = np.array([row.scores for row in rows], np.float32)
+    model['reference_pop'] = np.array([row.pop for row in rows])
+    save_arrays(path, **model)
+
+
+def read_projection_model(path):
+    """Read a projection model into a dict of NumPy arrays."""
+    return load_arrays(path)
+
+
+def variant_ids(model):
+    """Model variants as `contig:position:ref:alt` strings, in model order."""
+    return [
+        f'{contig}:{position}:{ref}:{alt}'
+        for contig, position, ref, alt in zip(
+            model['contig'], model['position'], model['ref'], model['alt']
+        )
+    ]
+
+
+def project_dosages(model, dosages, block_size=10000):
+    """
+    Project samples onto the model PCA. `dosages` is a (samples x model variants)
+    array of alternate allele counts, in model variant order, with negative values
+    for missing genotypes. Variants are processed in blocks of `block_size`, so any
+    number of samples can be projected as one matrix multiplication per block.
+    Scores are corrected by the model's `shrinkage` factors, so they are on the
+    same scale as the reference scores.
+    """
+    if 'shrinkage' not in model:
+        raise ValueError(
+            'Projection model has no shrinkage factors, '
+            'rewrite it with write_projection_model'
+        )
+    dosages = np.atleast_2d(dosages)
+    n_model_variants, k = model['loadings'].shape
+    if dosages.shape[1] != n_model_variants:
+        raise ValueError(
+            f'Expected dosages for {n_model_variants} variants, '
+            f'got {dosages.shape[1]}'
+        )
+    scores = np.zeros((dosages.shape[0], k), dtype=np.float64)
+    for start in range(0, n_model_variants, block_size):
+        block = slice(start, start + block_size)
+        dosage_block = dosages[:, block].astype(np.float64)
+        normalised = (dosage_block - model['mean'][block]) * model['scale'][block]
+        normalised[dosage_block < 0] = 0
+        scores += normalised @ model['loadings'][block].astype(np.float64)
+    return scores * model['shrinkage']
+
+
+def nearest_populations(model, scores, n_pcs=10, n_neighbours=20, exclude=()):
+    """
+    Population label of each projected sample, by majority vote of its
+    `n_neighbours` nearest reference samples on the first `n_pcs` PCs, leaving out
+    the reference samples in `exclude`. `scores` must be shrinkage-corrected like
+    the reference scores, as returned by `project_dosages`. Returns a list of
+    (population, fraction of neighbours with that label) tuples.
+    """
+    reference = model['reference_scores'][:, :n_pcs].astype(np.float64)
+    labels = model['reference_pop']
+    if len(exclude) > 0:
+        voters = ~np.isin(model['reference_s'], list(exclude))
+        reference, labels = reference[voters], labels[voters]
+    results = []
+    for sample_scores in np.atleast_2d(scores)[:, :n_pcs]:
+        distances = np.sum((reference - sample_scores) ** 2, axis=1)
+        neighbours = labels[np.argsort(distances)[:n_neighbours]]
+        pops, counts = np.unique(neighbours, return_counts=True)
+        best = np.argmax(counts)
+        results.append((str(pops[best]), counts[best] / len(neighbours)))
+    return results
+
+
+def model_dosages(mt, model):
+    """
+    Alternate allele counts of the samples of `mt`, keyed by locus and alleles, at
+    the model sites, as the sample IDs and a (samples x model variants) array in
+    model order with -1 for missing genotypes, for `project_dosages`.
+    """
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    sites = hl.Table.parallelize(
+        [{'v': v, 'i': i} for i, v in enumerate(variant_ids(model))],
+        hl.tstruct(v=hl.tstr, i=hl.tint32),
+    )
+    sites = sites.key_by(**hl.parse_variant(sites.v)).drop('v')
+    mt = mt.annotate_rows(__i=sites[mt.row_key].i)
+    mt = mt.filter_rows(hl.is_defined(mt.__i)).add_col_index('__j')
+    samples = mt.s.collect()
+    entries = mt.select_entries(
+        __dosage=hl.or_else(mt.GT.n_alt_alleles(), -1)
+    ).entries()
+    calls = entries.aggregate(
+        hl.agg.collect((entries.__j, entries.__i, entries.__dosage))
+    )
+    dosages = np.full((len(samples), len(model['position'])), -1, np.int8)
+    for j, i, dosage in calls:
+        dosages[j, i] = dosage
+    return samples, dosages
+
+
+def check_reference_projection(model, samples, dosages, min_accuracy=0.9):
+    """
+    Check that reference `samples` (e.g. held out of the PCA fit), projected from
+    their `dosages` with `project_dosages`, are assigned their own population by
+    `nearest_populations` when they do not vote themselves. Returns the fraction
+    assigned correctly, and raises a ValueError if it is below `min_accuracy`.
+    """
+    pops = dict(zip(model['reference_s'], model['reference_pop']))
+    labelled = [k for k, s in enumerate(samples) if s in pops]
+    samples = [samples[k] for k in labelled]
+    dosages = np.atleast_2d(dosages)[labelled]
+    assigned = nearest_populations(
+        model, project_dosages(model, dosages), exclude=samples
+    )
+    correct = [pop == pops[s] for s, (pop, _) in zip(samples, assigned)]
+    accuracy = sum(correct) / len(correct)
+    print(
+        f'{sum(correct)} of {len(correct)} projected reference samples '
+        f'assigned their own population'
+    )
+    if accuracy < min_accuracy:
+        raise ValueError(
+            f'Only {accuracy:.1%} of projected reference samples were assigned '
+            f'their own population, expected at least {min_accuracy:.0%}'
+        )
+    return accuracy
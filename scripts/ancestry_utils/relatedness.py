@@ -0,0 +1,171 @@
+"""
+Pruning of related samples from a sparse table of related pairs.
+
+`hl.maximal_independent_set` collects all edges to the driver and ignores the
+kinship and the samples' quality when choosing which sample of a pair to drop.
+`prune_related` splits the graph of related pairs into connected components
+(union-find) and solves each component independently in a process pool:
+components of up to `max_exact_size` samples exactly (fewest samples removed),
+larger ones greedily by removing the sample with the most remaining relatives.
+Ties are broken by a priority per sample, so that reference panel samples, then
+samples with a higher call rate, then samples with a lower total kinship are
+kept.
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+
+def connected_components(pairs):
+    """Group the (i, j, kinship) `pairs` by the connected component of their samples."""
+    parent = {}
+
+    def find(node):
+        root = parent.setdefault(node, node)
+        while root != parent[root]:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    for i, j, _ in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    components = {}
+    for pair in pairs:
+        components.setdefault(find(pair[0]), []).append(pair)
+    return sorted(components.values(), key=len, reverse=True)
+
+
+def _is_independent(kept, edges):
+    return not any(i in kept and j in kept for i, j, _ in edges)
+
+
+def _solve_component(args):
+    """
+    Samples to remove from one component, as (removed samples, method), so that
+    no related pair is left.
+    """
+    edges, priority, max_exact_size = args
+    nodes = sorted(priority, key=lambda n: (priority[n], n))
+    if len(nodes) <= max_exact_size:
+        # nodes are sorted by increasing priority, so of the smallest sets of
+        # samples whose removal leaves no related pair, one that removes
+        # lower-priority samples is found first
+        for size in range(1, len(nodes)):
+            for removed in itertools.combinations(nodes, size):
+                if _is_independent(set(nodes) - set(removed), edges):
+                    return list(removed), 'exact'
+    neighbours = {n: set() for n in nodes}
+    for i, j, _ in edges:
+        neighbours[i].add(j)
+        neighbours[j].add(i)
+    removed = []
+    while any(neighbours.values()):
+        node = max(nodes, key=lambda n: (len(neighbours[n]), [-p for p in priority[n]]))
+        for other in neighbours.pop(node):
+            neighbours[other].discard(node)
+        nodes.remove(node)
+        removed.append(node)
+    return removed, 'greedy'
+
+
+def _priorities(pairs, call_rate, reference_samples):
+    """Priority of each sample of `pairs` to be kept; higher is kept first."""
+    kinship_sum = {}
+    for i, j, kinship in pairs:
+        kinship_sum[i] = kinship_sum.get(i, 0.0) + kinship
+        kinship_sum[j] = kinship_sum.get(j, 0.0) + kinship
+    return {
+        s: (int(s in reference_samples), call_rate.get(s, 0.0), -total)
+        for s, total in kinship_sum.items()
+    }
+
+
+def prune_related(
+    pairs, call_rate=None, reference_samples=(), max_exact_size=12, n_workers=None
+):
+    """
+    Samples to remove so that no two of the remaining samples are related, given
+    the related pairs as (i, j, kinship) tuples. `call_rate` (a dict of sample
+    to call rate) and `reference_samples` (a set of reference panel samples)
+    break ties between otherwise equivalent choices.
+
+    Returns the sorted list of removed samples and a list with the statistics of
+    each connected component: number of samples, pairs and removed samples,
+    maximum kinship, and whether it was solved exactly or greedily.
+    """
+    pairs = [(i, j, float(kinship)) for i, j, kinship in pairs if i != j]
+    priority = _priorities(pairs, call_rate or {}, set(reference_samples))
+    components = connected_components(pairs)
+    tasks = [
+        (edges, {n: priority[n] for i, j, _ in edges for n in (i, j)}, max_exact_size)
+        for edges in components
+    ]
+    if n_workers == 1:
+        results = list(map(_solve_component, tasks))
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(executor.map(_solve_component, tasks, chunksize=16))
+
+    removed = []
+    stats = []
+    for component, (edges, (component_removed, method)) in enumerate(
+        zip(components, results)
+    ):
+        removed.extend(component_removed)
+        stats.append(
+            {
+                'component': component,
+                'n_samples': len({n for i, j, _ in edges for n in (i, j)}),
+                'n_pairs': len(edges),
+                'n_removed': len(component_removed),
+                'max_kinship': max(kinship for _, _, kinship in edges),
+                'method': method,
+            }
+        )
+    print(
+        f'Removing {len(removed)} related samples from {len(components)} '
+        f'connected components'
+    )
+    return sorted(removed), stats
+
+
+def related_pairs(i_expr, j_expr, kinship_expr):
+    """Collect the (i, j, kinship) tuples of a table of related pairs."""
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    ht = i_expr._indices.source  # pylint: disable=protected-access
+    return [
+        tuple(pair)
+        for pair in ht.aggregate(hl.agg.collect((i_expr, j_expr, kinship_expr)))
+    ]
+
+
+def sample_call_rates(call_expr):
+    """Call rate of each sample of the matrix table of `call_expr`, as a dict."""
+    import hail as hl  # pylint: disable=import-outside-toplevel
+
+    mt = call_expr._indices.source  # pylint: disable=protected-access
+    mt = mt.annotate_cols(__call_rate=hl.agg.fraction(hl.is_defined(call_expr)))
+    return dict(mt.aggregate_cols(hl.agg.collect((mt.s, mt.__call_rate))))
+
+
+def write_component_stats(path, stats):
+    """Write the per-component statistics of `prune_related` as a TSV file."""
+    # pylint: disable=import-outside-toplevel
+    from ancestry_utils.arrays import open_file
+
+    columns = (
+        'component',
+        'n_samples',
+        'n_pairs',
+        'n_removed',
+        'max_kinship',
+        'method',
+    )
+    with open_file(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in stats:
+            f.write('\t'.join(str(row[column]) for column in columns) + '\n')
@@ -0,0 +1,62 @@
+"""
+Checkpointed pipeline stages.
+
+Each stage writes its output to a path derived from the stage name and its
+parameters, and records those parameters in a JSON file next to it. Rerunning a
+pipeline reads every stage whose output is complete and resumes at the first
+missing one. Stages should include the paths of their inputs in their
+parameters, so that changing an upstream parameter invalidates the stages that
+depend on it.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+import hail as hl
+
+
+def table_version(path):
+    """
+    Version of a Hail table or matrix table, to key caches on: the modification
+    time of its `_SUCCESS` file, which is written last, so a table rewritten at
+    the same path gets a new version.
+    """
+    return str(hl.hadoop_stat(f'{path.rstrip("/")}/_SUCCESS')['modification_time'])
+
+
+def stage_path(output_dir, name, params, kind='ht'):
+    """Versioned output path of a stage: `{output_dir}/{name}_{digest}.{kind}`."""
+    digest = hashlib.sha256(
+        json.dumps({'name': name, **params}, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:16]
+    return f'{output_dir}/{name}_{digest}.{kind}'
+
+
+def run_stage(output_dir, name, params, compute, kind='ht'):
+    """
+    Return the output of stage `name`, a Hail table (`kind='ht'`) or matrix table
+    (`kind='mt'`), and its checkpoint path. If a complete checkpoint exists for
+    these `params` it is read, otherwise `compute()` is called and its result
+    written.
+    """
+    path = stage_path(output_dir, name, params, kind)
+    read = hl.read_matrix_table if kind == 'mt' else hl.read_table
+    if hl.hadoop_exists(f'{path}/_SUCCESS'):
+        print(f'Stage {name}: reading completed checkpoint {path}')
+        return read(path), path
+
+    print(f'Stage {name}: computing {path}')
+    start = datetime.now()
+    compute().write(path, overwrite=True)
+    with hl.hadoop_open(path.replace(f'.{kind}', '.json'), 'w') as f:
+        json.dump(
+            {
+                'name': name,
+                'params': params,
+                'started': start.isoformat(),
+                'completed': datetime.now().isoformat(),
+            },
+            f,
+            indent=2,
+        )
+    return read(path), path
@@ -0,0 +1,71 @@
+"""
+Fused per-variant QC statistics for variant selection.
+"""
+
+import hail as hl
+
+
+def variant_qc_stats(mt):
+    """
+    Per-variant genotype counts, allele frequency, call rate, inbreeding
+    coefficient and HWE p-value of `mt.GT`, as a row table. Only the genotype
+    counts need a pass over the entries; everything else is derived from them, so
+    `hl.variant_qc` followed by a separate `hl.agg.inbreeding` pass is replaced by
+    one aggregation. The inbreeding coefficient uses the variant's own AF as the
+    prior, like `hl.agg.inbreeding(mt.GT, mt.variant_qc.AF[1])`. AC and AF count
+    all non-reference alleles, which equals `variant_qc.AF[1]` for biallelic sites.
+    """
+    n_samples = mt.count_cols()
+    ht = mt.select_rows(
+        n_called=hl.agg.count_where(hl.is_defined(mt.GT)),
+        n_hom_ref=hl.agg.count_where(mt.GT.is_hom_ref()),
+        n_het=hl.agg.count_where(mt.GT.is_het()),
+        n_hom_var=hl.agg.count_where(mt.GT.is_hom_var()),
+        AC=hl.agg.sum(mt.GT.n_alt_alleles()),
+    ).rows()
+
+    ht = ht.annotate(AN=2 * ht.n_called)
+    ht = ht.annotate(
+        AF=hl.or_missing(ht.AN > 0, ht.AC / ht.AN),
+        call_rate=ht.n_called / n_samples,
+    )
+    expected_homs = ht.n_called * (1 - 2 * ht.AF * (1 - ht.AF))
+    return ht.annotate(
+        f_stat=(ht.n_hom_ref + ht.n_hom_var - expected_homs)
+        / (ht.n_called - expected_homs),
+        p_value_hwe=hl.hardy_weinberg_test(
+            ht.n_hom_ref, ht.n_het, ht.n_hom_var
+        ).p_value,
+    )
+
+
+def hail_variant_qc(qc, n_samples):
+    """
+    The `variant_qc` struct of `hl.variant_qc` and the `IB` struct of
+    `hl.agg.inbreeding`, built from a row `qc` of `variant_qc_stats` of a biallelic
+    site in a dataset of `n_samples` samples, so that matrix tables annotated with
+    them keep the schema their consumers expect (e.g. `variant_qc.AF[1]`).
+    `n_filtered` and the DP and GQ statistics need the entries, so are left out.
+    """
+    hwe = hl.hardy_weinberg_test(qc.n_hom_ref, qc.n_het, qc.n_hom_var)
+    expected_homs = qc.n_called * (1 - 2 * qc.AF * (1 - qc.AF))
+    variant_qc = hl.struct(
+        AF=hl.or_missing(qc.AN > 0, hl.array([1 - qc.AF, qc.AF])),
+        AC=hl.array([hl.int32(qc.AN - qc.AC), hl.int32(qc.AC)]),
+        AN=hl.int32(qc.AN),
+        homozygote_count=hl.array([hl.int32(qc.n_hom_ref), hl.int32(qc.n_hom_var)]),
+        call_rate=qc.call_rate,
+        n_called=qc.n_called,
+        n_not_called=n_samples - qc.n_called,
+        n_het=qc.n_het,
+        n_non_ref=qc.n_het + qc.n_hom_var,
+        het_freq_hwe=hwe.het_freq_hwe,
+        p_value_hwe=hwe.p_value,
+    )
+    inbreeding = hl.struct(
+        f_stat=qc.f_stat,
+        n_called=qc.n_called,
+        expected_homs=expected_homs,
+        observed_homs=qc.n_hom_ref + qc.n_hom_var,
+    )
+    return variant_qc, inbreeding
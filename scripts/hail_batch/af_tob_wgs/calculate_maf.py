@@ -2,6 +2,7 @@
 
 import hail as hl
 from analysis_runner import bucket_path
+from ancestry_utils.densify import read_densified
 
 TOB_WGS = bucket_path('mt/v5.1.mt/')
 
@@ -11,8 +12,7 @@ def query():
 
     hl.init(default_reference='GRCh38')
 
-    tob_wgs = hl.read_matrix_table(TOB_WGS)
-    tob_wgs = hl.experimental.densify(tob_wgs)
+    tob_wgs = read_densified(TOB_WGS)
     tob_wgs = hl.variant_qc(tob_wgs)
     # get MAF > 0.05
     tob_wgs = tob_wgs.filter_rows(tob_wgs.variant_qc.AF[0] < 1)
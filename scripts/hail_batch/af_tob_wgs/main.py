@@ -16,6 +16,7 @@ dataproc.hail_dataproc_job(
     max_age="12h",
     num_secondary_workers=20,
     init=["gs://cpg-common-main/hail_dataproc/install_common.sh"],
+    pyfiles=["../../ancestry_utils"],
     job_name=f"calculate_maf",
     worker_boot_disk_size=200,
 )
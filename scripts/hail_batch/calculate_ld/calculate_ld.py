@@ -1,10 +1,13 @@
 """Calculate ld using the ld_matrix function"""
 
 import hail as hl
-import pandas as pd
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.densify import read_densified
+from ancestry_utils.ld_matrix import export_banded_ld
 
 TOB_WGS = bucket_path('mt/v7.mt/')
+RADIUS = 2000000
+CHUNK_SIZE = 10000
 
 
 def query():
@@ -12,16 +15,21 @@ def query():
 
     hl.init(default_reference='GRCh38')
 
-    tob_wgs = hl.read_matrix_table(TOB_WGS)
-    tob_wgs = hl.experimental.densify(tob_wgs)
-    # filter out constant variants
+    tob_wgs = read_densified(TOB_WGS)
+    # filter to biallelic variants, and out constant variants
     tob_wgs = tob_wgs.filter_rows(hl.len(tob_wgs.alleles) == 2)
-    tob_wgs = tob_wgs.head(30000)
-    ld = hl.ld_matrix(tob_wgs.GT.n_alt_alleles(), tob_wgs.locus, radius=2e6)
-    ld = pd.DataFrame(ld.to_numpy())
-    # save pandas df
-    ld_filename = output_path(f'ld_matrix.csv', 'analysis')
-    ld.to_csv(ld_filename, index=False)
+    tob_wgs = hl.variant_qc(tob_wgs)
+    tob_wgs = tob_wgs.filter_rows(
+        (tob_wgs.variant_qc.AF[1] > 0) & (tob_wgs.variant_qc.AF[1] < 1)
+    )
+    # write the band of the LD matrix within RADIUS as sparse chunks per
+    # chromosome, instead of a dense CSV
+    export_banded_ld(
+        tob_wgs,
+        output_path('ld_matrix', 'analysis'),
+        radius=RADIUS,
+        chunk_size=CHUNK_SIZE,
+    )
 
 
 if __name__ == '__main__':
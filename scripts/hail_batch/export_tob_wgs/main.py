@@ -16,6 +16,7 @@ dataproc.hail_dataproc_job(
     max_age='4h',
     num_secondary_workers=20,
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'export_plink',
     worker_boot_disk_size=200,
 )
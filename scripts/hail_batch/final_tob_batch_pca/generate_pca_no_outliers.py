@@ -1,19 +1,45 @@
 """
 Perform pca on nfe samples from the HGDP/1KG +
-tob-wgs dataset and remove outlier samples.
+tob-wgs dataset and iteratively remove outlier samples.
 Reliant on output from
 ```joint-calling/scripts/ancestry_pca.py```
 """
 
+import hashlib
+import json
+import click
 import hail as hl
+import numpy as np
 import pandas as pd
 from cpg_utils.hail import dataset_path, output_path
-
+from ancestry_utils import numpy_pca
+from ancestry_utils.genotype_cache import (
+    download_genotype_cache,
+    export_genotype_cache,
+    read_genotype_cache,
+)
+from ancestry_utils.outliers import iterative_outlier_removal, write_outliers
+from ancestry_utils.pca import sample_pca_runner
+from ancestry_utils.stages import table_version
 
 HGDP1KG_TOBWGS = dataset_path(f'joint-calling/v7/ancestry/mt_union_hgdp.mt', 'analysis')
 
 
-def query():
+@click.command()
+@click.option(
+    '--backend',
+    type=click.Choice(['numpy', 'hail']),
+    default='numpy',
+    help='PCA on the driver with NumPy, or with hl.hwe_normalized_pca',
+)
+@click.option('--n-pcs', default=10, help='Number of PCs used to flag outliers')
+@click.option(
+    '--n-mads',
+    default=6.0,
+    help='Flag samples further than this many MADs from the median on any PC',
+)
+@click.option('--max-rounds', default=10, help='Maximum number of PCA rounds')
+def query(backend, n_pcs, n_mads, max_rounds):
     """Query script entry point."""
     hl.init(default_reference='GRCh38')
 
@@ -23,98 +49,56 @@ def query():
         (mt.hgdp_1kg_metadata.population_inference.pop == 'nfe')
         | (mt.s.contains('CPG'))
     )
-    # remove outlier samples, as identified by PCA
-    outliers = [
-        'CPG2709',
-        'CPG2881',
-        'CPG3707',
-        'CPG1040',
-        'CPG2261',
-        'CPG9175',
-        'CPG9142',
-        'CPG4804',
-        'CPG2147',
-        'CPG3517',
-        'CPG3608',
-        'CPG2386',
-        'CPG2337',
-        'CPG3699',
-        'CPG786',
-        'CPG927',
-        'CPG3244',
-        'CPG2634',
-        'CPG2311',
-        'HG01628',
-        'NA12892',
-        'HG01694',
-        'HG01695',
-        'HG01669',
-        'HG01527',
-        'HG01630',
-        'CPG10066',
-        'CPG1412',
-        'CPG1677',
-        'CPG1784',
-        'CPG1842',
-        'CPG2329',
-        'CPG2691',
-        'CPG3350',
-        'CPG3467',
-        'CPG4374',
-        'CPG6122',
-        'CPG8250',
-        'CPG9191',
-        'CPG9704',
-        'CPG8532',
-        'CPG1099',
-        'CPG3822',
-        'CPG2519',
-        'HG01697',
-        'HG01757',
-        'HG01704',
-        'v3.1::HG02232',
-        'HG01668',
-        'HG01612',
-        'HG01766',
-        'HG01506',
-        'CPG7633',
-        'CPG1248',
-        'CPG1347',
-        'CPG3731',
-        'HG01626',
-        'HG01500',
-        'HG01619',
-        'HGDP01384',
-        'HG01767',
-        'HG01525',
-        'CPG554',
-        'CPG4994',
-        'CPG5066',
-        'CPG67264',
-        'CPG67504',
-        'CPG1305',
-        'CPG232',
-        'CPG208',
-        'CPG67686',
-        'CPG273',
-        'HG01699',
-        'HGDP01396',
-        'HG01610',
-        'HG01509',
-    ]
-
-    mt = mt.filter_cols(hl.literal(outliers).contains(mt.s), keep=False)
-
     # Remove related samples at the 2nd degree or closer, as indicated by gnomAD
     mt = mt.filter_cols(mt.hgdp_1kg_metadata.gnomad_release | mt.s.startswith('CPG'))
+    # both backends run the PCA on the same biallelic variants
+    mt = mt.filter_rows(hl.len(mt.alleles) == 2)
+    sample_ids = np.array(mt.s.collect())
+
+    if backend == 'hail':
+        run_pca = sample_pca_runner(mt, sample_ids, k=20)
+    else:
+        # a few thousand samples at ~90k sites fit on the driver: export the calls
+        # as packed genotypes and run the PCA with NumPy, which decomposes X^T X
+        # exactly at this size (above 10,000 samples, every round of outlier
+        # removal is warm-started from the previous eigenvectors). The cache is
+        # named after the input matrix table and its version, the row filter and
+        # the sample set, so changing any of them exports again
+        params = {
+            'mt': HGDP1KG_TOBWGS,
+            'mt_version': table_version(HGDP1KG_TOBWGS),
+            'rows': 'biallelic',
+            'samples': sorted(sample_ids.tolist()),
+        }
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8'))
+        cache = export_genotype_cache(
+            mt, output_path(f'genotype_cache/nfe_{digest.hexdigest()[:16]}', 'tmp')
+        )
+        cache = read_genotype_cache(
+            download_genotype_cache(cache, '/tmp/nfe_no_outliers')
+        )
+        sample_ids = cache['samples']
+
+        def run_pca(mask, start):
+            return numpy_pca.hwe_normalized_pca(cache, k=20, samples=mask, start=start)
+
+    # Perform PCA, removing outlier samples until none are left
+    result, mask, outliers = iterative_outlier_removal(
+        run_pca, sample_ids, n_pcs=n_pcs, n_mads=n_mads, max_rounds=max_rounds
+    )
+    write_outliers(output_path('outliers.tsv'), outliers)
+    if backend == 'hail':
+        eigenvalues, _, scores, loadings = result
+    else:
+        eigenvalues, scores, loadings, variants = result
+        eigenvalues = eigenvalues.tolist()
+        scores, loadings = numpy_pca.pca_tables(
+            cache, scores, loadings, variants, samples=mask
+        )
 
-    # Perform PCA
     eigenvalues_path = output_path('eigenvalues.ht')
     scores_path = output_path('scores.ht')
     loadings_path = output_path('loadings.ht')
-    eigenvalues, scores, loadings = hl.hwe_normalized_pca(
-        mt.GT, compute_loadings=True, k=20
-    )
     # turn eigenvalues into pandas df and rename columns
     eigenvalues = pd.DataFrame(eigenvalues)
     eigenvalues = eigenvalues.rename(columns={eigenvalues.columns[0]: 'eigenvalues'})
@@ -124,4 +108,4 @@ def query():
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
@@ -14,8 +14,10 @@ dataproc.hail_dataproc_job(
     batch,
     f'generate_pca_no_outliers.py',
     max_age='4h',
-    num_secondary_workers=20,
+    num_secondary_workers=0,
+    packages=['click'],
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'tob-pca',
     worker_boot_disk_size=200,
 )
@@ -3,6 +3,7 @@
 import click
 import pandas as pd
 import hail as hl
+from ancestry_utils.downsample import downsample_rows
 
 GNOMAD_HGDP_1KG_MT = (
     'gs://gcp-public-data--gnomad/release/3.1/mt/genomes/'
@@ -29,10 +30,13 @@ def query(output):
     filt_mt = mt_qc.filter_rows(
         (mt_qc.variant_qc.call_rate >= 0.99) & (mt_qc.variant_qc.n_non_ref >= 1)
     )
-    nrows = filt_mt.count_rows()
-    # Downsample the dataset to approximately 10k randomly-selected rows
-    # (the input must be a proportion)
-    downsampled_mt = filt_mt.sample_rows(10000 / nrows, seed=12345)
+    # Downsample the dataset to exactly 10k randomly-selected rows, spread
+    # over chromosomes in proportion to their number of variants
+    rows = filt_mt.rows()
+    downsampled_rows = downsample_rows(
+        rows, 10000, seed=12345, stratum_expr=rows.locus.contig
+    )
+    downsampled_mt = filt_mt.semi_join_rows(downsampled_rows)
 
     eigenvalues, scores, loadings = hl.hwe_normalized_pca(
         downsampled_mt.GT, compute_loadings=True, k=20
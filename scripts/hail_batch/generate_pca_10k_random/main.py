@@ -22,6 +22,7 @@ dataproc.hail_dataproc_job(
     max_age='15h',
     num_secondary_workers=100,
     packages=['click'],
+    pyfiles=['../../ancestry_utils'],
     job_name='PCA-loadings',
 )
 
@@ -0,0 +1,40 @@
+"""
+Append newly-sequenced TOB-WGS samples to the joined HGDP/1KG + TOB-WGS matrix
+table, without densifying and joining the existing samples again. Reliant on
+output from
+```
+hgdp1kg_tobwgs_densified_pca_new_variants/
+hgdp_1kg_tob_wgs_densified_pca_new_variants.py
+```
+"""
+
+import hail as hl
+from analysis_runner import bucket_path, output_path
+from ancestry_utils.join import append_samples
+
+
+HGDP1KG_TOBWGS = bucket_path(
+    '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
+)
+TOB_WGS = bucket_path('mt/v7.mt')
+
+
+def query():
+    """Query script entry point."""
+
+    hl.init(default_reference='GRCh38')
+
+    joined = hl.read_matrix_table(HGDP1KG_TOBWGS)
+    appended = append_samples(
+        joined, TOB_WGS, checkpoint_dir=output_path('append_samples', 'tmp')
+    )
+    if appended is None:
+        return
+    mt_path = output_path('hgdp1kg_tobwgs_joined_all_samples.mt')
+    appended.write(mt_path, overwrite=True)
+    n_samples = hl.read_matrix_table(mt_path).count_cols()
+    print(f'Samples in appended matrix table: {n_samples}')
+
+
+if __name__ == '__main__':
+    query()
@@ -0,0 +1,24 @@
+"""Entry point for the analysis runner."""
+
+import os
+import hailtop.batch as hb
+from analysis_runner import dataproc
+
+service_backend = hb.ServiceBackend(
+    billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
+)
+
+batch = hb.Batch(name='append-tob-wgs-samples', backend=service_backend)
+
+dataproc.hail_dataproc_job(
+    batch,
+    'append_tob_wgs_samples.py',
+    max_age='4h',
+    num_secondary_workers=20,
+    init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
+    job_name='append-tob-wgs-samples',
+    worker_boot_disk_size=200,
+)
+
+batch.run()
@@ -1,46 +1,41 @@
 """
-Perform PCA on densified TOB-WGS data. Reliant on output from
-```
-hgdp1kg_tobwgs_densified_pca_new_variants/
-hgdp_1kg_tob_wgs_densified_pca_new_variants.py
-````
+Perform PCA on densified TOB-WGS data, at the variants selected by
+```variant_selection/hgdp_1kg_tob_wgs_variant_selection.py```
 """
 
+import json
+import click
 import hail as hl
 import pandas as pd
-from hail.experimental import lgt_to_gt
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.join import build_joint_matrix
+from ancestry_utils.pca import warm_started_pca
 
-
-TOB_WGS = bucket_path('1kg_hgdp_densify_new_variants/v0/tob_wgs_filtered.mt/')
-GNOMAD_HGDP_1KG_MT = (
-    'gs://gcp-public-data--gnomad/release/3.1/mt/genomes/'
-    'gnomad.genomes.v3.1.hgdp_1kg_subset_dense.mt'
+NEW_VARIANTS = bucket_path(
+    'tob_wgs_hgdp_1kg_variant_selection/v8/tob_wgs_hgdp_1kg_filtered_variants.mt'
 )
+TOB_WGS = bucket_path('mt/v4.mt')
 
 
-def query():
+@click.command()
+@click.option(
+    '--previous-loadings',
+    default=None,
+    help=(
+        'Loadings table of a previous run on nearly the same samples, used to '
+        'warm-start the PCA instead of running hl.hwe_normalized_pca'
+    ),
+)
+@click.option(
+    '--n-iterations', default=3, help='Maximum power iterations when warm-starting'
+)
+def query(previous_loadings, n_iterations):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
 
-    tob_wgs = hl.read_matrix_table(TOB_WGS)
-    hgdp_1kg = hl.read_matrix_table(GNOMAD_HGDP_1KG_MT)
-
-    # keep loci that are contained in the densified, filtered tob-wgs mt
-    hgdp_1kg = hgdp_1kg.semi_join_rows(tob_wgs.rows())
-
-    # Entries and columns must be identical
-    tob_wgs_select = tob_wgs.select_entries(
-        GT=lgt_to_gt(tob_wgs.LGT, tob_wgs.LA)
-    ).select_cols()
-    hgdp_1kg_select = hgdp_1kg.select_entries(hgdp_1kg.GT).select_cols()
-    # Join datasets
-    hgdp1kg_tobwgs_joined = hgdp_1kg_select.union_cols(tob_wgs_select)
-    # Add in metadata information
-    hgdp_1kg_metadata = hgdp_1kg.cols()
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.annotate_cols(
-        hgdp_1kg_metadata=hgdp_1kg_metadata[hgdp1kg_tobwgs_joined.s]
+    hgdp1kg_tobwgs_joined = build_joint_matrix(
+        TOB_WGS, sites_path=NEW_VARIANTS, n_partitions=1000
     )
     # save this for population-level PCAs
     mt_path = output_path('hgdp1kg_tobwgs_joined_all_samples.mt')
@@ -51,13 +46,24 @@ def query():
     eigenvalues_path = output_path('eigenvalues.ht')
     scores_path = output_path('scores.ht')
     loadings_path = output_path('loadings.ht')
-    eigenvalues, scores, loadings = hl.hwe_normalized_pca(
-        hgdp1kg_tobwgs_joined.GT, compute_loadings=True, k=20
-    )
+    if previous_loadings:
+        eigenvalues, scores, loadings, convergence = warm_started_pca(
+            hgdp1kg_tobwgs_joined.GT,
+            hl.read_table(previous_loadings),
+            output_path('normalized_genotypes.bm', 'tmp'),
+            k=20,
+            n_iterations=n_iterations,
+        )
+        with hl.hadoop_open(output_path('pca_convergence.json'), 'w') as f:
+            json.dump(convergence, f, indent=2)
+    else:
+        eigenvalues, scores, loadings = hl.hwe_normalized_pca(
+            hgdp1kg_tobwgs_joined.GT, compute_loadings=True, k=20
+        )
     hl.Table.from_pandas(pd.DataFrame(eigenvalues)).export(eigenvalues_path)
     scores.write(scores_path, overwrite=True)
     loadings.write(loadings_path, overwrite=True)
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
@@ -16,6 +16,8 @@ dataproc.hail_dataproc_job(
     max_age='12h',
     num_secondary_workers=20,
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    packages=['click'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'tobwgs_pca_new_variants',
     worker_boot_disk_size=200,
 )
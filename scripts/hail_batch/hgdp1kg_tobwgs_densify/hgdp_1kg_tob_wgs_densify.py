@@ -1,9 +1,10 @@
 """
-Test densify function on TOB-WGS data.
+Densify TOB-WGS data at the gnomAD loadings sites only.
 """
 
 import click
 import hail as hl
+from ancestry_utils.densify import read_densified
 
 
 GNOMAD_LIFTOVER_LOADINGS = 'gs://cpg-common-main/references/gnomad/gnomad_loadings_90k_liftover.ht'
@@ -25,11 +26,10 @@ def query(output):  # pylint: disable=too-many-locals
     hl.init(default_reference='GRCh38')
 
     hgdp_1kg = hl.read_matrix_table(GNOMAD_HGDP_1KG_MT)
-    tob_wgs = hl.read_matrix_table(TOB_WGS).key_rows_by('locus', 'alleles')
     loadings = hl.read_table(GNOMAD_LIFTOVER_LOADINGS).key_by('locus', 'alleles')
 
-    # filter to loci that are contained in both tables and the loadings after densifying
-    tob_wgs = hl.experimental.densify(tob_wgs)
+    # only densify the loadings sites, then filter to loci contained in both tables
+    tob_wgs = read_densified(TOB_WGS, sites_path=GNOMAD_LIFTOVER_LOADINGS)
     hgdp_1kg = hgdp_1kg.filter_rows(
         hl.is_defined(loadings.index(hgdp_1kg['locus'], hgdp_1kg['alleles']))
         & hl.is_defined(tob_wgs.index_rows(hgdp_1kg['locus'], hgdp_1kg['alleles']))
@@ -4,6 +4,7 @@ Densify TOB-WGS data.
 
 import hail as hl
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.densify import read_densified
 
 
 NEW_VARIANTS = bucket_path(
@@ -22,11 +23,10 @@ def query():
     hl.init(default_reference='GRCh38')
 
     hgdp_1kg = hl.read_matrix_table(GNOMAD_HGDP_1KG_MT)
-    tob_wgs = hl.read_matrix_table(TOB_WGS)
     new_variants = hl.read_matrix_table(NEW_VARIANTS)
 
-    # filter to loci that are contained in both tables and the loadings after densifying
-    tob_wgs = hl.experimental.densify(tob_wgs)
+    # only densify the selected variants, then filter to loci contained in both tables
+    tob_wgs = read_densified(TOB_WGS, sites_path=NEW_VARIANTS)
     hgdp_1kg = hgdp_1kg.filter_rows(
         hl.is_defined(new_variants.index_rows(hgdp_1kg['locus'], hgdp_1kg['alleles']))
         & hl.is_defined(tob_wgs.index_rows(hgdp_1kg['locus'], hgdp_1kg['alleles']))
@@ -17,6 +17,7 @@ dataproc.hail_dataproc_job(
     max_age='12h',
     num_secondary_workers=20,
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'densify_tobwgs_new_variants',
 )
 
@@ -0,0 +1,32 @@
+"""
+Export the hard calls of the joined HGDP/1KG + TOB-WGS samples at the selected
+ancestry sites as a 2-bit packed PLINK genotype cache. Reliant on output from
+```
+variant_selection/hgdp_1kg_tob_wgs_variant_selection.py
+```
+"""
+
+import click
+import hail as hl
+from ancestry_utils.genotype_cache import export_genotype_cache
+
+HGDP1KG_TOBWGS = (
+    'gs://cpg-tob-wgs-main/tob_wgs_hgdp_1kg_variant_selection/v3/'
+    'tob_wgs_hgdp_1kg_filtered_variants.mt'
+)
+
+
+@click.command()
+@click.option('--output', help='GCS output path', required=True)
+def query(output):
+    """Query script entry point."""
+
+    hl.init(default_reference='GRCh38')
+
+    mt = hl.read_matrix_table(HGDP1KG_TOBWGS)
+    mt = mt.filter_rows(hl.len(mt.alleles) == 2)
+    export_genotype_cache(mt, f'{output}/tob_wgs_hgdp_1kg_genotypes')
+
+
+if __name__ == '__main__':
+    query()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,29 @@
+"""Run hgdp1kg_tobwgs_genotype_cache.py using the analysis runner."""
+
+import os
+import hail as hl
+import hailtop.batch as hb
+from analysis_runner import dataproc
+
+OUTPUT = os.getenv('OUTPUT')
+assert OUTPUT
+
+hl.init(default_reference='GRCh38')
+
+service_backend = hb.ServiceBackend(
+    billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
+)
+
+batch = hb.Batch(name='genotype cache', backend=service_backend)
+
+dataproc.hail_dataproc_job(
+    batch,
+    f'hgdp1kg_tobwgs_genotype_cache.py --output={OUTPUT}',
+    max_age='2h',
+    num_secondary_workers=20,
+    packages=['click'],
+    pyfiles=['../../ancestry_utils'],
+    job_name='genotype-cache',
+)
+
+batch.run()
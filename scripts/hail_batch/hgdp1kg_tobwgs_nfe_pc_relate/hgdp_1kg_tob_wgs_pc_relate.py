@@ -4,17 +4,39 @@ tob-wgs datasets.
 
 """
 
+import click
 import hail as hl
 import pandas as pd
 from analysis_runner import bucket_path, output_path
-
+from ancestry_utils.kinship import pc_relate_pairs
+from ancestry_utils.relatedness import (
+    prune_related,
+    related_pairs,
+    sample_call_rates,
+    write_component_stats,
+)
 
 HGDP1KG_TOBWGS = bucket_path(
     '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
 )
+SCORES = bucket_path('1kg_hgdp_densified_pca_new_variants/v0/scores.ht')
 
 
-def query():
+@click.command()
+@click.option(
+    '--scores',
+    default=SCORES,
+    help='PCA scores table of the samples, used instead of recomputing the PCA',
+)
+@click.option(
+    '--recompute-pca',
+    is_flag=True,
+    help='Let pc_relate compute its own PCA and write all pairs, as before',
+)
+@click.option(
+    '--min-kinship', default=0.1, help='Only pairs with at least this kinship are kept'
+)
+def query(scores, recompute_pca, min_kinship):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
@@ -22,22 +44,37 @@ def query():
     mt = hl.read_matrix_table(HGDP1KG_TOBWGS)
 
     # Perform kinship test with pc_relate
-    pc_rel_path = output_path('pc_relate_kinship_estimate.ht')
-    pc_rel = hl.pc_relate(mt.GT, 0.01, k=10, statistics='kin')
-    pc_rel.write(pc_rel_path, overwrite=True)
+    if recompute_pca:
+        pc_rel_path = output_path('pc_relate_kinship_estimate.ht')
+        pc_rel = hl.pc_relate(mt.GT, 0.01, k=10, statistics='kin')
+        pc_rel.write(pc_rel_path, overwrite=True)
+        pc_rel = pc_rel.key_by(i=pc_rel.i.s, j=pc_rel.j.s)
+    else:
+        pc_rel = pc_relate_pairs(
+            mt.GT, hl.read_table(scores), min_kinship=min_kinship, n_pcs=10
+        )
+        pc_rel = pc_rel.checkpoint(
+            output_path('pc_relate_related_pairs.ht'), overwrite=True
+        )
     pairs = pc_rel.filter(pc_rel['kin'] >= 0.125)
-    related_samples_to_remove = hl.maximal_independent_set(pairs.i, pairs.j, False)
-    n_related_samples = related_samples_to_remove.count()
-    print(f'related_samples_to_remove.count() = {n_related_samples}')
+    # keep HGDP/1KG samples, then samples with a higher call rate
+    call_rate = sample_call_rates(mt.GT)
+    related_samples_to_remove, component_stats = prune_related(
+        related_pairs(pairs.i, pairs.j, pairs.kin),
+        call_rate=call_rate,
+        reference_samples={s for s in call_rate if 'TOB' not in s},
+    )
+    print(f'related_samples_to_remove.count() = {len(related_samples_to_remove)}')
+    write_component_stats(
+        output_path('related_components.tsv', 'analysis'), component_stats
+    )
 
     # save as html
-    html = pd.DataFrame(
-        {'removed_individual': related_samples_to_remove.node.s.collect()}
-    ).to_html()
+    html = pd.DataFrame({'removed_individual': related_samples_to_remove}).to_html()
     plot_filename_html = output_path(f'removed_samples.html', 'web')
     with hl.hadoop_open(plot_filename_html, 'w') as f:
         f.write(html)
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
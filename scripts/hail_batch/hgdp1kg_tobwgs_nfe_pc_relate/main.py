@@ -16,6 +16,8 @@ dataproc.hail_dataproc_job(
     max_age='4h',
     num_secondary_workers=20,
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    packages=['click'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'pc-relate',
     worker_boot_disk_size=200,
 )
@@ -18,10 +18,11 @@ batch = hb.Batch(name='hgdp1kg tobwgs pca', backend=service_backend)
 
 dataproc.hail_dataproc_job(
     batch,
-    f'hgdp_1kg_tob_wgs_pca.py --output={OUTPUT}',
+    f'hgdp_1kg_tob_wgs_pca.py --output={OUTPUT} --pca-method=randomized',
     max_age='24h',
     num_workers=50,
     packages=['click'],
+    pyfiles=['../../ancestry_utils'],
     job_name='hgdp1kg-tobwgs-pca',
 )
 
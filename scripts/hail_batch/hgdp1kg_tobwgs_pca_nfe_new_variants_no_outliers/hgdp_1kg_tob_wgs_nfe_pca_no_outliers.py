@@ -1,6 +1,6 @@
 """
 Perform pca on nfe samples from the HGDP/1KG +
-tob-wgs dataset and remove outlier samples.
+tob-wgs dataset and iteratively remove outlier samples.
 Reliant on output from
 
 ```hgdp1kg_tobwgs_densified_pca_new_variants/
@@ -8,9 +8,13 @@ hgdp_1kg_tob_wgs_densified_pca_new_variants.py
 ```
 """
 
+import click
 import hail as hl
+import numpy as np
 import pandas as pd
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.outliers import iterative_outlier_removal, write_outliers
+from ancestry_utils.pca import sample_pca_runner
 
 
 HGDP1KG_TOBWGS = bucket_path(
@@ -18,7 +22,15 @@ HGDP1KG_TOBWGS = bucket_path(
 )
 
 
-def query():
+@click.command()
+@click.option('--n-pcs', default=10, help='Number of PCs used to flag outliers')
+@click.option(
+    '--n-mads',
+    default=6.0,
+    help='Flag samples further than this many MADs from the median on any PC',
+)
+@click.option('--max-rounds', default=10, help='Maximum number of PCA rounds')
+def query(n_pcs, n_mads, max_rounds):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
@@ -29,48 +41,28 @@ def query():
         (mt.hgdp_1kg_metadata.population_inference.pop == 'nfe')
         | (mt.s.contains('TOB'))
     )
-    # remove outlier samples, as identified by PCA
-    outliers = [
-        'TOB1734',
-        'TOB1714',
-        'TOB1126',
-        'TOB1653',
-        'TOB1668',
-        'TOB1681',
-        'TOB1116',
-        'TOB1107',
-        'TOB1635',
-        'HG01628',
-        'TOB1675',
-        'TOB1125',
-        'TOB1762',
-        'TOB1263',
-        'TOB1640',
-        'HG01669',
-        'TOB1795',
-        'TOB1707',
-        'HG01695',
-        'HG01694',
-        'TOB1673',
-        'HG01630',
-    ]
-
-    mt = mt.filter_cols(hl.literal(outliers).contains(mt.s), keep=False)
-
     # Remove related samples at the 2nd degree or closer, as indicated by gnomAD
     mt = mt.filter_cols(mt.hgdp_1kg_metadata.gnomad_release | mt.s.startswith('TOB'))
 
-    # Perform PCA
+    # Perform PCA, removing outlier samples until none are left
+    sample_ids = np.array(mt.s.collect())
+    result, _, outliers = iterative_outlier_removal(
+        sample_pca_runner(mt, sample_ids, k=20),
+        sample_ids,
+        n_pcs=n_pcs,
+        n_mads=n_mads,
+        max_rounds=max_rounds,
+    )
+    eigenvalues, _, scores, loadings = result
+    write_outliers(output_path('outliers.tsv'), outliers)
+
     eigenvalues_path = output_path('eigenvalues.ht')
     scores_path = output_path('scores.ht')
     loadings_path = output_path('loadings.ht')
-    eigenvalues, scores, loadings = hl.hwe_normalized_pca(
-        mt.GT, compute_loadings=True, k=20
-    )
     hl.Table.from_pandas(pd.DataFrame(eigenvalues)).export(eigenvalues_path)
     scores.write(scores_path, overwrite=True)
     loadings.write(loadings_path, overwrite=True)
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
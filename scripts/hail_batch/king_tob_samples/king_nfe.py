@@ -2,16 +2,41 @@
 Estimate kinship coefficient using KING on NFE samples from the HGDP/1KG dataset.
 """
 
+import click
 import hail as hl
 import pandas as pd
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.kinship import blocked_king
+from ancestry_utils.relatedness import (
+    prune_related,
+    related_pairs,
+    sample_call_rates,
+    write_component_stats,
+)
+from ancestry_utils.stages import table_version
 
 HGDP1KG_TOBWGS = bucket_path(
     '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
 )
 
 
-def query():
+@click.command()
+@click.option(
+    '--mode',
+    type=click.Choice(['blocked', 'full']),
+    default='blocked',
+    help=(
+        'Compute KING in sample blocks and keep only related pairs, or write the '
+        'full hl.king kinship matrix'
+    ),
+)
+@click.option(
+    '--min-kinship',
+    default=0.125,
+    help='Kinship above which a pair of samples is related (2nd degree or closer)',
+)
+@click.option('--block-size', default=1000, help='Samples per block in blocked mode')
+def query(mode, min_kinship, block_size):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
@@ -22,26 +47,42 @@ def query():
         | (mt.s.contains('TOB'))
     )
     # Remove related samples (at the 2nd degree or closer)
-    king = hl.king(mt.GT)
-    king_path = output_path('king_kinship_estimate_NFE.ht')
-    king.write(king_path)
-    ht = king.entries()
-    related_samples = ht.filter((ht.s_1 != ht.s) & (ht.phi > 0.125), keep=True)
-    struct = hl.struct(i=related_samples.s_1, j=related_samples.s)
-    struct = struct.annotate(phi=related_samples.phi)
-    related_samples_to_remove = hl.maximal_independent_set(
-        struct.i, struct.j, False  # pylint: disable=E1101
+    if mode == 'blocked':
+        related_samples = blocked_king(
+            mt.GT,
+            output_path('king_blocks', 'tmp'),
+            {'mt': HGDP1KG_TOBWGS, 'mt_version': table_version(HGDP1KG_TOBWGS)},
+            min_kinship=min_kinship,
+            block_size=block_size,
+        )
+        related_samples = related_samples.checkpoint(
+            output_path('king_related_pairs_NFE.ht'), overwrite=True
+        )
+    else:
+        king = hl.king(mt.GT)
+        king_path = output_path('king_kinship_estimate_NFE.ht')
+        king.write(king_path)
+        ht = king.entries()
+        related_samples = ht.filter(
+            (ht.s_1 != ht.s) & (ht.phi > min_kinship), keep=True
+        )
+    # keep HGDP/1KG samples, then samples with a higher call rate
+    call_rate = sample_call_rates(mt.GT)
+    related_samples_to_remove, component_stats = prune_related(
+        related_pairs(related_samples.s_1, related_samples.s, related_samples.phi),
+        call_rate=call_rate,
+        reference_samples={s for s in call_rate if 'TOB' not in s},
+    )
+    print(f'related_samples_to_remove.count() = {len(related_samples_to_remove)}')
+    write_component_stats(
+        output_path('related_components.tsv', 'analysis'), component_stats
     )
-    n_related_samples = related_samples_to_remove.count()
-    print(f'related_samples_to_remove.count() = {n_related_samples}')
     # save as html
-    html = pd.DataFrame(
-        {'related_individual': related_samples_to_remove.node.collect()}
-    ).to_html()
+    html = pd.DataFrame({'related_individual': related_samples_to_remove}).to_html()
     plot_filename_html = output_path(f'related_samples.html', 'web')
     with hl.hadoop_open(plot_filename_html, 'w') as f:
         f.write(html)
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
@@ -1,18 +1,34 @@
 """Generates ld pruning for the HGDP + 1KG dataset"""
 
+import json
 import click
 from gnomad.utils.annotations import annotate_adj
 import hail as hl
+from ancestry_utils.ld_prune import ld_index, prune_from_index, windowed_ld_prune
 
 GNOMAD_HGDP_1KG_MT = (
     'gs://gcp-public-data--gnomad/release/3.1/mt/genomes/'
     'gnomad.genomes.v3.1.hgdp_1kg_subset_dense.mt'
 )
+LD_INDEX_R2_FLOOR = 0.05
+LD_INDEX_BP_WINDOW_SIZE = 500000
 
 
 @click.command()
 @click.option('--output', help='GCS output path', required=True)
-def query(output):
+@click.option(
+    '--method',
+    type=click.Choice(['index', 'windowed', 'hail']),
+    default='hail',
+    help=(
+        'Greedy pruning from the cached LD index, windowed greedy pruning on '
+        'sorted partitions, or hl.ld_prune (default)'
+    ),
+)
+@click.option('--r2', default=0.2, help='Squared correlation threshold')
+@click.option('--bp-window-size', default=500000, help='Window size in bp')
+@click.option('--min-af', default=0.05, help='Minimum alternate allele frequency')
+def query(output, method, r2, bp_window_size, min_af):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
@@ -24,8 +40,31 @@ def query(output):
     mt = mt.filter_entries(mt.adj)
     mt = hl.variant_qc(mt)
     # Filter to common and biallelic variants
-    mt = mt.filter_rows((hl.len(mt.alleles) == 2) & (mt.variant_qc.AF[1] > 0.05))
-    pruned_variant_table = hl.ld_prune(mt.GT, r2=0.2, bp_window_size=500000)
+    mt = mt.filter_rows((hl.len(mt.alleles) == 2) & (mt.variant_qc.AF[1] > min_af))
+    if method == 'index':
+        # computed once per AF cut-off; other thresholds and windows only read it
+        variants_ht, pairs_ht = ld_index(
+            mt.GT,
+            {'mt': GNOMAD_HGDP_1KG_MT, 'adj': True, 'min_af': min_af},
+            r2_floor=LD_INDEX_R2_FLOOR,
+            bp_window_size=LD_INDEX_BP_WINDOW_SIZE,
+        )
+        pruned_variant_table = prune_from_index(
+            variants_ht, pairs_ht, r2, bp_window_size=bp_window_size
+        )
+    elif method == 'windowed':
+        pruned_variant_table, timings = windowed_ld_prune(
+            mt.GT,
+            f'{output}/ld_prune_dosages.ht',
+            r2=r2,
+            bp_window_size=bp_window_size,
+        )
+        with hl.hadoop_open(f'{output}/ld_prune_timings.json', 'w') as f:
+            json.dump(timings, f, indent=2)
+    else:
+        pruned_variant_table = hl.ld_prune(
+            mt.GT, r2=r2, bp_window_size=bp_window_size
+        )
     filtered_mt = mt.filter_rows(hl.is_defined(pruned_variant_table[mt.row_key]))
     # save filtered mt table
     filtered_mt.write(mt_path, overwrite=True)
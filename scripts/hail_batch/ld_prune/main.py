@@ -22,6 +22,7 @@ dataproc.hail_dataproc_job(
     max_age='5h',
     num_secondary_workers=100,
     packages=['click', 'gnomad'],
+    pyfiles=['../../ancestry_utils'],
     job_name='ld-prune',
     worker_boot_disk_size=200,
 )
@@ -19,6 +19,7 @@ dataproc.hail_dataproc_job(
     worker_machine_type='n1-highmem-8',
     packages=['selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'project_wgs_samples',
 )
 
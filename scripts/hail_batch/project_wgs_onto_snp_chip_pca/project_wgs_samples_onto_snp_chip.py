@@ -4,16 +4,16 @@ Project WGS data onto SNP-chip data
 
 import re
 import hail as hl
-import pandas as pd
 from analysis_runner import bucket_path, output_path
 from hail.experimental import pc_project
 from hail.experimental import lgt_to_gt
 from bokeh.plotting import ColumnDataSource, figure
 from bokeh.palettes import Dark2  # pylint: disable=no-name-in-module
 from bokeh.transform import factor_cmap
-from bokeh.resources import CDN
-from bokeh.embed import file_html
-from bokeh.io.export import get_screenshot_as_png
+from ancestry_utils.densify import read_densified
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, scores_frame
+from ancestry_utils.projection_model import projection_model_table
 
 SNP_CHIP = bucket_path(
     'tob_wgs_snp_chip_pca/increase_partitions/v2/snp_chip_10000_partitions.mt'
@@ -27,8 +27,7 @@ def query():  # pylint: disable=too-many-locals
     hl.init(default_reference='GRCh38')
 
     snp_chip = hl.read_matrix_table(SNP_CHIP)
-    tob_wgs = hl.read_matrix_table(TOB_WGS)
-    tob_wgs = hl.experimental.densify(tob_wgs)
+    tob_wgs = read_densified(TOB_WGS)
     tob_wgs = tob_wgs.annotate_entries(GT=lgt_to_gt(tob_wgs.LGT, tob_wgs.LA))
     snp_chip = snp_chip.semi_join_rows(tob_wgs.rows())
     snp_chip_path = output_path('snp_chip_filtered_by_tob_wgs.mt', 'tmp')
@@ -48,19 +47,22 @@ def query():  # pylint: disable=too-many-locals
     tob_wgs = tob_wgs.semi_join_rows(snp_chip.rows())
     tob_wgs_path = output_path('tob_wgs_filtered_by_snp_chip.mt', 'tmp')
     tob_wgs = tob_wgs.checkpoint(tob_wgs_path)
-    snp_chip = snp_chip.annotate_rows(af=hl.agg.mean(snp_chip.GT.n_alt_alleles()) / 2)
-    loadings = loadings.annotate(af=snp_chip.rows()[loadings.key].af)
+    loadings = projection_model_table(
+        loadings, snp_chip, output_path('projection_model', 'tmp')
+    )
     # project WGS samples onto PCA
-    ht = pc_project(tob_wgs.GT, loadings.loadings, loadings.af)
+    ht = pc_project(tob_wgs.GT, loadings.loadings, loadings.pca_af)
     ht_path = output_path('pc_project_tob_wgs.ht', 'tmp')
     ht = ht.checkpoint(ht_path)
     scores = scores.key_by(s=scores.s + '_snp_chip')
-    union_scores = ht.union(scores)
+    union_scores_path = output_path('union_scores.ht', 'tmp')
+    ht.union(scores).write(union_scores_path, overwrite=True)
     variance = [(x / sum(eigenvalues) * 100) for x in eigenvalues]
     variance = [round(x, 2) for x in variance]
 
     # Get partner sample information
-    sample_names = union_scores.s.collect()
+    frame = scores_frame(union_scores_path)
+    sample_names = set(frame['s'])
 
     def sample_type(sample_name):
         if sample_name.endswith('snp_chip'):
@@ -78,16 +80,18 @@ def query():  # pylint: disable=too-many-locals
         return prefix + tech
 
     # plot
-    labels = list(map(sample_type, sample_names))
-    cohort_sample_codes = list(set(labels))
+    frame['label'] = frame['s'].map(sample_type)
+    cohort_sample_codes = sorted(set(frame['label']))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
+    source_filename = output_path('source.tsv', 'tmp')
+    with hl.hadoop_open(source_filename, 'w') as f:
+        frame.to_csv(f, sep='\t', index=False)
 
     # Get number of PCs
     number_of_pcs = len(eigenvalues)
+    figures = {}
 
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         plot = figure(
             title='TOB-WGS + TOB SNP Chip',
             x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
@@ -96,14 +100,12 @@ def query():  # pylint: disable=too-many-locals
         )
         source = ColumnDataSource(
             dict(
-                x=union_scores.scores[pc1].collect(),
-                y=union_scores.scores[pc2].collect(),
-                label=labels,
-                samples=sample_names,
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['label'],
+                samples=frame['s'],
             )
         )
-        source_filename = output_path(f'source_{pc2}.ht', 'tmp')
-        hl.Table.from_pandas(pd.DataFrame(source.data)).export(source_filename)
         plot.circle(
             'x',
             'y',
@@ -116,13 +118,9 @@ def query():  # pylint: disable=too-many-locals
             legend_group='label',
         )
         plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'pc{pc2}', 'web')] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,28 @@
+"""Entry point for the analysis runner."""
+
+import os
+import sys
+import hailtop.batch as hb
+from analysis_runner import dataproc
+
+POP = sys.argv[1] if len(sys.argv) > 1 else ''
+
+service_backend = hb.ServiceBackend(
+    billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
+)
+
+batch = hb.Batch(name=f'reference-panel-pca-{POP}', backend=service_backend)
+
+dataproc.hail_dataproc_job(
+    batch,
+    f'reference_panel_pca.py --pop {POP}' if POP else 'reference_panel_pca.py',
+    max_age='12h',
+    num_secondary_workers=20,
+    packages=['click'],
+    init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
+    job_name=f'reference-panel-pca-{POP}',
+    worker_boot_disk_size=200,
+)
+
+batch.run()
@@ -0,0 +1,100 @@
+"""
+Fit a PCA on HGDP/1KG reference panel samples only, then project the TOB-WGS
+samples onto it. Once the reference PCA exists, adding or removing cohort samples
+only needs the projection step. Reliant on output from
+```hgdp1kg_tobwgs_densified_pca_new_variants/
+hgdp_1kg_tob_wgs_densified_pca_new_variants.py
+```
+"""
+
+import click
+import hail as hl
+import pandas as pd
+from analysis_runner import bucket_path, output_path
+from ancestry_utils.pca import PCA_METHODS, fit_reference_pca, project_samples
+from ancestry_utils.projection_model import (
+    add_reference_populations,
+    check_reference_projection,
+    model_dosages,
+    read_projection_model,
+    write_projection_model,
+)
+
+HGDP1KG_TOBWGS = bucket_path(
+    '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
+)
+# number of held-out reference samples projected with the NumPy model as a check
+N_CHECK_SAMPLES = 100
+
+
+@click.command()
+@click.option('--pop', help='Population to subset from the 1KG (e.g. afr, nfe)')
+@click.option(
+    '--pca-method',
+    type=click.Choice(PCA_METHODS),
+    default='exact',
+    help='Exact or blocked randomized PCA of the reference panel',
+)
+@click.option(
+    '--holdout-fraction',
+    default=0.1,
+    help='Fraction of the reference panel used to correct projection shrinkage',
+)
+def query(pop, pca_method, holdout_fraction):
+    """Query script entry point."""
+
+    hl.init(default_reference='GRCh38')
+
+    mt = hl.read_matrix_table(HGDP1KG_TOBWGS)
+    prefix = f'{pop.lower()}_' if pop else ''
+    loadings_path = output_path(f'{prefix}reference_loadings.ht')
+
+    if not hl.hadoop_exists(f'{loadings_path}/_SUCCESS'):
+        # unrelated HGDP/1KG samples, as indicated by gnomAD
+        ref_mt = mt.filter_cols(
+            hl.is_defined(mt.hgdp_1kg_metadata) & mt.hgdp_1kg_metadata.gnomad_release
+        )
+        if pop:
+            ref_mt = ref_mt.filter_cols(
+                ref_mt.hgdp_1kg_metadata.population_inference.pop == pop.lower()
+            )
+        eigenvalues, scores, loadings = fit_reference_pca(
+            ref_mt, k=20, holdout_fraction=holdout_fraction, method=pca_method
+        )
+        hl.Table.from_pandas(pd.DataFrame(eigenvalues)).export(
+            output_path(f'{prefix}reference_eigenvalues.ht')
+        )
+        scores.write(output_path(f'{prefix}reference_scores.ht'), overwrite=True)
+        loadings.write(loadings_path, overwrite=True)
+
+        # NumPy model with reference populations, for projecting single genomes
+        model_path = output_path(f'{prefix}projection_model.npz')
+        write_projection_model(hl.read_table(loadings_path), model_path)
+        scores = hl.read_table(output_path(f'{prefix}reference_scores.ht'))
+        add_reference_populations(
+            model_path,
+            scores,
+            mt.cols()[scores.s].hgdp_1kg_metadata.population_inference.pop,
+        )
+        # held-out reference samples projected with the NumPy model must be
+        # assigned their own population by the other reference samples
+        held_out = scores.aggregate(
+            hl.agg.filter(scores.held_out, hl.agg.collect(scores.s))
+        )[:N_CHECK_SAMPLES]
+        if held_out:
+            model = read_projection_model(model_path)
+            samples, dosages = model_dosages(
+                ref_mt.filter_cols(hl.literal(set(held_out)).contains(ref_mt.s)),
+                model,
+            )
+            check_reference_projection(model, samples, dosages)
+
+    # project the cohort onto the reference PCA
+    loadings = hl.read_table(loadings_path)
+    cohort_mt = mt.filter_cols(hl.is_missing(mt.hgdp_1kg_metadata))
+    scores = project_samples(cohort_mt, loadings)
+    scores.write(output_path(f'{prefix}projected_scores.ht'), overwrite=True)
+
+
+if __name__ == '__main__':
+    query()  # pylint: disable=no-value-for-parameter
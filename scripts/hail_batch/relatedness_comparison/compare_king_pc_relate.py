@@ -0,0 +1,57 @@
+"""
+Compare the KING and pc_relate kinship estimates of the NFE + TOB-WGS samples
+with each other and with the 1000 Genomes pedigree.
+"""
+
+import json
+import click
+import hail as hl
+from analysis_runner import bucket_path, output_path
+from ancestry_utils.kinship import compare_kinship, read_kinship_pairs
+from ancestry_utils.pedigree import pedigree_pairs
+
+HGDP1KG_TOBWGS = bucket_path(
+    '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
+)
+KING_ESTIMATE_NFE = bucket_path('king/v0/king_related_pairs_NFE.ht')
+PC_RELATE_ESTIMATE_NFE = bucket_path(
+    'tob_wgs_hgdp_1kg_nfe_pc_relate/v0/pc_relate_related_pairs.ht'
+)
+# copy of reports/relatedness_method_test/pedigree.txt
+PEDIGREE = bucket_path('relatedness_method_test/pedigree.txt')
+
+
+@click.command()
+@click.option('--king', default=KING_ESTIMATE_NFE, help='KING kinship estimate')
+@click.option(
+    '--pc-relate', default=PC_RELATE_ESTIMATE_NFE, help='pc_relate kinship estimate'
+)
+@click.option('--pedigree', default=PEDIGREE, help='1000 Genomes pedigree file')
+@click.option(
+    '--min-kinship', default=0.1, help='Kinship at which a pair counts as related'
+)
+def query(king, pc_relate, pedigree, min_kinship):
+    """Query script entry point."""
+
+    hl.init(default_reference='GRCh38')
+
+    samples_ht = hl.read_matrix_table(HGDP1KG_TOBWGS).cols()
+    samples_ht = samples_ht.filter(
+        (samples_ht.hgdp_1kg_metadata.population_inference.pop == 'nfe')
+        | (samples_ht.s.contains('TOB'))
+    )
+    summary = compare_kinship(
+        read_kinship_pairs(king),
+        read_kinship_pairs(pc_relate),
+        pedigree_pairs(pedigree),
+        samples_ht.s.collect(),
+        min_kinship=min_kinship,
+    )
+    summary.update({'king': king, 'pc_relate': pc_relate})
+    print(json.dumps(summary, indent=2))
+    with hl.hadoop_open(output_path('king_pc_relate_comparison.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    query()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,23 @@
+"""Entry point for the analysis runner."""
+
+import os
+import hailtop.batch as hb
+from analysis_runner import dataproc
+
+service_backend = hb.ServiceBackend(
+    billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
+)
+
+batch = hb.Batch(name='king-pc-relate-comparison', backend=service_backend)
+
+dataproc.hail_dataproc_job(
+    batch,
+    'compare_king_pc_relate.py',
+    max_age='2h',
+    init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    packages=['click'],
+    pyfiles=['../../ancestry_utils'],
+    job_name='king-pc-relate-comparison',
+)
+
+batch.run()
@@ -1,74 +1,174 @@
-"""Pipeline for choosing new variants for HGDP/1kG + TOB-WGS data"""
+"""
+Pipeline for choosing new variants for HGDP/1kG + TOB-WGS data.
 
+Every stage writes a versioned checkpoint under `{output}/checkpoints`, so a rerun
+(e.g. after losing preemptible workers) resumes from the last completed stage.
+Variant QC statistics are checkpointed next to the joined matrix table instead.
+"""
+
+import json
 import click
 import hail as hl
-from hail.experimental import lgt_to_gt
-
-GNOMAD_HGDP_1KG_MT = (
-    'gs://gcp-public-data--gnomad/release/3.1/mt/genomes/'
-    'gnomad.genomes.v3.1.hgdp_1kg_subset_dense.mt'
-)
+from ancestry_utils.downsample import downsample_rows, maf_bin
+from ancestry_utils.join import build_joint_matrix, joint_matrix_path
+from ancestry_utils.ld_prune import ld_index, prune_from_index, windowed_ld_prune
+from ancestry_utils.stages import run_stage
+from ancestry_utils.variant_qc import hail_variant_qc, variant_qc_stats
 
 TOB_WGS = 'gs://cpg-tob-wgs-main/mt/v2-raw.mt/'
 
 NUM_ROWS_BEFORE_LD_PRUNE = 200000
+MIN_AF = 0.01
+MIN_CALL_RATE = 0.99
+MIN_F_STAT = -0.25
+LD_PRUNE_R2 = 0.1
+LD_PRUNE_BP_WINDOW_SIZE = 500000
+LD_INDEX_R2_FLOOR = 0.05
+SEED = 12345
 
 
 @click.command()
 @click.option('--output', help='GCS output path', required=True)
-def query(output):  # pylint: disable=too-many-locals
+@click.option(
+    '--ld-prune-method',
+    type=click.Choice(['index', 'windowed', 'hail']),
+    default='hail',
+    help=(
+        'Greedy pruning from the cached LD index, windowed greedy pruning on '
+        'sorted partitions, or hl.ld_prune (default)'
+    ),
+)
+def query(output, ld_prune_method):
     """Query script entry point."""
 
     hl.init(default_reference='GRCh38')
 
-    hgdp_1kg = hl.read_matrix_table(GNOMAD_HGDP_1KG_MT)
-    tob_wgs = hl.read_matrix_table(TOB_WGS).key_rows_by('locus', 'alleles')
-
-    # filter to loci that are contained in both matrix tables after densifying
-    tob_wgs = hl.experimental.densify(tob_wgs)
-
-    # Entries and columns must be identical
-    tob_wgs_select = tob_wgs.select_entries(GT=lgt_to_gt(tob_wgs.LGT, tob_wgs.LA))
-    hgdp_1kg_select = hgdp_1kg.select_entries(hgdp_1kg.GT)
-    hgdp_1kg_select = hgdp_1kg_select.select_cols()
-    # Join datasets
-    hgdp1kg_tobwgs_joined = hgdp_1kg_select.union_cols(tob_wgs_select)
-    # Add in metadata information
-    hgdp_1kg_metadata = hgdp_1kg.cols()
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.annotate_cols(
-        hgdp_1kg_metadata=hgdp_1kg_metadata[hgdp1kg_tobwgs_joined.s]
+    checkpoints = f'{output}/checkpoints'
+    hgdp1kg_tobwgs_joined = build_joint_matrix(TOB_WGS)
+    joined_path, _ = joint_matrix_path(TOB_WGS)
+
+    # QC statistics are stored with the joined matrix table, so that other
+    # pipelines filtering the same join can reuse them
+    variant_qc_ht, variant_qc_path = run_stage(
+        joined_path.rsplit('/', 1)[0],
+        'variant_qc_stats',
+        {'joined': joined_path},
+        lambda: variant_qc_stats(hgdp1kg_tobwgs_joined),
     )
 
     # choose variants based off of gnomAD v3 parameters
-    hgdp1kg_tobwgs_joined = hl.variant_qc(hgdp1kg_tobwgs_joined)
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.annotate_rows(
-        IB=hl.agg.inbreeding(
-            hgdp1kg_tobwgs_joined.GT, hgdp1kg_tobwgs_joined.variant_qc.AF[1]
-        )
+    def filtered_variants():
+        ht = variant_qc_ht
+        return ht.filter(
+            (hl.len(ht.alleles) == 2)
+            & (ht.locus.in_autosome())
+            & (ht.AF > MIN_AF)
+            & (ht.call_rate > MIN_CALL_RATE)
+            & (ht.f_stat > MIN_F_STAT)
+        ).select()
+
+    filtered_ht, filtered_path = run_stage(
+        checkpoints,
+        'filtered_variants',
+        {
+            'variant_qc': variant_qc_path,
+            'min_af': MIN_AF,
+            'min_call_rate': MIN_CALL_RATE,
+            'min_f_stat': MIN_F_STAT,
+        },
+        filtered_variants,
     )
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.filter_rows(
-        (hl.len(hgdp1kg_tobwgs_joined.alleles) == 2)
-        & (hgdp1kg_tobwgs_joined.locus.in_autosome())
-        & (hgdp1kg_tobwgs_joined.variant_qc.AF[1] > 0.01)
-        & (hgdp1kg_tobwgs_joined.variant_qc.call_rate > 0.99)
-        & (hgdp1kg_tobwgs_joined.IB.f_stat > -0.25)
+
+    # exactly NUM_ROWS_BEFORE_LD_PRUNE variants, spread over chromosomes and minor
+    # allele frequency bins in proportion to their number of filtered variants
+    def downsampled_variants():
+        ht = filtered_ht
+        af = variant_qc_ht[ht.key].AF
+        return downsample_rows(
+            ht,
+            NUM_ROWS_BEFORE_LD_PRUNE,
+            seed=SEED,
+            stratum_expr=hl.struct(contig=ht.locus.contig, maf_bin=maf_bin(af)),
+        )
+
+    downsampled_ht, downsampled_path = run_stage(
+        checkpoints,
+        'downsampled_variants',
+        {
+            'filtered_variants': filtered_path,
+            'n_rows': NUM_ROWS_BEFORE_LD_PRUNE,
+            'seed': SEED,
+            'strata': ['contig', 'maf_bin'],
+        },
+        downsampled_variants,
     )
 
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.cache()
-    nrows = hgdp1kg_tobwgs_joined.count_rows()
-    print(f'hgdp1kg_tobwgs_joined.count_rows() = {nrows}')
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.sample_rows(
-        NUM_ROWS_BEFORE_LD_PRUNE / nrows, seed=12345
+    def ld_pruned_variants():
+        mt = hgdp1kg_tobwgs_joined.semi_join_rows(downsampled_ht)
+        if ld_prune_method == 'index':
+            # the index only depends on the downsampled variants, so changing the
+            # pruning threshold or window does not read genotypes again
+            variants_ht, pairs_ht = ld_index(
+                mt.GT,
+                {'downsampled_variants': downsampled_path},
+                r2_floor=LD_INDEX_R2_FLOOR,
+                bp_window_size=LD_PRUNE_BP_WINDOW_SIZE,
+            )
+            return prune_from_index(
+                variants_ht,
+                pairs_ht,
+                LD_PRUNE_R2,
+                bp_window_size=LD_PRUNE_BP_WINDOW_SIZE,
+            )
+        if ld_prune_method == 'hail':
+            return hl.ld_prune(
+                mt.GT, r2=LD_PRUNE_R2, bp_window_size=LD_PRUNE_BP_WINDOW_SIZE
+            )
+        pruned, timings = windowed_ld_prune(
+            mt.GT,
+            f'{checkpoints}/ld_prune_dosages.ht',
+            r2=LD_PRUNE_R2,
+            bp_window_size=LD_PRUNE_BP_WINDOW_SIZE,
+        )
+        with hl.hadoop_open(f'{checkpoints}/ld_prune_timings.json', 'w') as f:
+            json.dump(timings, f, indent=2)
+        return pruned
+
+    pruned_variant_table, pruned_path = run_stage(
+        checkpoints,
+        'ld_pruned_variants',
+        {
+            'downsampled_variants': downsampled_path,
+            'r2': LD_PRUNE_R2,
+            'bp_window_size': LD_PRUNE_BP_WINDOW_SIZE,
+            'method': ld_prune_method,
+        },
+        ld_pruned_variants,
     )
 
-    pruned_variant_table = hl.ld_prune(
-        hgdp1kg_tobwgs_joined.GT, r2=0.1, bp_window_size=500000
+    # the final matrix table keeps its name for downstream scripts, so record the
+    # checkpoints it was built from and rewrite it whenever they change
+    mt_path = f'{output}/tob_wgs_hgdp_1kg_filtered_variants.mt'
+    params_path = mt_path.replace('.mt', '.json')
+    params = {'variant_qc': variant_qc_path, 'ld_pruned_variants': pruned_path}
+    if hl.hadoop_exists(f'{mt_path}/_SUCCESS') and hl.hadoop_exists(params_path):
+        with hl.hadoop_open(params_path) as f:
+            if json.load(f) == params:
+                print(f'{mt_path} is up to date')
+                return
+
+    # same variant_qc and IB fields as hl.variant_qc and hl.agg.inbreeding
+    variant_qc, inbreeding = hail_variant_qc(
+        variant_qc_ht[hgdp1kg_tobwgs_joined.row_key],
+        hgdp1kg_tobwgs_joined.count_cols(),
     )
-    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.filter_rows(
-        hl.is_defined(pruned_variant_table[hgdp1kg_tobwgs_joined.row_key])
+    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.annotate_rows(
+        variant_qc=variant_qc, IB=inbreeding
     )
-    mt_path = f'{output}/tob_wgs_hgdp_1kg_filtered_variants.mt'
-    hgdp1kg_tobwgs_joined.write(mt_path)
+    hgdp1kg_tobwgs_joined = hgdp1kg_tobwgs_joined.semi_join_rows(pruned_variant_table)
+    hgdp1kg_tobwgs_joined.write(mt_path, overwrite=True)
+    with hl.hadoop_open(params_path, 'w') as f:
+        json.dump(params, f, indent=2)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 """Run hgdp_1kg_tob_wgs_variant_selection.py using the analysis runner."""
 
 import os
+import sys
 import hail as hl
 import hailtop.batch as hb
 from analysis_runner import dataproc
@@ -10,6 +11,8 @@ assert OUTPUT
 
 hl.init(default_reference='GRCh38')
 
+MIN_AF = sys.argv[1] if len(sys.argv) > 1 else '0.001'
+
 service_backend = hb.ServiceBackend(
     billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
 )
@@ -18,11 +21,13 @@ batch = hb.Batch(name='variant selection exploration', backend=service_backend)
 
 dataproc.hail_dataproc_job(
     batch,
-    f'hgdp_1kg_tob_wgs_variant_selection_exploration.py --output={OUTPUT}',
+    f'hgdp_1kg_tob_wgs_variant_selection_exploration.py --output={OUTPUT} '
+    f'--min-af={MIN_AF}',
     max_age='12h',
     num_secondary_workers=20,
     packages=['click', 'selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_phantomjs.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name='variant-selection-exploration',
 )
 
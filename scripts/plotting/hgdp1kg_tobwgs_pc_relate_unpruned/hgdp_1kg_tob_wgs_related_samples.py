@@ -3,103 +3,111 @@ Save scores of related individuals after running pc_relate.
 
 """
 
+import click
 import hail as hl
 import pandas as pd
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.kinship import read_kinship_pairs
+from ancestry_utils.relatedness import (
+    prune_related,
+    related_pairs,
+    write_component_stats,
+)
 
-
+# related pairs written by hail_batch/hgdp1kg_tobwgs_nfe_pc_relate and
+# hail_batch/king_tob_samples, which only hold the pairs above their
+# --min-kinship (0.1 for pc_relate, 0.125 for KING by default)
 PC_RELATE_ESTIMATE_NFE = bucket_path(
-    'tob_wgs_hgdp_1kg_nfe_pc_relate/v0/pc_relate_kinship_estimate.ht'
+    'tob_wgs_hgdp_1kg_nfe_pc_relate/v0/pc_relate_related_pairs.ht'
 )
 PC_RELATE_ESTIMATE_GLOBAL = bucket_path(
     'tob_wgs_hgdp_1kg_pc_relate/v0/pc_relate_kinship_estimate.ht'
 )
-KING_ESTIMATE_NFE = bucket_path('king/v0/king_kinship_estimate_NFE.ht')
-
-
-def query():
-    """Query script entry point."""
-
-    hl.init(default_reference='GRCh38')
-
-    # save relatedness estimates for pc_relate global populations
-    ht = hl.read_table(PC_RELATE_ESTIMATE_GLOBAL)
-    related_samples = ht.filter(ht.kin > 0.1)
-    pc_relate_global = pd.DataFrame(
-        {
-            'i_s': related_samples.i.s.collect(),
-            'j_s': related_samples.j.s.collect(),
-            'kin': related_samples.kin.collect(),
-        }
-    )
-    filename = output_path(f'pc_relate_global_matrix.csv', 'analysis')
-    pc_relate_global.to_csv(filename, index=False)
+KING_ESTIMATE_NFE = bucket_path('king/v0/king_related_pairs_NFE.ht')
 
-    # get maximal independent set
-    pairs = ht.filter(ht['kin'] >= 0.125)
-    related_samples_to_remove = hl.maximal_independent_set(pairs.i, pairs.j, False)
 
-    related_samples = pd.DataFrame(
-        {'removed_individual': related_samples_to_remove.node.s.collect()}
+def remove_related(pairs, column, name):
+    """
+    Prune the related (i, j, kinship) `pairs`, keeping HGDP/1KG samples over
+    TOB-WGS samples, and save the removed samples and the component statistics.
+    """
+    reference_samples = {s for i, j, _ in pairs for s in (i, j) if 'TOB' not in s}
+    related_samples_to_remove, component_stats = prune_related(
+        pairs, reference_samples=reference_samples
     )
-    filename = output_path(f'pc_relate_global_maximal_independent_set.csv', 'analysis')
+    related_samples = pd.DataFrame({column: related_samples_to_remove})
+    filename = output_path(f'{name}_maximal_independent_set.csv', 'analysis')
     related_samples.to_csv(filename, index=False)
+    write_component_stats(
+        output_path(f'{name}_related_components.tsv', 'analysis'), component_stats
+    )
 
-    # save relatedness estimates for pc_relate NFE samples
-    ht = hl.read_table(PC_RELATE_ESTIMATE_NFE)
+
+def save_related(path, name, csv_name, column):
+    """
+    Save the pairs of the kinship estimate at `path` (any table read by
+    `read_kinship_pairs`) with a kinship above 0.1 as a CSV file, and prune the
+    pairs with a kinship of at least 0.125.
+    """
+    ht = read_kinship_pairs(path)
     related_samples = ht.filter(ht.kin > 0.1)
-    pc_relate_nfe = pd.DataFrame(
-        {
-            'i_s': related_samples.i.s.collect(),
-            'j_s': related_samples.j.s.collect(),
-            'kin': related_samples.kin.collect(),
-        }
+    pairs = pd.DataFrame(
+        related_pairs(related_samples.i, related_samples.j, related_samples.kin),
+        columns=['i_s', 'j_s', 'kin'],
     )
-    filename = output_path(f'pc_relate_nfe_matrix.csv', 'analysis')
-    pc_relate_nfe.to_csv(filename, index=False)
+    filename = output_path(csv_name, 'analysis')
+    pairs.to_csv(filename, index=False)
     # get maximal independent set
-    pairs = ht.filter(ht['kin'] >= 0.125)
-    related_samples_to_remove = hl.maximal_independent_set(pairs.i, pairs.j, False)
-    related_samples = pd.DataFrame(
-        {'removed_individual': related_samples_to_remove.node.s.collect()}
+    second_degree_related_samples = ht.filter(ht.kin >= 0.125)
+    remove_related(
+        related_pairs(
+            second_degree_related_samples.i,
+            second_degree_related_samples.j,
+            second_degree_related_samples.kin,
+        ),
+        column,
+        name,
     )
-    filename = output_path(f'pc_relate_nfe_maximal_independent_set.csv', 'analysis')
-    related_samples.to_csv(filename, index=False)
 
-    # save relatedness estimates for KING NFE samples
-    mt = hl.read_matrix_table(KING_ESTIMATE_NFE)
-    ht = mt.entries()
-    # remove entries where samples are identical
-    related_samples = ht.filter(ht.s_1 != ht.s)
-    related_samples = ht.filter(ht.phi > 0.1)
-    king_nfe = pd.DataFrame(
-        {
-            'i_s': related_samples.s_1.collect(),
-            'j_s': related_samples.s.collect(),
-            'kin': related_samples.phi.collect(),
-        }
-    )
-    filename = output_path(f'king_nfe_matrix_90k.csv', 'analysis')
-    king_nfe.to_csv(filename, index=False)
-    # save KING NFE maximal independent set
-    second_degree_related_samples = ht.filter(
-        (ht.s_1 != ht.s) & (ht.phi > 0.125), keep=True
-    )
-    struct = hl.struct(
-        i=second_degree_related_samples.s_1, j=second_degree_related_samples.s
-    )
-    struct = struct.annotate(phi=second_degree_related_samples.phi)
-    related_samples_to_remove = hl.maximal_independent_set(
-        struct.i, struct.j, False  # pylint: disable=E1101
+
+@click.command()
+@click.option(
+    '--pc-relate-global',
+    default=PC_RELATE_ESTIMATE_GLOBAL,
+    help='pc_relate kinship estimate of all samples',
+)
+@click.option(
+    '--pc-relate-nfe',
+    default=PC_RELATE_ESTIMATE_NFE,
+    help='pc_relate kinship estimate of the NFE samples',
+)
+@click.option(
+    '--king-nfe', default=KING_ESTIMATE_NFE, help='KING kinship estimate of NFE'
+)
+def query(pc_relate_global, pc_relate_nfe, king_nfe):
+    """Query script entry point."""
+
+    hl.init(default_reference='GRCh38')
+
+    # save relatedness estimates for pc_relate global populations
+    save_related(
+        pc_relate_global,
+        'pc_relate_global',
+        'pc_relate_global_matrix.csv',
+        'removed_individual',
     )
-    related_samples = pd.DataFrame(
-        {'related_individual': related_samples_to_remove.node.collect()}
+    # save relatedness estimates for pc_relate NFE samples
+    save_related(
+        pc_relate_nfe, 'pc_relate_nfe', 'pc_relate_nfe_matrix.csv', 'removed_individual'
     )
-    filename = output_path(
-        f'king_90k_related_samples_maximal_independent_set.csv', 'analysis'
+    # save relatedness estimates for KING NFE samples
+    save_related(
+        king_nfe,
+        'king_90k_related_samples',
+        'king_nfe_matrix_90k.csv',
+        'related_individual',
     )
-    related_samples.to_csv(filename, index=False)
 
 
 if __name__ == '__main__':
-    query()
+    query()  # pylint: disable=no-value-for-parameter
@@ -15,6 +15,7 @@ dataproc.hail_dataproc_job(
     f'hgdp_1kg_tob_wgs_related_samples.py',
     max_age='2h',
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'related_samples-save',
 )
 
@@ -16,6 +16,7 @@ dataproc.hail_dataproc_job(
     max_age='2h',
     packages=['selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name='new-variants-plot-pca',
 )
 
@@ -3,14 +3,13 @@
 import hail as hl
 import pandas as pd
 from analysis_runner import bucket_path, output_path
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.resources import CDN
-from bokeh.embed import file_html
 from bokeh.transform import factor_cmap
 from bokeh.plotting import ColumnDataSource, figure
 from bokeh.palettes import turbo  # pylint: disable=no-name-in-module
 from bokeh.models import CategoricalColorMapper, HoverTool
-
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, scores_frame
+from ancestry_utils.stages import table_version
 
 HGDP1KG_TOBWGS = bucket_path(
     '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
@@ -29,7 +28,6 @@ def manhattan_loadings(
     collect_all=False,
     n_divisions=500,
 ):
-
     """modify hail manhattan plot"""
     palette = [
         '#1f77b4',
@@ -112,13 +110,23 @@ def query():
 
     hl.init(default_reference='GRCh38')
 
-    scores = hl.read_table(SCORES)
-    scores = scores.annotate(
-        study=hl.if_else(scores.s.contains('TOB'), 'TOB-WGS', 'HGDP-1kG')
+    def labels(scores):
+        metadata = (
+            hl.read_matrix_table(HGDP1KG_TOBWGS).cols()[scores.s].hgdp_1kg_metadata
+        )
+        # TOB-WGS samples have no HGDP/1kG metadata
+        return {
+            'study': hl.if_else(scores.s.contains('TOB'), 'TOB-WGS', 'HGDP-1kG'),
+            'continental_pop': hl.or_else(metadata.population_inference.pop, 'TOB-NFE'),
+            'subpop': hl.or_else(metadata.labeled_subpop, 'TOB-NFE'),
+        }
+
+    # the labels change with the metadata of the joined matrix table
+    frame = scores_frame(
+        SCORES,
+        labels,
+        version=f'{table_version(SCORES)}-{table_version(HGDP1KG_TOBWGS)}',
     )
-    sample_names = scores.s.collect()
-    labels = scores.study.collect()
-    study = list(set(labels))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
     eigenvalues = hl.import_table(EIGENVALUES)
     eigenvalues = eigenvalues.to_pandas()
@@ -129,136 +137,42 @@ def query():
 
     # Get number of PCs
     number_of_pcs = len(eigenvalues)
-
-    # plot by study
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
-        plot = figure(
-            title='Study',
-            x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
-            y_axis_label=f'PC{pc2 + 1} ({variance[pc2]}%)',
-            tooltips=tooltips,
-        )
-        source = ColumnDataSource(
-            dict(
-                x=scores.scores[pc1].collect(),
-                y=scores.scores[pc2].collect(),
-                label=labels,
-                samples=sample_names,
+    figures = {}
+
+    # plot by study, continental population and subpopulation
+    for column, title in (
+        ('study', 'Study'),
+        ('continental_pop', 'Continental Population'),
+        ('subpop', 'Subpopulation'),
+    ):
+        factors = sorted(set(frame[column]))
+        palette = ['#1b9e77', '#d95f02'] if column == 'study' else turbo(len(factors))
+        for pc1, pc2 in pc_pairs(number_of_pcs):
+            plot = figure(
+                title=title,
+                x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
+                y_axis_label=f'PC{pc2 + 1} ({variance[pc2]}%)',
+                tooltips=tooltips,
             )
-        )
-        plot.circle(
-            'x',
-            'y',
-            alpha=0.5,
-            source=source,
-            size=4,
-            color=factor_cmap('label', ['#1b9e77', '#d95f02'], study),
-            legend_group='label',
-        )
-        plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'study_pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'study_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
-
-    # plot by continental population
-    hgdp1kg_tobwgs = hl.read_matrix_table(HGDP1KG_TOBWGS)
-    scores = scores.annotate(
-        continental_pop=hgdp1kg_tobwgs.cols()[
-            scores.s
-        ].hgdp_1kg_metadata.population_inference.pop
-    )
-    labels = scores.continental_pop.collect()
-    # Change TOB-WGS 'none' values to 'TOB-WGS'
-    labels = ['TOB-NFE' if x is None else x for x in labels]
-    continental_population = list(set(labels))
-    tooltips = [('labels', '@label'), ('samples', '@samples')]
-
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
-        plot = figure(
-            title='Continental Population',
-            x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
-            y_axis_label=f'PC{pc2 + 1} ({variance[pc2]}%)',
-            tooltips=tooltips,
-        )
-        source = ColumnDataSource(
-            dict(
-                x=scores.scores[pc1].collect(),
-                y=scores.scores[pc2].collect(),
-                label=labels,
-                samples=sample_names,
+            source = ColumnDataSource(
+                dict(
+                    x=frame[f'PC{pc1 + 1}'],
+                    y=frame[f'PC{pc2 + 1}'],
+                    label=frame[column],
+                    samples=frame['s'],
+                )
             )
-        )
-        plot.circle(
-            'x',
-            'y',
-            alpha=0.5,
-            source=source,
-            size=4,
-            color=factor_cmap(
-                'label', turbo(len(continental_population)), continental_population
-            ),
-            legend_group='label',
-        )
-        plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'continental_pop_pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'continental_pop_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
-
-    # plot by subpopulation
-    scores = scores.annotate(
-        subpop=hgdp1kg_tobwgs.cols()[scores.s].hgdp_1kg_metadata.labeled_subpop
-    )
-    labels = scores.subpop.collect()
-    labels = ['TOB-NFE' if x is None else x for x in labels]
-    sub_population = list(set(labels))
-    tooltips = [('labels', '@label'), ('samples', '@samples')]
-
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
-        plot = figure(
-            title='Subpopulation',
-            x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
-            y_axis_label=f'PC{pc2 + 1} ({variance[pc2]}%)',
-            tooltips=tooltips,
-        )
-        source = ColumnDataSource(
-            dict(
-                x=scores.scores[pc1].collect(),
-                y=scores.scores[pc2].collect(),
-                label=labels,
-                samples=sample_names,
+            plot.circle(
+                'x',
+                'y',
+                alpha=0.5,
+                source=source,
+                size=4,
+                color=factor_cmap('label', palette, factors),
+                legend_group='label',
             )
-        )
-        plot.circle(
-            'x',
-            'y',
-            alpha=0.5,
-            source=source,
-            size=4,
-            color=factor_cmap('label', turbo(len(sub_population)), sub_population),
-            legend_group='label',
-        )
-        plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'subpop_pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'subpop_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+            plot.add_layout(plot.legend[0], 'left')
+            figures[output_path(f'{column}_pc{pc2}', 'web')] = plot
 
     # Plot loadings
     loadings_ht = hl.read_table(LOADINGS)
@@ -270,13 +184,9 @@ def query():
             title='Loadings of PC ' + str(pc),
             collect_all=True,
         )
-        plot_filename = output_path(f'loadings_pc{pc}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'loadings_pc{pc}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'loadings_pc{pc}', 'web')] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
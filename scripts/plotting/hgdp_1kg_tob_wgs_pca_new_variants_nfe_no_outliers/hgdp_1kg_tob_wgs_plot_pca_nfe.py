@@ -7,12 +7,12 @@ removing outliers.
 import hail as hl
 import pandas as pd
 from analysis_runner import bucket_path, output_path
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.resources import CDN
-from bokeh.embed import file_html
 from bokeh.plotting import ColumnDataSource, figure
 from bokeh.transform import factor_cmap
 from bokeh.palettes import turbo  # pylint: disable=no-name-in-module
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, scores_frame
+from ancestry_utils.stages import table_version
 
 HGDP1KG_TOBWGS = bucket_path(
     '1kg_hgdp_densified_pca_new_variants/v0/hgdp1kg_tobwgs_joined_all_samples.mt'
@@ -26,20 +26,22 @@ def query():
 
     hl.init(default_reference='GRCh38')
 
-    mt = hl.read_matrix_table(HGDP1KG_TOBWGS)
-    scores = hl.read_table(SCORES)
-
-    # Filter outliers and related samples
-    mt = mt.semi_join_cols(scores)
-    mt = mt.annotate_cols(scores=scores[mt.s].scores)
-    mt = mt.annotate_cols(study=hl.if_else(mt.s.contains('TOB'), 'TOB-WGS', 'HGDP-1kG'))
+    def labels(scores):
+        metadata = (
+            hl.read_matrix_table(HGDP1KG_TOBWGS).cols()[scores.s].hgdp_1kg_metadata
+        )
+        return {
+            'study': hl.if_else(scores.s.contains('TOB'), 'TOB-WGS', 'HGDP-1kG'),
+            'subpop': hl.or_else(metadata.labeled_subpop, 'TOB-WGS'),
+        }
 
-    # PCA plot must all come from the same object
-    columns = mt.cols()
-    pca_scores = columns.scores
-    labels = columns.study
-    sample_names = columns.s
-    cohort_sample_codes = list(set(labels.collect()))
+    # only the samples left after removing outliers and related samples have scores
+    frame = scores_frame(
+        SCORES,
+        labels,
+        version=f'{table_version(SCORES)}-{table_version(HGDP1KG_TOBWGS)}',
+    )
+    cohort_sample_codes = sorted(set(frame['study']))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
 
     # get percent variance explained
@@ -52,11 +54,10 @@ def query():
 
     # Get number of PCs
     number_of_pcs = len(eigenvalues)
+    figures = {}
 
     print('Making PCA plots labelled by study')
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         print(f'PC{pc1 + 1} vs PC{pc2 + 1}')
         plot = figure(
             title='TOB-WGS + HGDP/1kG Dataset',
@@ -66,10 +67,10 @@ def query():
         )
         source = ColumnDataSource(
             dict(
-                x=pca_scores[pc1].collect(),
-                y=pca_scores[pc2].collect(),
-                label=labels.collect(),
-                samples=sample_names.collect(),
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['study'],
+                samples=frame['s'],
             )
         )
         plot.circle(
@@ -82,26 +83,16 @@ def query():
             legend_group='label',
         )
         plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'study_pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'study_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'study_pc{pc2}', 'web')] = plot
 
     print('Making PCA plots labelled by the subpopulation')
-    labels = columns.hgdp_1kg_metadata.labeled_subpop.collect()
-    labels = ['TOB-WGS' if x is None else x for x in labels]
-    subpopulation = list(set(labels))
+    subpopulation = sorted(set(frame['subpop']))
     # change ordering of subpopulations
     # so TOB-WGS is at the end and glyphs appear on top
     subpopulation.append(subpopulation.pop(subpopulation.index('TOB-WGS')))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
 
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         print(f'PC{pc1 + 1} vs PC{pc2 + 1}')
         plot = figure(
             title='Subpopulation',
@@ -111,10 +102,10 @@ def query():
         )
         source = ColumnDataSource(
             dict(
-                x=pca_scores[pc1].collect(),
-                y=pca_scores[pc2].collect(),
-                label=labels,
-                samples=sample_names.collect(),
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['subpop'],
+                samples=frame['s'],
             )
         )
         plot.circle(
@@ -127,13 +118,9 @@ def query():
             legend_group='label',
         )
         plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'subpopulation_pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'subpopulation_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'subpopulation_pc{pc2}', 'web')] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
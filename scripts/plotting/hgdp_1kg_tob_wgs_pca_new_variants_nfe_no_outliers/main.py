@@ -16,6 +16,7 @@ dataproc.hail_dataproc_job(
     max_age='1h',
     packages=['selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name='no-outliers-plot-pca-nfe',
 )
 
@@ -3,16 +3,15 @@ Project snp-chip samples onto
 combined hgdp/1kg + tob-wgs dataset.
 """
 
-import subprocess
 import click
 import pandas as pd
 import hail as hl
 from hail.experimental import pc_project
 from bokeh.palettes import Dark2  # pylint: disable=no-name-in-module
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.plotting import output_file, save, ColumnDataSource, figure
+from bokeh.plotting import ColumnDataSource, figure
 from bokeh.transform import factor_cmap
-
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, table_frame
 
 SNP_CHIP = 'gs://cpg-tob-wgs-test/snpchip/v1/snpchip_grch38.mt/'
 HGDP1KG_TOBWGS = (
@@ -80,19 +79,16 @@ def query(output, pop):  # pylint: disable=too-many-locals
     variance = variance.round(2)
 
     # plot
-    labels = union_scores.cohort_sample_codes
-    sample_names = union_scores.s
-    cohort_sample_codes = list(set(labels.collect()))
+    frame = table_frame(
+        union_scores, {'cohort_sample_codes': union_scores.cohort_sample_codes}
+    )
+    cohort_sample_codes = sorted(set(frame['cohort_sample_codes']))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
+    figures = {}
     number_of_pcs = len(eigenvalues)
-    union_scores = union_scores.persist()
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
-        plot_filename = (
-            f'{output}/reprocessed_sample_projection_pc' + str(i + 1) + '.png'
-        )
-        if not hl.hadoop_exists(plot_filename):
+    for pc1, pc2 in pc_pairs(number_of_pcs):
+        plot_filename = f'{output}/snp_chip_sample_projection_pc{pc1 + 1}'
+        if not hl.hadoop_exists(f'{plot_filename}.png'):
             plot = figure(
                 title='SNP-Chip Sample Projection',
                 x_axis_label='PC' + str(pc1 + 1) + ' (' + str(variance[pc1]) + '%)',
@@ -101,10 +97,10 @@ def query(output, pop):  # pylint: disable=too-many-locals
             )
             source = ColumnDataSource(
                 dict(
-                    x=union_scores.scores[pc1].collect(),
-                    y=union_scores.scores[pc2].collect(),
-                    label=labels.collect(),
-                    samples=sample_names.collect(),
+                    x=frame[f'PC{pc1 + 1}'],
+                    y=frame[f'PC{pc2 + 1}'],
+                    label=frame['cohort_sample_codes'],
+                    samples=frame['s'],
                 )
             )
             plot.circle(
@@ -119,12 +115,9 @@ def query(output, pop):  # pylint: disable=too-many-locals
                 legend_group='label',
             )
             plot.add_layout(plot.legend[0], 'left')
-            with hl.hadoop_open(plot_filename, 'wb') as f:
-                get_screenshot_as_png(plot).save(f, format='PNG')
-            plot_filename_html = 'snp_chip_sample_projection_pc' + str(i + 1) + '.html'
-            output_file(plot_filename_html)
-            save(plot)
-            subprocess.run(['gsutil', 'cp', plot_filename_html, output], check=False)
+            figures[plot_filename] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
@@ -25,6 +25,7 @@ dataproc.hail_dataproc_job(
     max_age='5h',
     packages=['click', 'selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_phantomjs.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'{POP}-pca-reprocessed',
 )
 
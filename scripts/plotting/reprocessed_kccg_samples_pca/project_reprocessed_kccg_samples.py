@@ -3,23 +3,24 @@ Perform PCA on samples reprocessed using
 the KCCG pipeline.
 """
 
-import subprocess
 import click
 import pandas as pd
 import hail as hl
 from hail.experimental import lgt_to_gt
 from hail.experimental import pc_project
 from bokeh.palettes import Dark2  # pylint: disable=no-name-in-module
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.plotting import output_file, save, ColumnDataSource, figure
+from bokeh.plotting import ColumnDataSource, figure
 from bokeh.transform import factor_cmap
-
+from ancestry_utils.projection_model import projection_model_table
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, table_frame
 
 HGDP1KG_TOBWGS = (
     'gs://cpg-tob-wgs-main/1kg_hgdp_densified_pca/v2/'
     'hgdp1kg_tobwgs_joined_all_samples.mt/'
 )
 LOADINGS = 'gs://cpg-tob-wgs-main/1kg_hgdp_densified_nfe/v0/loadings.ht/'
+PROJECTION_MODEL = 'gs://cpg-tob-wgs-main/1kg_hgdp_densified_nfe/v0/projection_model'
 REPROCESSED_1KG = 'gs://cpg-tob-wgs-test/pipeline_validation/kccg_gatk4/mt/v0.mt'
 SCORES = 'gs://cpg-tob-wgs-main/1kg_hgdp_densified_nfe/v0/scores.ht/'
 EIGENVALUES = 'gs://cpg-tob-wgs-main/1kg_hgdp_densified_nfe/v0/eigenvalues.ht/'
@@ -43,17 +44,16 @@ def query(output, pop):  # pylint: disable=too-many-locals
     else:
         mt = mt.filter_cols(mt.s.contains('TOB'))
 
-    # Get allele-frequency and loadings for pc_project function
-    mt = mt.annotate_rows(af=hl.agg.mean(mt.GT.n_alt_alleles()) / 2)
-    loadings = hl.read_table(LOADINGS)
-    loadings = loadings.annotate(af=mt.rows()[loadings.key].af)
+    # Get allele-frequency and loadings for pc_project function, once per population
+    model_path = f'{PROJECTION_MODEL}_{pop.lower() if pop else "tob"}'
+    loadings = projection_model_table(hl.read_table(LOADINGS), mt, model_path)
     reprocessed_samples = hl.read_matrix_table(REPROCESSED_1KG)
     reprocessed_samples = hl.experimental.densify(reprocessed_samples)
     reprocessed_samples = reprocessed_samples.annotate_entries(
         GT=lgt_to_gt(reprocessed_samples.LGT, reprocessed_samples.LA)
     )
     # Project new genotypes onto loadings
-    ht = pc_project(reprocessed_samples.GT, loadings.loadings, loadings.af)
+    ht = pc_project(reprocessed_samples.GT, loadings.loadings, loadings.pca_af)
     ht = ht.key_by(s=ht.s + '_reprocessed')
     pcs = hl.read_table(SCORES)
     union_scores = ht.union(pcs)
@@ -92,17 +92,15 @@ def query(output, pop):  # pylint: disable=too-many-locals
     variance = variance.round(2)
 
     # plot
-    labels = union_scores.cohort_sample_codes
-    sample_names = union_scores.s
-    cohort_sample_codes = list(set(labels.collect()))
+    frame = table_frame(
+        union_scores, {'cohort_sample_codes': union_scores.cohort_sample_codes}
+    )
+    cohort_sample_codes = sorted(set(frame['cohort_sample_codes']))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
-    for i in range(0, 10):
-        pc1 = i
-        pc2 = i + 1
-        plot_filename = (
-            f'{output}/reprocessed_sample_projection_pc' + str(i + 1) + '.png'
-        )
-        if not hl.hadoop_exists(plot_filename):
+    figures = {}
+    for pc1, pc2 in pc_pairs(11):
+        plot_filename = f'{output}/reprocessed_sample_projection_pc{pc1 + 1}'
+        if not hl.hadoop_exists(f'{plot_filename}.png'):
             plot = figure(
                 title='Reprocessed Sample Projection',
                 x_axis_label='PC' + str(pc1 + 1) + ' (' + str(variance[pc1]) + '%)',
@@ -111,10 +109,10 @@ def query(output, pop):  # pylint: disable=too-many-locals
             )
             source = ColumnDataSource(
                 dict(
-                    x=union_scores.scores[pc1].collect(),
-                    y=union_scores.scores[pc2].collect(),
-                    label=labels.collect(),
-                    samples=sample_names.collect(),
+                    x=frame[f'PC{pc1 + 1}'],
+                    y=frame[f'PC{pc2 + 1}'],
+                    label=frame['cohort_sample_codes'],
+                    samples=frame['s'],
                 )
             )
             plot.circle(
@@ -129,14 +127,9 @@ def query(output, pop):  # pylint: disable=too-many-locals
                 legend_group='label',
             )
             plot.add_layout(plot.legend[0], 'left')
-            with hl.hadoop_open(plot_filename, 'wb') as f:
-                get_screenshot_as_png(plot).save(f, format='PNG')
-            plot_filename_html = (
-                'reprocessed_sample_projection_pc' + str(i + 1) + '.html'
-            )
-            output_file(plot_filename_html)
-            save(plot)
-            subprocess.run(['gsutil', 'cp', plot_filename_html, output], check=False)
+            figures[plot_filename] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
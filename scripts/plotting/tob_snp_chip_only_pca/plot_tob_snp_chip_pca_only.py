@@ -1,14 +1,13 @@
 """Create PCA plots for the combined TOB-WGS/SNP-chip data"""
 
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.resources import CDN
-from bokeh.embed import file_html
 from bokeh.transform import factor_cmap
 from bokeh.plotting import ColumnDataSource, figure
 import pandas as pd
 import hail as hl
 import click
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, scores_frame
 
 SCORES = bucket_path('tob_snp_chip_pca/v0/scores.ht')
 EIGENVALUES = bucket_path('tob_snp_chip_pca/v0/eigenvalues.ht')
@@ -21,15 +20,14 @@ def query():
 
     hl.init(default_reference='GRCh38')
 
-    scores = hl.read_table(SCORES)
+    frame = scores_frame(SCORES)
     tob_wgs = hl.read_matrix_table(TOB_WGS)
-    snp_chip_names = scores.s.collect()
-    wgs_names = tob_wgs.s.collect()
+    wgs_names = set(tob_wgs.s.collect())
 
     def sample_type(sample_name):
         return 'dual_sample' if sample_name in wgs_names else 'snp_chip_only'
 
-    labels = list(map(sample_type, snp_chip_names))
+    frame['label'] = frame['s'].map(sample_type)
 
     # get percent variance explained
     eigenvalues = hl.import_table(EIGENVALUES)
@@ -41,13 +39,12 @@ def query():
 
     # Get number of PCs
     number_of_pcs = len(eigenvalues)
+    figures = {}
 
     # plot
-    cohort_sample_codes = list(set(labels))
+    cohort_sample_codes = sorted(set(frame['label']))
     tooltips = [('labels', '@label'), ('samples', '@samples')]
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         plot = figure(
             title='SNP Chip Samples',
             x_axis_label=f'PC{pc1 + 1} ({variance[pc1]})%)',
@@ -56,10 +53,10 @@ def query():
         )
         source = ColumnDataSource(
             dict(
-                x=scores.scores[pc1].collect(),
-                y=scores.scores[pc2].collect(),
-                label=labels,
-                samples=snp_chip_names,
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['label'],
+                samples=frame['s'],
             )
         )
         plot.circle(
@@ -72,13 +69,9 @@ def query():
             legend_group='label',
         )
         plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path(f'pc{pc2}.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'pc{pc2}', 'web')] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
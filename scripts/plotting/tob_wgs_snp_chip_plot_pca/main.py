@@ -16,6 +16,7 @@ dataproc.hail_dataproc_job(
     max_age='1h',
     packages=['click', 'selenium'],
     init=['gs://cpg-common-main/hail_dataproc/install_common.sh'],
+    pyfiles=['../../ancestry_utils'],
     job_name=f'pca_combined_tob_snp_chip',
 )
 
@@ -1,9 +1,6 @@
 """Create PCA plots for the combined TOB-WGS/SNP-chip data"""
 
 import re
-from bokeh.io.export import get_screenshot_as_png
-from bokeh.resources import CDN
-from bokeh.embed import file_html
 from bokeh.transform import factor_cmap
 from bokeh.plotting import ColumnDataSource, figure
 from bokeh.palettes import Dark2  # pylint: disable=no-name-in-module
@@ -11,6 +8,8 @@ import pandas as pd
 import hail as hl
 import click
 from analysis_runner import bucket_path, output_path
+from ancestry_utils.figures import export_figures
+from ancestry_utils.plot_data import pc_pairs, scores_frame
 
 SCORES = bucket_path('tob_wgs_snp_chip_variant_pca/v6/scores.ht/')
 EIGENVALUES = bucket_path('tob_wgs_snp_chip_variant_pca/v6/eigenvalues.ht')
@@ -22,14 +21,15 @@ def query():  # pylint: disable=too-many-locals
 
     hl.init(default_reference='GRCh38')
 
-    scores = hl.read_table(SCORES)
-    scores = scores.annotate(
-        cohort_sample_codes=hl.if_else(
-            scores.s.contains('snp_chip'), 'snp_chip', 'tob_wgs'
-        )
+    frame = scores_frame(
+        SCORES,
+        lambda scores: {
+            'cohort_sample_codes': hl.if_else(
+                scores.s.contains('snp_chip'), 'snp_chip', 'tob_wgs'
+            )
+        },
     )
-    labels = scores.cohort_sample_codes
-    hover_fields = dict([('s', scores.s)])
+    tooltips = [('labels', '@label'), ('samples', '@samples')]
 
     # get percent variance explained
     eigenvalues = hl.import_table(EIGENVALUES)
@@ -41,30 +41,40 @@ def query():  # pylint: disable=too-many-locals
 
     # Get number of PCs
     number_of_pcs = len(eigenvalues)
+    figures = {}
 
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    cohort_sample_codes = sorted(set(frame['cohort_sample_codes']))
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         print(f'PC{pc1 + 1} vs PC{pc2 + 1}')
-        p = hl.plot.scatter(
-            scores.scores[pc1],
-            scores.scores[pc2],
-            label=labels,
+        p = figure(
             title='TOB-WGS + TOB SNP Chip',
-            xlabel='PC' + str(pc1 + 1) + ' (' + str(variance[pc1]) + '%)',
-            ylabel='PC' + str(pc2 + 1) + ' (' + str(variance[pc2]) + '%)',
-            hover_fields=hover_fields,
+            x_axis_label='PC' + str(pc1 + 1) + ' (' + str(variance[pc1]) + '%)',
+            y_axis_label='PC' + str(pc2 + 1) + ' (' + str(variance[pc2]) + '%)',
+            tooltips=tooltips,
         )
-        plot_filename = output_path('pc' + str(pc2) + '.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(p).save(f, format='PNG')
-        html = file_html(p, CDN, 'my plot')
-        plot_filename_html = output_path(f'pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        source = ColumnDataSource(
+            dict(
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['cohort_sample_codes'],
+                samples=frame['s'],
+            )
+        )
+        p.circle(
+            'x',
+            'y',
+            alpha=0.5,
+            source=source,
+            size=4,
+            color=factor_cmap(
+                'label', Dark2[max(3, len(cohort_sample_codes))], cohort_sample_codes
+            ),
+            legend_group='label',
+        )
+        figures[output_path(f'pc{pc2}', 'web')] = p
 
     # Get partner sample information
-    sample_names = scores.s.collect()
+    sample_names = set(frame['s'])
 
     def sample_type(sample_name):
         if sample_name.endswith('snp_chip'):
@@ -82,18 +92,15 @@ def query():  # pylint: disable=too-many-locals
         return prefix + tech
 
     # save as html
-    labels = list(map(sample_type, sample_names))
-    html = pd.DataFrame({'sample_name': sample_names, 'sample_tech': labels}).to_html()
+    frame['sample_tech'] = frame['s'].map(sample_type)
+    html = frame[['s', 'sample_tech']].rename(columns={'s': 'sample_name'}).to_html()
     plot_filename_html = output_path(f'sample_technology.html', 'web')
     with hl.hadoop_open(plot_filename_html, 'w') as f:
         f.write(html)
 
     # plot
-    cohort_sample_codes = list(set(labels))
-    tooltips = [('labels', '@label'), ('samples', '@samples')]
-    for i in range(0, (number_of_pcs - 1)):
-        pc1 = i
-        pc2 = i + 1
+    cohort_sample_codes = sorted(set(frame['sample_tech']))
+    for pc1, pc2 in pc_pairs(number_of_pcs):
         plot = figure(
             title='Reprocessed Sample Projection',
             x_axis_label='PC' + str(pc1 + 1) + ' (' + str(variance[pc1]) + '%)',
@@ -102,10 +109,10 @@ def query():  # pylint: disable=too-many-locals
         )
         source = ColumnDataSource(
             dict(
-                x=scores.scores[pc1].collect(),
-                y=scores.scores[pc2].collect(),
-                label=labels,
-                samples=sample_names,
+                x=frame[f'PC{pc1 + 1}'],
+                y=frame[f'PC{pc2 + 1}'],
+                label=frame['sample_tech'],
+                samples=frame['s'],
             )
         )
         plot.circle(
@@ -120,13 +127,9 @@ def query():  # pylint: disable=too-many-locals
             legend_group='label',
         )
         plot.add_layout(plot.legend[0], 'left')
-        plot_filename = output_path('technology_type_pc' + str(pc2) + '.png', 'web')
-        with hl.hadoop_open(plot_filename, 'wb') as f:
-            get_screenshot_as_png(plot).save(f, format='PNG')
-        html = file_html(plot, CDN, 'my plot')
-        plot_filename_html = output_path(f'technology_type_pc{pc2}.html', 'web')
-        with hl.hadoop_open(plot_filename_html, 'w') as f:
-            f.write(html)
+        figures[output_path(f'technology_type_pc{pc2}', 'web')] = plot
+
+    export_figures(figures)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,203 @@
+"""
+Place a single newly-sequenced genome on an existing PCA, without a Dataproc
+cluster. Genotypes are read at the projection model sites only, projected with
+NumPy and assigned the population of their nearest reference samples.
+
+Models are written by `ancestry_utils.projection_model` (see the README).
+"""
+
+import gzip
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import click
+import numpy as np
+from ancestry_utils.projection_model import (
+    nearest_populations,
+    project_dosages,
+    read_projection_model,
+    variant_ids,
+)
+
+
+def _model_index(model):
+    """Map (contig, position) to [(ref, alt, model index)]."""
+    index = {}
+    for i, (contig, position, ref, alt) in enumerate(
+        zip(model['contig'], model['position'], model['ref'], model['alt'])
+    ):
+        index.setdefault((str(contig), int(position)), []).append((ref, alt, i))
+    return index
+
+
+def read_vcf_dosages(model, vcf_path, sample=None, absent_as_ref=False):
+    """
+    Alternate allele counts of one sample of a (optionally gzipped) VCF at the
+    model sites, in model order. Sites absent from the VCF are missing (-1), or
+    homozygous reference if `absent_as_ref` is set.
+    """
+    index = _model_index(model)
+    dosages = np.full(len(model['position']), 0 if absent_as_ref else -1, np.int8)
+    opener = gzip.open if vcf_path.endswith('gz') else open
+    sample_column = 9
+    with opener(vcf_path, 'rt') as f:
+        for line in f:
+            if line.startswith('##'):
+                continue
+            if line.startswith('#'):
+                header = line.rstrip('\n').split('\t')
+                if sample:
+                    sample_column = header.index(sample)
+                continue
+            # only split the whole line at model sites
+            contig, position, _ = line.split('\t', 2)
+            if not contig.startswith('chr'):
+                contig = f'chr{contig}'
+            sites = index.get((contig, int(position)))
+            if not sites:
+                continue
+            fields = line.rstrip('\n').split('\t')
+            alts = fields[4].split(',')
+            gt_index = fields[8].split(':').index('GT')
+            gt = fields[sample_column].split(':')[gt_index].replace('|', '/')
+            for ref, alt, i in sites:
+                if ref != fields[3] or alt not in alts:
+                    continue
+                if '.' in gt:
+                    dosages[i] = -1
+                else:
+                    allele = str(alts.index(alt) + 1)
+                    dosages[i] = gt.split('/').count(allele)
+    return dosages
+
+
+def read_hail_dosages(model, path, sample=None):
+    """
+    Alternate allele counts of one sample at the model sites, read with Hail in
+    local mode from a bgen file or a (sparse or dense) matrix table. Sparse
+    matrix tables are densified at the model sites using the reference block
+    table cached for the callset (`ancestry_utils.densify.last_ref_block_end`),
+    so only the rows around those sites are read.
+    """
+    # pylint: disable=import-outside-toplevel
+    import hail as hl
+    from hail.experimental import lgt_to_gt
+    from ancestry_utils.densify import densify_sites, last_ref_block_end
+
+    hl.init(default_reference='GRCh38', quiet=True)
+    sites = hl.Table.parallelize(
+        [{'v': v, 'i': i} for i, v in enumerate(variant_ids(model))],
+        hl.tstruct(v=hl.tstr, i=hl.tint32),
+    )
+    sites = sites.key_by(**hl.parse_variant(sites.v)).drop('v')
+    if path.endswith('.bgen'):
+        mt = hl.import_bgen(path, entry_fields=['GT'], variants=sites)
+    else:
+        mt = hl.read_matrix_table(path).key_rows_by('locus', 'alleles')
+    if sample:
+        mt = mt.filter_cols(mt.s == sample)
+    else:
+        mt = mt.head(None, n_cols=1)
+    if 'END' in mt.entry:
+        mt = densify_sites(mt, sites, last_ref_block_end(path))
+    if 'LGT' in mt.entry:
+        mt = mt.annotate_entries(GT=lgt_to_gt(mt.LGT, mt.LA))
+    mt = mt.annotate_rows(i=sites[mt.row_key].i)
+    entries = mt.filter_rows(hl.is_defined(mt.i)).entries()
+    calls = entries.aggregate(
+        hl.agg.collect((entries.i, hl.or_else(entries.GT.n_alt_alleles(), -1)))
+    )
+    dosages = np.full(len(model['position']), -1, np.int8)
+    for i, dosage in calls:
+        dosages[i] = dosage
+    return dosages
+
+
+def project(model, path, sample=None, absent_as_ref=False):
+    """Project one sample and assign its nearest reference population."""
+    if path.endswith(('.vcf', '.vcf.gz', '.vcf.bgz')):
+        dosages = read_vcf_dosages(model, path, sample, absent_as_ref)
+    else:
+        dosages = read_hail_dosages(model, path, sample)
+    scores = project_dosages(model, dosages)[0]
+    result = {
+        'sample': sample,
+        'n_sites_called': int(np.sum(dosages >= 0)),
+        'n_model_sites': len(dosages),
+        'scores': scores.tolist(),
+    }
+    if 'reference_pop' in model:
+        pop, fraction = nearest_populations(model, scores)[0]
+        result['nearest_population'] = pop
+        result['nearest_population_fraction'] = fraction
+    return result
+
+
+def serve(model, port, host='127.0.0.1'):
+    """
+    Keep the model in memory and answer `POST /project` requests, with a JSON body
+    of the form {"path": ..., "sample": ..., "absent_as_ref": false}. Requests can
+    name any path readable by the server, so it only listens on `host` (by default
+    localhost).
+    """
+
+    class ProjectionHandler(BaseHTTPRequestHandler):
+        """Request handler for the projection endpoint."""
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Project the requested sample."""
+            if self.path != '/project':
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                response = project(
+                    model,
+                    request['path'],
+                    request.get('sample'),
+                    request.get('absent_as_ref', False),
+                )
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                self.send_error(400, str(e))
+                return
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f'Serving projections on {host}:{port}')
+    HTTPServer((host, port), ProjectionHandler).serve_forever()
+
+
+@click.command()
+@click.option('--model', 'model_path', help='Projection model (.npz)', required=True)
+@click.option('--input', 'input_path', help='VCF, bgen or matrix table to project')
+@click.option('--sample', help='Sample to project (default: the first sample)')
+@click.option(
+    '--absent-as-ref',
+    is_flag=True,
+    help='Treat model sites missing from a VCF as homozygous reference',
+)
+@click.option('--serve', 'port', type=int, help='Serve projections on this port')
+@click.option(
+    '--host',
+    default='127.0.0.1',
+    help='Interface to serve projections on (default: localhost only)',
+)
+def main(
+    model_path, input_path, sample, absent_as_ref, port, host
+):  # pylint: disable=too-many-arguments
+    """Project one sample, or serve projections over HTTP."""
+    model = read_projection_model(model_path)
+    if port:
+        serve(model, port, host)
+    elif input_path:
+        print(json.dumps(project(model, input_path, sample, absent_as_ref), indent=2))
+    else:
+        raise click.UsageError('Either --input or --serve is required')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,97 @@
+"""
+Score the kinship estimates in this folder against the 1000 Genomes pedigree,
+with precision and recall per relationship degree. Runs locally in a few
+seconds, e.g. from this folder:
+
+PYTHONPATH=../.. python3 validate_kinship.py
+"""
+
+import csv
+import json
+import re
+import click
+from ancestry_utils.pedigree import (
+    DEGREES,
+    expected_kinship,
+    relationship_graph,
+    score_kinship,
+)
+
+PEDIGREE = 'pedigree.txt'
+SAMPLE_META = 'gnomad.genomes.v3.1.hgdp_1kg_subset.sample_meta.tsv'
+# kinship tables and whether they were computed on all samples or NFE samples
+KINSHIP_TABLES = {
+    'pc_relate_global': ('pc_relate_global_matrix.csv', 'global'),
+    'king_global_10k': ('king_global_matrix_10k.csv', 'global'),
+    'pc_relate_nfe': ('pc_relate_nfe_matrix.csv', 'nfe'),
+    'king_nfe_10k': ('king_nfe_matrix_10k.csv', 'nfe'),
+    'king_nfe_90k': ('king_nfe_matrix_90k.csv', 'nfe'),
+}
+
+
+def sample_id(s):
+    """Sample ID without the gnomAD 'v3.1::' prefix and duplicate suffix."""
+    return re.sub(r'[^0-9]$', '', s.replace('v3.1::', ''))
+
+
+def read_pairs(path):
+    """(i, j, kinship) tuples of a kinship CSV with columns i_s, j_s and kin."""
+    with open(path) as f:
+        return [
+            (sample_id(row['i_s']), sample_id(row['j_s']), float(row['kin']))
+            for row in csv.DictReader(f)
+        ]
+
+
+def tgp_samples(path):
+    """1000 Genomes samples of the HGDP/1kG subset, overall and inferred NFE."""
+    samples = {'global': set(), 'nfe': set()}
+    with open(path) as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            if row['subsets.tgp'] == 'true':
+                samples['global'].add(sample_id(row['s']))
+                if row['population_inference.pop'] == 'nfe':
+                    samples['nfe'].add(sample_id(row['s']))
+    return samples
+
+
+@click.command()
+@click.option(
+    '--table',
+    'tables',
+    multiple=True,
+    type=click.Choice(list(KINSHIP_TABLES)),
+    help='Kinship tables to score (default: all)',
+)
+@click.option('--output', help='Write the scores to this JSON file')
+def main(tables, output):
+    """Score kinship tables against the pedigree."""
+    graph = relationship_graph(PEDIGREE)
+    expected = expected_kinship(graph)
+    samples = {
+        scope: scope_samples & set(graph['parents'])
+        for scope, scope_samples in tgp_samples(SAMPLE_META).items()
+    }
+    scores = {}
+    for name in tables or KINSHIP_TABLES:
+        path, scope = KINSHIP_TABLES[name]
+        scores[name] = score_kinship(read_pairs(path), expected, samples[scope])
+        print(f'{name} ({len(samples[scope])} samples in the pedigree)')
+        print('  degree     expected  inferred  correct  precision  recall')
+        for degree in DEGREES[:-1] + ('related',):
+            row = scores[name][degree]
+            precision, recall = (
+                '-' if row[key] is None else f'{row[key]:.3f}'
+                for key in ('precision', 'recall')
+            )
+            print(
+                f'  {degree:<10} {row["n_expected"]:>8} {row["n_inferred"]:>9} '
+                f'{row["n_correct"]:>8} {precision:>10} {recall:>7}'
+            )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(scores, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
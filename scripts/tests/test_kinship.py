@@ -0,0 +1,62 @@
+"""Tests of the kinship estimates in ancestry_utils.kinship."""
+
+import math
+import pytest
+
+hl = pytest.importorskip('hail')
+
+# pylint: disable=wrong-import-position
+from ancestry_utils.kinship import blocked_king, kinship_degree_expr, ordered_pairs
+from ancestry_utils.pedigree import kinship_degree
+
+
+def _dataset(path):
+    """Small structured genotypes with string sample IDs and a duplicated sample."""
+    mt = hl.balding_nichols_model(3, 12, 300)
+    mt = mt.key_cols_by(s=hl.str('S') + hl.str(mt.sample_idx))
+    dup = mt.filter_cols(mt.s == 'S0')
+    dup = dup.key_cols_by(s=hl.str('S0-dup'))
+    # written out, so both estimates see the same random genotypes
+    return mt.select_cols().union_cols(dup.select_cols()).checkpoint(path)
+
+
+def test_blocked_king_matches_hl_king(tmp_path):
+    mt = _dataset(str(tmp_path / 'genotypes.mt'))
+    expected = hl.king(mt.GT).entries()
+    expected = {(row.s_1, row.s): row.phi for row in expected.collect()}
+    pairs = blocked_king(
+        mt.GT,
+        str(tmp_path / 'king'),
+        {'test': 'king'},
+        min_kinship=-math.inf,
+        block_size=5,
+    ).collect()
+    n_samples = mt.count_cols()
+    assert len(pairs) == n_samples * (n_samples - 1) // 2
+    for row in pairs:
+        assert row.phi == pytest.approx(expected[(row.s_1, row.s)])
+    duplicates = [row.phi for row in pairs if {row.s_1, row.s} == {'S0', 'S0-dup'}]
+    assert duplicates == [pytest.approx(0.5)]
+
+
+def test_ordered_pairs_orders_string_ids():
+    ht = hl.Table.parallelize(
+        [
+            {'a': 'S2', 'b': 'S10', 'phi': 0.2},
+            {'a': 'S10', 'b': 'S2', 'phi': 0.2},
+            {'a': 'S1', 'b': 'S1', 'phi': 0.5},
+        ],
+        hl.tstruct(a=hl.tstr, b=hl.tstr, phi=hl.tfloat64),
+    )
+    pairs = ordered_pairs(ht.a, ht.b, ht.phi).collect()
+    assert [(row.i, row.j, row.kin) for row in pairs] == [('S10', 'S2', 0.2)]
+
+
+def test_kinship_degree_expr_of_missing_kinship():
+    kinships = [None, math.nan, 0.5, 0.3, 0.1, 0.05, 0.01]
+    ht = hl.Table.parallelize(
+        [{'kin': kin} for kin in kinships], hl.tstruct(kin=hl.tfloat64)
+    )
+    degrees = ht.annotate(degree=kinship_degree_expr(ht.kin)).degree.collect()
+    assert degrees == [kinship_degree(kin) for kin in kinships]
+    assert degrees[:2] == ['unrelated', 'unrelated']
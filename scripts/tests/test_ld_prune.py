@@ -0,0 +1,125 @@
+"""Tests of the segmented greedy LD pruning in ancestry_utils.ld_prune."""
+
+from collections import namedtuple
+import numpy as np
+import pytest
+
+pytest.importorskip('hail')
+
+# pylint: disable=wrong-import-position,protected-access
+from ancestry_utils import ld_prune
+
+Row = namedtuple('Row', ['contig', 'position', 'idx', 'alleles', 'dosages'])
+
+R2 = 0.2
+BP_WINDOW_SIZE = 5000
+
+
+def _rows(n_variants=400, n_samples=60, seed=0):
+    """Sorted rows on two contigs, with blocks of correlated variants."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    position = 0
+    haplotypes = rng.random((2, n_samples)) < 0.3
+    for idx in range(n_variants):
+        contig = 'chr1' if idx < n_variants // 2 else 'chr2'
+        if idx == n_variants // 2:
+            position = 0
+        position += int(rng.integers(50, 400))
+        # copy the previous variant with some noise, or start a new block
+        if rng.random() < 0.2:
+            haplotypes = rng.random((2, n_samples)) < rng.uniform(0.05, 0.5)
+        else:
+            flip = rng.random((2, n_samples)) < 0.05
+            haplotypes = haplotypes ^ flip
+        dosages = haplotypes.sum(axis=0).astype(str)
+        dosages[rng.random(n_samples) < 0.02] = ld_prune.MISSING_DOSAGE
+        rows.append(Row(contig, position, idx, ['A', 'C'], ''.join(dosages)))
+    return rows
+
+
+def _segmented_prune(rows, segment_size):
+    """Kept variants of `windowed_ld_prune`, with the Spark shuffle done locally."""
+    starts = [(row.contig, row.position) for row in rows[::segment_size]]
+    segments = [[] for _ in starts]
+    for row in rows:
+        for segment, is_halo in ld_prune._segment_targets(
+            row, starts, segment_size, BP_WINDOW_SIZE
+        ):
+            segments[segment].append((is_halo, row))
+
+    def prune(carries):
+        return {
+            segment: ld_prune._prune_segment(
+                segments[segment], R2, BP_WINDOW_SIZE, carry
+            )
+            for segment, carry in carries.items()
+        }
+
+    results, _ = ld_prune._prune_segments(
+        prune, len(starts), ld_prune._window_carries(starts, BP_WINDOW_SIZE)
+    )
+    return [variant for segment in sorted(results) for variant in results[segment][0]]
+
+
+def _index_prune(rows, segment_size):
+    """Kept idx of `prune_from_index`, with the LD index built locally."""
+    pairs, _ = ld_prune._pair_rows(rows, R2, BP_WINDOW_SIZE)
+    upstream = {}
+    for i, j, _, _ in pairs:
+        upstream.setdefault(j, []).append(i)
+    candidates = [
+        (row.idx, upstream.get(row.idx, []))
+        for row in rows
+        if ld_prune._standardize(row.dosages) is not None
+    ]
+    segments = [
+        candidates[start : start + segment_size]
+        for start in range(0, len(candidates), segment_size)
+    ]
+
+    def prune(carries):
+        return {
+            segment: ld_prune._greedy_segment(segments[segment], carry)
+            for segment, carry in carries.items()
+        }
+
+    results, _ = ld_prune._prune_segments(prune, len(segments), ld_prune._index_carries)
+    return sorted(idx for kept, _ in results.values() for idx in kept)
+
+
+def _r2(a, b):
+    x, y = ld_prune._standardize(a.dosages), ld_prune._standardize(b.dosages)
+    return float(x @ y) ** 2
+
+
+@pytest.mark.parametrize('segment_size', [400, 100, 20, 7, 3, 1])
+def test_segmented_prune_matches_single_pass(segment_size):
+    rows = _rows()
+    single_pass, _, _ = ld_prune._prune_rows(rows, R2, BP_WINDOW_SIZE)
+    assert 0 < len(single_pass) < len(rows)
+    assert _segmented_prune(rows, segment_size) == single_pass
+
+
+@pytest.mark.parametrize('segment_size', [20, 3])
+def test_segmented_prune_keeps_no_pair_in_ld(segment_size):
+    rows = _rows(seed=1)
+    kept = {
+        (contig, position)
+        for contig, position, _ in _segmented_prune(rows, segment_size)
+    }
+    kept_rows = [row for row in rows if (row.contig, row.position) in kept]
+    for i, a in enumerate(kept_rows):
+        for b in kept_rows[i + 1 :]:
+            if b.contig != a.contig or b.position - a.position > BP_WINDOW_SIZE:
+                break
+            assert _r2(a, b) < R2
+
+
+@pytest.mark.parametrize('segment_size', [1000, 50, 7, 1])
+def test_index_prune_matches_single_pass(segment_size):
+    rows = _rows(seed=2)
+    single_pass, _, _ = ld_prune._prune_rows(rows, R2, BP_WINDOW_SIZE)
+    kept = {(contig, position) for contig, position, _ in single_pass}
+    expected = [row.idx for row in rows if (row.contig, row.position) in kept]
+    assert _index_prune(rows, segment_size) == expected
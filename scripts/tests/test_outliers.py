@@ -0,0 +1,23 @@
+"""Tests of the iterative outlier removal in ancestry_utils.outliers."""
+
+import numpy as np
+from ancestry_utils.outliers import iterative_outlier_removal
+
+
+def _run_pca(mask, start):  # pylint: disable=unused-argument
+    """Scores with one extreme sample, whichever samples are left."""
+    n_samples = int(mask.sum())
+    rng = np.random.default_rng(n_samples)
+    scores = rng.normal(size=(n_samples, 2))
+    scores[0] = 100.0
+    return np.ones(2), scores, mask.copy()
+
+
+def test_mask_matches_result_after_max_rounds():
+    sample_ids = [f's{k}' for k in range(50)]
+    result, mask, outliers = iterative_outlier_removal(
+        _run_pca, sample_ids, n_pcs=2, max_rounds=3
+    )
+    assert np.array_equal(result[2], mask)
+    assert len(result[1]) == mask.sum() == 48
+    assert outliers == [('s0', 1), ('s1', 2)]
@@ -0,0 +1,42 @@
+"""Tests of the scores frame cache keys in ancestry_utils.plot_data."""
+
+import pytest
+
+hl = pytest.importorskip('hail')
+
+# pylint: disable=wrong-import-position,protected-access
+from ancestry_utils import plot_data
+
+
+def _labels(ht, study='TOB-WGS'):
+    metadata = hl.utils.range_table(3)
+    metadata = metadata.key_by(s=hl.str(metadata.idx)).annotate(pop='nfe')
+    return {
+        'study': hl.if_else(ht.s.contains('TOB'), study, 'HGDP/1KG'),
+        'pop': metadata[ht.s].pop,
+    }
+
+
+def _label_keys(labels):
+    return {name: plot_data._expr_key(expr) for name, expr in labels.items()}
+
+
+def test_label_keys_do_not_depend_on_the_session_state():
+    ht = hl.utils.range_table(5)
+    ht = ht.key_by(s=hl.str(ht.idx))
+    first = _label_keys(_labels(ht))
+    # generated field names and error IDs advance with every expression built
+    _labels(ht)
+    assert _label_keys(_labels(ht)) == first
+
+
+def test_label_keys_change_with_the_expressions():
+    ht = hl.utils.range_table(5)
+    ht = ht.key_by(s=hl.str(ht.idx))
+    keys = _label_keys(_labels(ht))
+    changed = _label_keys(_labels(ht, study='TOB'))
+    assert changed['study'] != keys['study']
+    assert changed['pop'] == keys['pop']
+    assert plot_data._cache_path('ht', 'v', keys, 'cache') != plot_data._cache_path(
+        'ht', 'v', changed, 'cache'
+    )